@@ -0,0 +1,363 @@
+import argparse
+import gc
+import importlib
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import cv2
+
+''' Documentation: class Micro_benchmark
+
+    Measures the hot kernels of the extraction and training scripts on
+    synthetic arrays, with no dataset nor weights needed. The kernels are the
+    ones of the code in the tree (URFD and Data_extraction), so it measures
+    whatever they currently are:
+
+    stack: temporal stacks assembly of streams_fextractor.py (Stacks.load,
+    Stacks.stack and Batch.add of a chunk of flows, in batches of 32)
+    mean: flow_mean subtraction of a full batch (Batch.flush, with a model
+    that does nothing)
+    clean: NaN/Inf cleanup of the flow magnitude of optflow_extractor.py
+    (Optflow_extractor.clean_magnitude)
+    rhythm: visual rhythm of every window of a synthetic video, as many as
+    its frames (Visual_Rythm_extractor.profiles and windows)
+    fusion: average of the predictions of the streams of train.py
+    (Train.average_predicteds, the fusion loops of calc_metrics)
+    predict: per-row predictions of result.py (Result.predict) with the
+    classifier of train.py and random weights
+
+    Every kernel runs warmup times and then repeat times, each run on fresh
+    inputs built out of the timing. The median time gives the ops/sec (ops
+    are stacks, flows, windows or rows, see 'unit') and the spread is
+    (max - min) / median. Peak memory is measured by tracemalloc in one more
+    run, so the timings aren't slowed down by it; it sees the numpy and
+    python allocations, not the ones made inside OpenCV.
+
+    Results can be saved in a json file (-save) and compared with a saved
+    baseline (-compare): a kernel whose ops/sec fell more than tolerance
+    below the baseline is a regression, and the script exits with 1.
+
+    A kernel whose module can't be imported (keras, sklearn, ...) is skipped
+    with the reason.
+'''
+
+KERNELS = ['stack', 'mean', 'clean', 'rhythm', 'fusion', 'predict']
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+SEMANTIX_DIR = os.path.dirname(BENCHMARK_DIR)
+
+# Folder of the modules of each kernel
+MODULE_DIRS = {'streams_fextractor': 'URFD', 'train': 'URFD',
+               'result': 'URFD',
+               'optflow_extractor': 'Data_extraction/temporal',
+               'visual_rhythm_extractor': 'Data_extraction/visual'}
+
+class Null_model:
+
+    # Stands for VGG16, so only the work around the forward pass is timed
+    def predict(self, inputs, batch_size=None):
+        return np.zeros(shape=(len(inputs), 1), dtype=np.float32)
+
+class Null_writer:
+
+    def put(self, predictions, targets):
+        pass
+
+class Micro_benchmark:
+
+    def __init__(self, repeat, warmup, scale):
+        self.repeat = repeat
+        self.warmup = warmup
+        self.scale = scale
+        self.x_size = 224
+        self.y_size = 224
+        self.sliding_height = 10
+        self.num_features = 4096
+        self.classes = ['Falls', 'NotFalls']
+        self.streams = ['pose', 'spatial', 'temporal']
+        self.window = 10
+        self.batch_size = 32
+
+        # Amount of ops of each run
+        self.amounts = {'stack': 100, 'mean': 32, 'clean': 4, 'rhythm': 40,
+                        'fusion': 20000, 'predict': 256}
+        self.units = {'stack': 'stacks', 'mean': 'stacks', 'clean': 'flows',
+                      'rhythm': 'windows', 'fusion': 'rows',
+                      'predict': 'rows'}
+
+        self.random = np.random.RandomState(0)
+        self.tmp = tempfile.mkdtemp(prefix='micro_benchmark_')
+
+    def close(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def amount(self, kernel):
+        return max(1, int(self.amounts[kernel] * self.scale))
+
+    def module(self, name):
+        path = os.path.join(SEMANTIX_DIR, MODULE_DIRS[name])
+        if path not in sys.path:
+            sys.path.insert(0, path)
+        return importlib.import_module(name)
+
+    def run(self, kernel):
+
+        # A kernel gives its setup, building the inputs of a run, and its run
+        try:
+            setup, run = getattr(self, 'kernel_' + kernel)(self.amount(kernel))
+        except Exception as error:
+            return {'skipped': type(error).__name__ + ': ' + str(error)}
+
+        times = []
+        for r in range(self.warmup + self.repeat):
+            inputs = setup()
+            gc.collect()
+            begin = time.perf_counter()
+            run(*inputs)
+            if r >= self.warmup:
+                times.append(time.perf_counter() - begin)
+
+        inputs = setup()
+        gc.collect()
+        tracemalloc.start()
+        run(*inputs)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        median = statistics.median(times)
+        return {'unit': self.units[kernel], 'amount': self.amount(kernel),
+                'repeat': self.repeat, 'median': median, 'min': min(times),
+                'max': max(times),
+                'spread': (max(times) - min(times)) / median,
+                'ops_per_sec': self.amount(kernel) / median,
+                'peak_bytes': peak}
+
+    def kernel_stack(self, amount):
+        streams_fextractor = self.module('streams_fextractor')
+
+        # A chunk of flows as Stacks.read gives it
+        flows = self.random.randint(0, 256, size=(self.x_size, self.y_size,
+                    2*(amount + self.sliding_height - 1)), dtype=np.uint8)
+
+        def setup():
+            stacks = streams_fextractor.Stacks(self.x_size, self.y_size,
+                                               self.sliding_height, amount)
+            batch = streams_fextractor.Batch(Null_model(), self.batch_size,
+                                             Null_writer())
+            batch.inputs = np.zeros(shape=(self.batch_size, self.x_size,
+                                    self.y_size, 2*self.sliding_height),
+                                    dtype=np.float32)
+            return stacks, batch
+
+        def run(stacks, batch):
+            stacks.load(flows, amount)
+            for i in range(amount):
+                batch.add(stacks.stack(i), None, None, i, 0)
+
+        return setup, run
+
+    def kernel_mean(self, amount):
+        streams_fextractor = self.module('streams_fextractor')
+
+        flow_mean = self.random.uniform(0, 255, size=(self.x_size,
+                        self.y_size, 2*self.sliding_height)).astype(np.float32)
+        batch = streams_fextractor.Batch(Null_model(), amount, Null_writer(),
+                                         flow_mean)
+        batch.inputs = np.full((amount, self.x_size, self.y_size,
+                                2*self.sliding_height), 128, dtype=np.float32)
+
+        def setup():
+            batch.targets = [None] * amount
+            return (batch,)
+
+        def run(batch):
+            batch.flush()
+
+        return setup, run
+
+    def kernel_clean(self, amount):
+        optflow_extractor = self.module('optflow_extractor')
+        extractor = optflow_extractor.Optflow_extractor([], self.x_size,
+                                                        self.y_size, '.avi')
+
+        # Magnitudes as cartToPolar gives them, with a few NaN and -Inf
+        mags = self.random.uniform(0, 10, size=(amount, self.x_size,
+                                   self.y_size)).astype(np.float32)
+        mags.reshape(-1)[self.random.randint(0, mags.size, 64)] = np.nan
+        mags.reshape(-1)[self.random.randint(0, mags.size, 64)] = -np.inf
+
+        def setup():
+            return (np.copy(mags),)
+
+        def run(mags):
+            for mag in mags:
+                extractor.clean_magnitude(mag)
+
+        return setup, run
+
+    def kernel_rhythm(self, amount):
+        visual_rhythm_extractor = self.module('visual_rhythm_extractor')
+        extractor = visual_rhythm_extractor.Visual_Rythm_extractor([], 1,
+                                                                   'avi')
+
+        video = os.path.join(self.tmp, 'rhythm.avi')
+        writer = cv2.VideoWriter(video, cv2.VideoWriter_fourcc(*'MJPG'), 30,
+                                 (self.y_size, self.x_size))
+        for f in range(max(amount, self.window)):
+            writer.write(self.random.randint(0, 256, size=(self.x_size,
+                         self.y_size, 3), dtype=np.uint8))
+        writer.release()
+
+        path = os.path.join(self.tmp, 'rhythm')
+        os.makedirs(path, exist_ok=True)
+
+        def setup():
+            return ()
+
+        def run():
+            hor, ver, length = extractor.profiles(video)
+            extractor.windows(hor, ver, length, self.window, path)
+
+        return setup, run
+
+    def trainer(self):
+        train = self.module('train')
+        return train.Train(1, 0.0001, list(self.classes), 1, 64, 'benchmark',
+                           True, list(self.streams), 2, 5)
+
+    def kernel_fusion(self, amount):
+        trainer = self.trainer()
+
+        # Softmax outputs of every stream
+        predicteds = self.random.uniform(size=(len(self.streams), amount,
+                                         len(self.classes)))
+        predicteds /= predicteds.sum(axis=2, keepdims=True)
+
+        def setup():
+            return ()
+
+        def run():
+            trainer.average_predicteds(len(self.streams), predicteds, amount)
+
+        return setup, run
+
+    def kernel_predict(self, amount):
+        result = self.module('result')
+        worker = result.Result(list(self.streams), list(self.classes),
+                               'benchmark', 'benchmark')
+        worker.classifier = self.trainer().set_classifier_vgg16()
+
+        features = self.random.uniform(size=(amount, self.num_features)
+                                       ).astype(np.float32)
+
+        def setup():
+            return ()
+
+        def run():
+            worker.predict(features)
+
+        return setup, run
+
+def compare(results, baseline, tolerance):
+
+    # Kernels slower than the baseline by more than tolerance
+    regressions = []
+    for kernel, result in results['kernels'].items():
+        base = baseline['kernels'].get(kernel)
+        if ('skipped' in result or base is None or 'skipped' in base or
+            base['amount'] != result['amount']):
+            print('%-8s no baseline to compare' % kernel, flush=True)
+            continue
+
+        ratio = result['ops_per_sec'] / base['ops_per_sec']
+        memory = result['peak_bytes'] / max(1, base['peak_bytes'])
+        status = 'ok'
+        if ratio < 1 - tolerance:
+            status = 'REGRESSION'
+            regressions.append(kernel)
+        print('%-8s %8.2fx speed %8.2fx peak memory %s' % (kernel, ratio,
+              memory, status), flush=True)
+
+    return regressions
+
+if __name__ == '__main__':
+    print("***********************************************************",
+            file=sys.stderr)
+    print("             SEMANTIX - UNICAMP DATALAB 2018", file=sys.stderr)
+    print("***********************************************************",
+            file=sys.stderr)
+
+    argp = argparse.ArgumentParser(description='Do micro-benchmark tasks')
+    argp.add_argument("-kernels", dest='kernels', type=str, nargs='+',
+            help='Usage: -kernels ' + ' '.join(KERNELS) + ' (default: all)',
+            default=KERNELS, choices=KERNELS, required=False)
+    argp.add_argument("-repeat", dest='repeat', type=int, nargs=1,
+            help='Usage: -repeat <timed_runs_of_each_kernel>',
+            default=[5], required=False)
+    argp.add_argument("-warmup", dest='warmup', type=int, nargs=1,
+            help='Usage: -warmup <untimed_runs_before_the_timed_ones>',
+            default=[1], required=False)
+    argp.add_argument("-scale", dest='scale', type=float, nargs=1,
+            help='Usage: -scale <factor_of_the_amount_of_ops_of_each_run>',
+            default=[1.0], required=False)
+    argp.add_argument("-save", dest='save', type=str, nargs=1,
+            help='Usage: -save <results_json_file>',
+            default=[None], required=False)
+    argp.add_argument("-compare", dest='compare', type=str, nargs=1,
+            help='Usage: -compare <baseline_json_file>',
+            default=[None], required=False)
+    argp.add_argument("-tolerance", dest='tolerance', type=float, nargs=1,
+            help='Usage: -tolerance <x> (0<=x<1, slowdown allowed against '
+                 'the baseline)', default=[0.1], required=False)
+
+    try:
+        args = argp.parse_args()
+    except:
+        argp.print_help(sys.stderr)
+        exit(1)
+
+    baseline = None
+    if args.compare[0] is not None:
+        try:
+            with open(args.compare[0]) as f:
+                baseline = json.load(f)
+        except (OSError, ValueError) as error:
+            print("Baseline " + args.compare[0] + " can't be read: " +
+                  str(error), file=sys.stderr)
+            exit(1)
+
+    benchmark = Micro_benchmark(args.repeat[0], args.warmup[0], args.scale[0])
+    results = {'machine': {'python': platform.python_version(),
+                           'numpy': np.__version__, 'opencv': cv2.__version__,
+                           'processor': platform.processor(),
+                           'cpus': os.cpu_count()},
+               'kernels': dict()}
+    try:
+        for kernel in args.kernels:
+            result = benchmark.run(kernel)
+            results['kernels'][kernel] = result
+            if 'skipped' in result:
+                print('%-8s skipped (%s)' % (kernel, result['skipped']),
+                      flush=True)
+            else:
+                print('%-8s %12.2f %s/sec (median of %d, spread %.1f%%) '
+                      'peak %.1f MB' % (kernel, result['ops_per_sec'],
+                      result['unit'], result['repeat'], 100*result['spread'],
+                      result['peak_bytes'] / 2**20), flush=True)
+    finally:
+        benchmark.close()
+
+    if args.save[0] is not None:
+        with open(args.save[0], 'w') as f:
+            json.dump(results, f, indent=4)
+
+    if baseline is not None:
+        if len(compare(results, baseline, args.tolerance[0])) > 0:
+            exit(1)
@@ -0,0 +1,389 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import h5py
+import numpy as np
+import psutil
+import scipy.io as sio
+import cv2
+
+''' Documentation: class Pipeline_benchmark
+
+    Runs the whole chain of the repo on a synthetic dataset, with no real
+    dataset nor the pre-trained weights needed, to size hardware and to
+    compare releases on a plain CPU box.
+
+    The dataset is generated with cv2.VideoWriter and laid out like URFD:
+    <work>/data/Falls/videoNN/videoNN.avi and <work>/data/NotFalls/...
+    In a Falls video a figure walks and falls, in a NotFalls one it only
+    walks, over a noisy background.
+
+    Then every stage runs, in order, as the scripts of the repo are run by
+    hand, with <work> as working folder:
+
+    generate: the synthetic videos
+    weights: random weight files in the format multi-stream-vgg16.py reads
+    (STACK for temporal, RGB for the others) and a flow_mean.mat
+    models: multi-stream-vgg16.py, VGG16_<stream> of every stream
+    frames: Data_extraction/spatial/get_frame_video.py on every video
+    flow: Data_extraction/temporal/optflow_extractor.py (Farneback)
+    rhythm: Data_extraction/visual/visual_rhythm_extractor.py
+    features: URFD/streams_fextractor.py
+    train: URFD/train.py (cross-train)
+    result: URFD/result.py (max_avg)
+
+    For each stage it reports the wall time, the throughput in videos and
+    frames of the dataset per second and the peak RSS of the stage, which is
+    the largest sum of the RSS of the process running it and its children,
+    sampled every -interval seconds. The output of every script goes to
+    <work>/logs/<stage>.log. A failed stage stops the chain.
+
+    streams_fextractor.py reads the frame_ and flow_ images, which only fit
+    its 224x224 inputs when the videos are 224x224. With any other
+    resolution the features are extracted straight from the videos
+    (-from_video).
+'''
+
+STAGES = ['generate', 'weights', 'models', 'frames', 'flow', 'rhythm',
+          'features', 'train', 'result']
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+SEMANTIX_DIR = os.path.dirname(BENCHMARK_DIR)
+
+VGG16_CONVS = [('block1_conv1', 64), ('block1_conv2', 64),
+               ('block2_conv1', 128), ('block2_conv2', 128),
+               ('block3_conv1', 256), ('block3_conv2', 256),
+               ('block3_conv3', 256), ('block4_conv1', 512),
+               ('block4_conv2', 512), ('block4_conv3', 512),
+               ('block5_conv1', 512), ('block5_conv2', 512),
+               ('block5_conv3', 512)]
+
+class Monitor:
+
+    # Peak RSS of a process and its children, sampled from a thread
+    def __init__(self, pid, interval):
+        self.process = psutil.Process(pid)
+        self.interval = interval
+        self.peak = 0
+        self.running = True
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def sample(self):
+        try:
+            rss = self.process.memory_info().rss
+            for child in self.process.children(recursive=True):
+                try:
+                    rss += child.memory_info().rss
+                except psutil.Error:
+                    pass
+        except psutil.Error:
+            return
+        self.peak = max(self.peak, rss)
+
+    def run(self):
+        while self.running:
+            self.sample()
+            time.sleep(self.interval)
+
+    def stop(self):
+        self.sample()
+        self.running = False
+        self.thread.join()
+        return self.peak
+
+class Pipeline_benchmark:
+
+    def __init__(self, work, videos, frames, x_size, y_size, streams,
+                 epochs, nsplits, interval):
+        self.work = work
+        self.data = os.path.join(work, 'data') + '/'
+        self.logs = os.path.join(work, 'logs')
+        self.classes = ['Falls', 'NotFalls']
+        self.videos = videos
+        self.frames = frames
+        self.x_size = x_size
+        self.y_size = y_size
+        self.streams = sorted(streams)
+        self.epochs = epochs
+        self.nsplits = nsplits
+        self.interval = interval
+        self.id = 'benchmark'
+        self.ext = '.avi'
+        self.sliding_height = 10
+        self.window = 10
+        self.num_features = 4096
+
+        self.random = np.random.RandomState(0)
+        os.makedirs(self.logs, exist_ok=True)
+
+    def run(self, stages):
+
+        results = []
+        for stage in stages:
+            print('### ' + stage, flush=True)
+            monitor = Monitor(os.getpid(), self.interval)
+            begin = time.perf_counter()
+            try:
+                status = getattr(self, 'stage_' + stage)()
+            finally:
+                peak = monitor.stop()
+            wall = time.perf_counter() - begin
+
+            result = {'stage': stage, 'status': status, 'wall': wall,
+                      'videos_per_sec': self.videos / wall,
+                      'frames_per_sec': self.videos * self.frames / wall,
+                      'peak_rss': peak}
+            results.append(result)
+            print('%-9s %-6s %9.2f s %8.2f videos/sec %9.2f frames/sec '
+                  'peak RSS %8.1f MB' % (stage, status, wall,
+                  result['videos_per_sec'], result['frames_per_sec'],
+                  peak / 2**20), flush=True)
+            if status != 'ok':
+                print('### ' + stage + ' failed, see ' + os.path.join(
+                      self.logs, stage + '.log'), flush=True)
+                break
+
+        return results
+
+    def script(self, stage, path, arguments):
+
+        # Scripts run with the working folder as cwd, their peak RSS is part
+        # of the one of the stage, they're children of this process
+        with open(os.path.join(self.logs, stage + '.log'), 'a') as log:
+            code = subprocess.call([sys.executable, os.path.join(
+                                   SEMANTIX_DIR, path)] + arguments,
+                                   cwd=self.work, stdout=log,
+                                   stderr=subprocess.STDOUT)
+        if code != 0:
+            return 'failed'
+        return 'ok'
+
+    def video_paths(self):
+        for c in self.classes:
+            for v in range(self.videos // len(self.classes) + (1 if
+                           self.classes.index(c) < self.videos %
+                           len(self.classes) else 0)):
+                dir = 'video' + str(v).zfill(2)
+                yield c, os.path.join(self.data, c, dir, dir + self.ext)
+
+    def stage_generate(self):
+
+        for c, path in self.video_paths():
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'),
+                                     30, (self.y_size, self.x_size))
+            background = self.random.randint(0, 64, size=(self.x_size,
+                                             self.y_size, 3), dtype=np.uint8)
+            height = self.x_size // 3
+            width = max(2, self.y_size // 12)
+            for f in range(self.frames):
+                frame = np.copy(background)
+                progress = f / max(1, self.frames - 1)
+                x = int(self.y_size * (0.2 + 0.5*progress))
+                y = int(self.x_size * 0.8)
+
+                # The figure falls during the second half of a Falls video
+                angle = 0.0
+                if c == 'Falls' and progress > 0.5:
+                    angle = min(1.0, 4*(progress - 0.5)) * np.pi / 2
+                top = (x + int(height*np.sin(angle)),
+                       y - int(height*np.cos(angle)))
+                cv2.line(frame, (x, y), top, (200, 180, 160), width)
+                cv2.circle(frame, top, width, (220, 200, 180), -1)
+                frame += self.random.randint(0, 16, size=frame.shape,
+                                             dtype=np.uint8)
+                writer.write(frame)
+            writer.release()
+
+        return 'ok'
+
+    def write_weights(self, path, channels):
+
+        # Layout read by multi-stream-vgg16.py: data/<layer>/0 (the kernel,
+        # transposed) and data/<layer>/1 (the bias), He initialized
+        with h5py.File(path, 'w') as h5:
+            data = h5.create_group('data')
+            for layer, filters in VGG16_CONVS:
+                group = data.create_group(layer)
+                std = np.sqrt(2.0 / (9 * channels))
+                group['0'] = (self.random.standard_normal(size=(filters,
+                              channels, 3, 3)) * std).astype(np.float32)
+                group['1'] = np.zeros(shape=(filters,), dtype=np.float32)
+                channels = filters
+
+            inputs = 7 * 7 * channels
+            group = data.create_group('fc6')
+            dataset = group.create_dataset('0', shape=(self.num_features,
+                                           inputs), dtype=np.float32)
+            std = np.sqrt(2.0 / inputs)
+            for row in range(0, self.num_features, 512):
+                dataset[row:row + 512] = (self.random.standard_normal(
+                    size=(min(512, self.num_features - row), inputs)) *
+                    std).astype(np.float32)
+            group['1'] = np.zeros(shape=(self.num_features,),
+                                  dtype=np.float32)
+
+    def stage_weights(self):
+
+        if 'temporal' in self.streams:
+            self.write_weights(os.path.join(self.work, 'weights_STACK.h5'),
+                               2*self.sliding_height)
+            sio.savemat(os.path.join(self.work, 'flow_mean.mat'),
+                        {'image_mean': self.random.uniform(96, 160,
+                         size=(224, 224, 2*self.sliding_height))})
+        if len([s for s in self.streams if s != 'temporal']) > 0:
+            self.write_weights(os.path.join(self.work, 'weights_RGB.h5'), 3)
+
+        return 'ok'
+
+    def stage_models(self):
+
+        weights = []
+        if 'temporal' in self.streams:
+            weights.append('weights_STACK.h5')
+        if len([s for s in self.streams if s != 'temporal']) > 0:
+            weights.append('weights_RGB.h5')
+        return self.script('models', 'multi-stream-vgg16.py',
+                           ['-streams'] + self.streams + ['-weight'] + weights)
+
+    def stage_frames(self):
+
+        for c, path in self.video_paths():
+            if self.script('frames', 'Data_extraction/spatial/'
+                           'get_frame_video.py', ['-video', path]) != 'ok':
+                return 'failed'
+        return 'ok'
+
+    def stage_flow(self):
+        return self.script('flow', 'Data_extraction/temporal/'
+                           'optflow_extractor.py', ['-data', self.data,
+                           '-class'] + self.classes + ['-input_dim', '224',
+                           '224', '-ext', self.ext])
+
+    def stage_rhythm(self):
+        return self.script('rhythm', 'Data_extraction/visual/'
+                           'visual_rhythm_extractor.py', ['-data', self.data,
+                           '-class'] + self.classes + ['-mean', '1',
+                           '-extension', self.ext[1:], '-window',
+                           str(self.window)])
+
+    def stage_features(self):
+
+        arguments = ['-data', self.data, '-streams'] + self.streams + [
+                     '-class'] + self.classes + ['-id', self.id, '-ext',
+                     self.ext, '-profile', os.path.join(self.logs,
+                     'features_profile.json')]
+        if self.x_size != 224 or self.y_size != 224:
+            arguments.append('-from_video')
+        return self.script('features', 'URFD/streams_fextractor.py',
+                           arguments)
+
+    def stage_train(self):
+        return self.script('train', 'URFD/train.py', ['-actions',
+                           'cross-train', '-streams'] + self.streams + [
+                           '-class'] + self.classes + ['-ep',
+                           str(self.epochs), '-lr', '0.0001', '-w0', '1',
+                           '-mini_batch', '64', '-id', self.id, '-batch_norm',
+                           'True', '-fold_norm', '2', '-kfold', 'video',
+                           '-nsplits', str(self.nsplits)])
+
+    def stage_result(self):
+        return self.script('result', 'URFD/result.py', ['-class'] +
+                           self.classes + ['-streams'] + self.streams + [
+                           '-fid', self.id, '-cid', self.id, '-f_classif',
+                           'max_avg'])
+
+if __name__ == '__main__':
+    print("***********************************************************",
+            file=sys.stderr)
+    print("             SEMANTIX - UNICAMP DATALAB 2018", file=sys.stderr)
+    print("***********************************************************",
+            file=sys.stderr)
+
+    argp = argparse.ArgumentParser(description='Do pipeline benchmark tasks')
+    argp.add_argument("-work", dest='work', type=str, nargs=1,
+            help='Usage: -work <working_folder> (default: a temporary one, '
+                 'removed at the end)', default=[None], required=False)
+    argp.add_argument("-videos", dest='videos', type=int, nargs=1,
+            help='Usage: -videos <amount_of_videos> (split between Falls '
+                 'and NotFalls)', default=[8], required=False)
+    argp.add_argument("-frames", dest='frames', type=int, nargs=1,
+            help='Usage: -frames <frames_of_each_video>', default=[40],
+            required=False)
+    argp.add_argument("-size", dest='size', type=int, nargs=2,
+            help='Usage: -size <x_dimension> <y_dimension> (of the videos)',
+            default=[224, 224], required=False)
+    argp.add_argument("-streams", dest='streams', type=str, nargs='+',
+            help='Usage: -streams spatial temporal ritmo',
+            default=['spatial', 'temporal'],
+            choices=['spatial', 'temporal', 'ritmo'], required=False)
+    argp.add_argument("-stages", dest='stages', type=str, nargs='+',
+            help='Usage: -stages ' + ' '.join(STAGES) + ' (default: all, '
+                 'later stages need the outputs of the former ones)',
+            default=STAGES, choices=STAGES, required=False)
+    argp.add_argument("-ep", dest='ep', type=int, nargs=1,
+            help='Usage: -ep <num_of_epochs>', default=[1], required=False)
+    argp.add_argument("-nsplits", dest='nsplits', type=int, nargs=1,
+            help='Usage: -nsplits <K: many splits you want (>1)>',
+            default=[2], required=False)
+    argp.add_argument("-interval", dest='interval', type=float, nargs=1,
+            help='Usage: -interval <seconds_between_RSS_samples>',
+            default=[0.05], required=False)
+    argp.add_argument("-output", dest='output', type=str, nargs=1,
+            help='Usage: -output <results_json_file>', default=[None],
+            required=False)
+
+    try:
+        args = argp.parse_args()
+    except:
+        argp.print_help(sys.stderr)
+        exit(1)
+
+    if args.videos[0] < 2 * args.nsplits[0]:
+        print("At least 2 * nsplits videos are needed to cross-train",
+              file=sys.stderr)
+        exit(1)
+
+    if args.frames[0] <= 10:
+        print("Videos need more frames than a stack of the temporal stream "
+              "(10)", file=sys.stderr)
+        exit(1)
+
+    work = args.work[0]
+    if work is None:
+        work = tempfile.mkdtemp(prefix='pipeline_benchmark_')
+    else:
+        os.makedirs(work, exist_ok=True)
+
+    benchmark = Pipeline_benchmark(os.path.abspath(work), args.videos[0],
+                    args.frames[0], args.size[0], args.size[1], args.streams,
+                    args.ep[0], args.nsplits[0], args.interval[0])
+    try:
+        stages = [stage for stage in STAGES if stage in args.stages]
+        results = benchmark.run(stages)
+    finally:
+        if args.work[0] is None:
+            shutil.rmtree(work, ignore_errors=True)
+
+    if args.output[0] is not None:
+        with open(args.output[0], 'w') as f:
+            json.dump({'machine': {'python': platform.python_version(),
+                       'processor': platform.processor(),
+                       'cpus': os.cpu_count(),
+                       'memory': psutil.virtual_memory().total},
+                       'dataset': {'videos': args.videos[0],
+                       'frames': args.frames[0], 'size': args.size,
+                       'streams': args.streams}, 'stages': results}, f,
+                      indent=4)
+
+    if len(results) == 0 or results[-1]['status'] != 'ok':
+        exit(1)
@@ -8,6 +8,12 @@ import glob
 import h5py
 import cv2
 import gc
+import collections
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, \
+                               as_completed
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+                __file__))))
+from video_reader import Video_reader
 
 
 ''' Documentation: class Frame_extractor
@@ -16,21 +22,52 @@ import gc
 
     extract
     extract_frame
+    extract_video
+    write
 
     extract: calls to extract_frame for it's multiple classes
 
     extract_frame: extracts all video frames and saves them individually.
+    With more than one worker, the videos are extracted in parallel by a
+    pool of processes, one video per process.
+
+    extract_video: decodes a video once, in order (no seek per frame), with
+    Video_reader (Data_extraction/video_reader.py), and hands its frames to
+    a pool of threads that encode and write them, so decoding and encoding
+    overlap. At most 2 * threads frames wait to be
+    written.
+
+    write: writes a frame, resized to 224x224 first if asked for.
+
+    Frame_writer holds the pool of threads of a video: put hands it a frame
+    (and waits while 2 * threads frames are pending), close waits for all
+    of them and gives the amount of frames written. It's also how the
+    frames decoded by Data_extraction/preprocess.py are written.
+
+    Frames are named <prefix>_<number>.jpg, in the folder of the video:
+    depth_ images (the input of monodepth, numbered from 0) or frame_
+    images (the spatial stream, numbered from 1, as get_frame_video.py
+    always did).
 '''
 
+# First number of the images of each prefix
+FIRST = {'depth': 0, 'frame': 1}
+RESIZE = (224, 224)
+
 class Frame_extractor:
 
-    def __init__(self, classes, extension):
+    def __init__(self, classes, extension, prefix='depth', resize=False,
+                 threads=4, workers=1):
         self.classes = classes 
         self.classes_dirs = []
         self.classes_videos = []
         self.fall_dirs = []
         self.class_value = []
         self.extension = extension
+        self.prefix = prefix
+        self.resize = resize
+        self.threads = threads
+        self.workers = workers
 
     def get_dirs(self, data_folder):
 
@@ -57,32 +94,67 @@ class Frame_extractor:
 
     def extract_frame(self, data_folder, videos, dirs, class_):
 
-        for (video, dir) in zip(videos, dirs): 
-            print (":::Video:::")
-            print (video) 
-
-            path = data_folder + class_ +  '/' + dir 
-            cap = cv2.VideoCapture(video)
-
-            length = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-            print( length )
-            #width1 = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))   # float
-            #height1 = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)) # float
-            #print (width1)
-            #print (height1)
-            count = 0
-            for fi in range (0,length):
-                cap.set(1,fi);
-                ret, img = cap.read()
-
-                save_path = path + '/depth_' + str(count).zfill(5) + '.jpg'
-                print (save_path)
-                cv2.imwrite(save_path, img)
-
-                count = count + 1
-
-            cap.release()
-            #cv2.destroyAllWindows()
+        paths = [data_folder + class_ +  '/' + dir for dir in dirs]
+        if self.workers > 1:
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                futures = dict([(executor.submit(self.extract_video, video,
+                               path), video) for (video, path) in 
+                               zip(videos, paths)])
+                for future in as_completed(futures):
+                    print(futures[future] + ': ' + str(future.result()) + 
+                          ' frames', flush=True)
+        else:
+            for (video, path) in zip(videos, paths): 
+                print(video + ': ' + str(self.extract_video(video, path)) +
+                      ' frames', flush=True)
+
+    def extract_video(self, video, path):
+
+        reader = Video_reader(video, threads=1 if self.workers > 1 else 0)
+        writer = Frame_writer(self, path)
+        try:
+            for img in reader.frames():
+                writer.put(img)
+        finally:
+            reader.release()
+        return writer.close()
+
+    def write(self, save_path, img):
+
+        if self.resize:
+            img = cv2.resize(img, RESIZE, interpolation=cv2.INTER_AREA)
+        if not cv2.imwrite(save_path, img):
+            raise IOError("Can't write " + save_path)
+
+class Frame_writer:
+
+    def __init__(self, extractor, path):
+        self.extractor = extractor
+        self.path = path
+        self.count = FIRST[extractor.prefix]
+        self.pending = collections.deque()
+        self.executor = ThreadPoolExecutor(max_workers=extractor.threads)
+
+    def put(self, img):
+
+        save_path = self.path + '/' + self.extractor.prefix + '_' + str(
+                    self.count).zfill(5) + '.jpg'
+        self.pending.append(self.executor.submit(self.extractor.write, 
+                            save_path, img))
+        self.count = self.count + 1
+
+        # Decoding waits for the encoders, frames don't pile up
+        while len(self.pending) > 2 * self.extractor.threads:
+            self.pending.popleft().result()
+
+    def close(self):
+
+        try:
+            while len(self.pending) > 0:
+                self.pending.popleft().result()
+        finally:
+            self.executor.shutdown()
+        return self.count - FIRST[self.extractor.prefix]
                              
 
 if __name__ == '__main__':
@@ -104,6 +176,24 @@ if __name__ == '__main__':
             help='Usage: -extension <video_extension_type>',
             required=True)
 
+    argp.add_argument("-prefix", dest='prefix', type=str, nargs=1,
+            choices=list(FIRST.keys()),
+            help='Usage: -prefix <depth | frame> (depth_ images for \
+                  monodepth, frame_ images for the spatial stream)',
+            required=False, default=['depth'])
+
+    argp.add_argument("-resize", dest='resize', action='store_true',
+            help='Usage: -resize (frames are written at 224x224)',
+            required=False)
+
+    argp.add_argument("-threads", dest='threads', type=int, nargs=1,
+            help='Usage: -threads <encoding_threads_per_video>',
+            required=False, default=[4])
+
+    argp.add_argument("-workers", dest='workers', type=int, nargs=1,
+            help='Usage: -workers <videos_extracted_in_parallel>',
+            required=False, default=[1])
+
    
     try:
         args = argp.parse_args()
@@ -111,7 +201,9 @@ if __name__ == '__main__':
         argp.print_help(sys.stderr)
         exit(1)
 
-    fr_extractor = Frame_extractor(args.classes, args.extension[0])
+    fr_extractor = Frame_extractor(args.classes, args.extension[0],
+                                   args.prefix[0], args.resize, 
+                                   args.threads[0], args.workers[0])
     fr_extractor.extract(args.data_folder[0])
     print ("done")
 
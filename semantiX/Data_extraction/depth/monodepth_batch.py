@@ -0,0 +1,411 @@
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import collections
+import glob
+import os
+import sys
+import time
+import numpy as np
+import cv2
+from concurrent.futures import ThreadPoolExecutor
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+                __file__))))
+from video_reader import Video_reader
+
+''' Documentation: class Depth_estimator
+
+    Runs monodepth on many images with a single graph and session, instead
+    of the one process per image of monodepth_simple.py.
+
+    The methods are:
+
+    estimate
+    estimate_files
+
+    estimate: the disparities of a list of BGR frames (as cv2 decodes
+    them). Frames are resized to the input of the model and run by batches
+    of batch_size, each frame with its mirror image, and the pairs of the
+    whole batch are post processed at once (post_process_disparities).
+
+    estimate_files: the disparities of image files, batch by batch. The
+    files are read by the tf.data pipeline of MonodepthDataloader (mode
+    'images'), decoded and resized by parallel calls and prefetched while
+    the model runs, as monodepth_main.py reads its test images.
+
+    tensorflow is only imported when a Depth_estimator is created, the
+    checkpoint is restored once.
+'''
+
+''' Documentation: class Depth_writer
+
+    Writes the depth_ images of the disparities of a batch, with no
+    matplotlib (plt.imsave) in the way:
+
+    write: the disparities of a batch are resized together (one cv2.resize
+    of a stack of them) to 224x224, or the size given, quantized together
+    and handed to a pool of threads that encode them. At most 2 * threads
+    images wait to be written.
+
+    close: waits for the images pending.
+
+    format is one of:
+
+    plasma: the colors plt.imsave(..., cmap='plasma') wrote, each image
+    scaled to its own min and max, looked up in a 256 entry table of the
+    colormap computed once (COLORMAP_PLASMA of OpenCV, or of matplotlib in
+    builds without it). depth_<n>.jpg, what the depth stream reads.
+    gray: the same scaled values as a single channel uint8 image,
+    depth_<n>.jpg.
+    gray16: the disparity itself, not scaled per image, as uint16 where
+    65535 is DISP_MAX, the largest disparity monodepth gives.
+    depth_<n>.png, as jpeg has no 16 bits.
+'''
+
+''' Documentation: class Depth_extractor
+
+    The batch depth mode: the depth_ images of a whole dataset (laid out as
+    <data>/<class>/<video>/) with a single Depth_estimator, written by a
+    Depth_writer.
+
+    extract: calls to extract_class for it's multiple classes
+
+    extract_class: extracts the depth of every folder of a class.
+
+    extract_folder: the depth of the frame_ images of a folder, depth_<n>
+    for frame_<n>, or, with from_video, of the frames decoded from its
+    video, numbered from 0 as frame_extractor.py numbers depth_ images.
+    With from_video, the next batch is decoded by a thread while the
+    current one runs.
+'''
+
+# Side of the depth_ images, the input of the depth stream
+DEPTH_SIZE = (224, 224)
+
+# Number of the first depth_ image of a video, as in frame_extractor.py
+FIRST = 0
+
+FORMATS = ['plasma', 'gray', 'gray16']
+
+# Largest disparity of monodepth (0.3 * sigmoid), the 65535 of gray16
+DISP_MAX = 0.3
+
+# Channels cv2.resize takes at once
+RESIZE_CHANNELS = 512
+
+# Masks of post_process_disparities, by (height, width)
+MASKS = dict()
+
+class Depth_estimator:
+
+    def __init__(self, checkpoint_path, encoder='vgg', input_height=256,
+                 input_width=512, batch_size=8, num_threads=4):
+        import tensorflow as tf
+        from monodepth_model import MonodepthModel, monodepth_parameters
+        from monodepth_dataloader import MonodepthDataloader
+
+        self.input_height = input_height
+        self.input_width = input_width
+        self.batch_size = batch_size
+
+        params = monodepth_parameters(
+            encoder=encoder,
+            height=input_height,
+            width=input_width,
+            batch_size=batch_size,
+            num_threads=num_threads,
+            num_epochs=1,
+            do_stereo=False,
+            wrap_mode="border",
+            use_deconv=False,
+            alpha_image_loss=0,
+            disp_gradient_loss_weight=0,
+            lr_loss_weight=0,
+            full_summary=False)
+
+        # Images come from the dataloader, unless frames are fed
+        self.files = tf.placeholder(tf.string, [None])
+        dataloader = MonodepthDataloader('', self.files, params, None,
+                                         'images')
+        self.initializer = dataloader.initializer
+        self.out_of_range = tf.errors.OutOfRangeError
+        self.left = tf.placeholder_with_default(dataloader.left_image_batch,
+                    [None, input_height, input_width, 3])
+        self.model = MonodepthModel(params, "test", self.left, None)
+
+        config = tf.ConfigProto(allow_soft_placement=True)
+        self.sess = tf.Session(config=config)
+        train_saver = tf.train.Saver()
+        self.sess.run(tf.global_variables_initializer())
+        self.sess.run(tf.local_variables_initializer())
+        train_saver.restore(self.sess, checkpoint_path.split(".")[0])
+
+    def estimate(self, frames):
+
+        disparities = []
+        for begin in range(0, len(frames), self.batch_size):
+            batch = frames[begin:begin + self.batch_size]
+            images = np.empty(shape=(2*len(batch), self.input_height,
+                              self.input_width, 3), dtype=np.float32)
+            for i, img in enumerate(batch):
+                img = cv2.resize(img, (self.input_width, self.input_height),
+                                 interpolation=cv2.INTER_LANCZOS4)
+                images[2*i] = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+            images[0::2] /= 255
+            images[1::2] = images[0::2, :, ::-1]
+
+            disp = self.sess.run(self.model.disp_left_est[0],
+                                 feed_dict={self.left: images})
+            disparities.extend(post_process_disparities(disp.reshape(-1, 2,
+                               self.input_height, self.input_width)))
+        return disparities
+
+    def estimate_files(self, files):
+
+        self.sess.run(self.initializer, feed_dict={self.files: files})
+        while True:
+            try:
+                disp = self.sess.run(self.model.disp_left_est[0])
+            except self.out_of_range:
+                break
+            yield post_process_disparities(disp.reshape(-1, 2,
+                                           self.input_height,
+                                           self.input_width))
+
+class Depth_writer:
+
+    def __init__(self, format='plasma', size=DEPTH_SIZE, threads=4):
+        self.format = format
+        self.size = size
+        self.threads = threads
+        self.extension = '.png' if format == 'gray16' else '.jpg'
+        self.lut = plasma_lut() if format == 'plasma' else None
+        self.pending = collections.deque()
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+
+    def write(self, names, disparities):
+
+        # names without the extension, depth_<n>
+        for name, img in zip(names, self.render(disparities)):
+            self.pending.append(self.executor.submit(self.encode, name +
+                                self.extension, img))
+        while len(self.pending) > 2 * self.threads:
+            self.pending.popleft().result()
+
+    def render(self, disparities):
+
+        disps = np.asarray(disparities, dtype=np.float32)
+        if len(disps) == 0:
+            return disps
+        width, height = self.size
+        resized = np.empty(shape=(len(disps), height, width),
+                           dtype=np.float32)
+        for begin in range(0, len(disps), RESIZE_CHANNELS):
+            stack = disps[begin:begin + RESIZE_CHANNELS].transpose(1, 2, 0)
+            stack = cv2.resize(np.ascontiguousarray(stack), (width, height),
+                               interpolation=cv2.INTER_LINEAR)
+            resized[begin:begin + RESIZE_CHANNELS] = stack.reshape(height,
+                                width, -1).transpose(2, 0, 1)
+
+        if self.format == 'gray16':
+            return np.clip(np.rint(resized * (65535 / DISP_MAX)), 0,
+                           65535).astype(np.uint16)
+
+        # Scaled to the min and max of each image, indexed as a colormap of
+        # 256 colors indexes [0, 1]
+        low = resized.min(axis=(1, 2), keepdims=True)
+        high = resized.max(axis=(1, 2), keepdims=True)
+        scaled = (resized - low) * (256 / np.maximum(high - low, 1e-12))
+        levels = np.minimum(scaled, 255).astype(np.uint8)
+        if self.format == 'gray':
+            return levels
+        return self.lut[levels]
+
+    def encode(self, save_path, img):
+
+        if not cv2.imwrite(save_path, img):
+            raise IOError("Can't write " + save_path)
+
+    def close(self):
+
+        try:
+            while len(self.pending) > 0:
+                self.pending.popleft().result()
+        finally:
+            self.executor.shutdown()
+
+class Depth_extractor:
+
+    def __init__(self, estimator, writer, classes, ext=None,
+                 from_video=False):
+        self.estimator = estimator
+        self.writer = writer
+        self.classes = classes
+        self.ext = ext
+        self.from_video = from_video
+        self.classes_dirs = []
+
+    def extract(self, data_folder):
+
+        self.get_dirs(data_folder)
+
+        try:
+            for i in range(len(self.classes)):
+                self.extract_class(data_folder, self.classes_dirs[i],
+                                   self.classes[i])
+        finally:
+            self.writer.close()
+
+    def extract_class(self, data_folder, dirs, class_):
+
+        print(class_ + ': ' + str(len(dirs)) + ' videos', flush=True)
+        begin = time.perf_counter()
+        images = 0
+        for dir in dirs:
+            path = data_folder + class_ + '/' + dir
+            amount = self.extract_folder(path, path + '/' + dir +
+                                         str(self.ext))
+            print(path + ': ' + str(amount) + ' depths', flush=True)
+            images += amount
+
+        seconds = time.perf_counter() - begin
+        print(class_ + ': ' + str(images) + ' depths in ' +
+              "{0:.1f}s ({1:.1f} images/sec)".format(seconds, images /
+              max(seconds, 1e-9)), flush=True)
+
+    def extract_folder(self, path, video):
+
+        if not self.from_video:
+            files = sorted(glob.glob(path + '/frame_*.jpg'))
+            names = [path + '/depth_' + f[f.rindex('_') + 1:-4] for f in 
+                     files]
+            begin = 0
+            for disparities in self.estimator.estimate_files(files):
+                self.writer.write(names[begin:begin + len(disparities)],
+                                  disparities)
+                begin += len(disparities)
+            return len(files)
+
+        batch_size = self.estimator.batch_size
+        reader = Video_reader(video)
+        frames = reader.frames()
+        def load():
+            batch = []
+            for frame in frames:
+                batch.append(frame)
+                if len(batch) == batch_size:
+                    break
+            return batch
+
+        amount = 0
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            loading = executor.submit(load)
+            while True:
+                batch = loading.result()
+                if len(batch) == 0:
+                    break
+                loading = executor.submit(load)
+
+                names = [path + '/depth_' + str(FIRST + amount + i).zfill(5)
+                         for i in range(len(batch))]
+                self.writer.write(names, self.estimator.estimate(batch))
+                amount += len(batch)
+
+        reader.release()
+        return amount
+
+    def get_dirs(self, data_folder):
+
+        for c in self.classes:
+            self.classes_dirs.append([f for f in os.listdir(data_folder + c)
+                        if os.path.isdir(os.path.join(data_folder, c, f))])
+            self.classes_dirs[-1].sort()
+
+def plasma_lut():
+
+    # BGR color of each of the 256 levels, as cv2.imwrite takes them
+    levels = np.arange(256, dtype=np.uint8).reshape(256, 1)
+    if hasattr(cv2, 'COLORMAP_PLASMA'):
+        return cv2.applyColorMap(levels, cv2.COLORMAP_PLASMA).reshape(256, 3)
+    import matplotlib.cm
+    rgba = matplotlib.cm.get_cmap('plasma', 256)(levels.ravel())
+    return np.rint(rgba[:, 2::-1] * 255).astype(np.uint8)
+
+def post_process_disparities(disps):
+
+    # post_process_disparity of monodepth_simple.py on a whole batch, disps
+    # of shape (batch, 2, h, w), with the masks of each size computed once
+    _, _, h, w = disps.shape
+    if (h, w) not in MASKS:
+        l, _ = np.meshgrid(np.linspace(0, 1, w), np.linspace(0, 1, h))
+        l_mask = 1.0 - np.clip(20 * (l - 0.05), 0, 1)
+        r_mask = np.fliplr(l_mask)
+        MASKS[(h, w)] = (r_mask.astype(np.float32), l_mask.astype(np.float32),
+                         (1.0 - l_mask - r_mask).astype(np.float32))
+    r_mask, l_mask, m_mask = MASKS[(h, w)]
+
+    l_disp = disps[:, 0]
+    r_disp = disps[:, 1, :, ::-1]
+    m_disp = 0.5 * (l_disp + r_disp)
+    return r_mask * l_disp + l_mask * r_disp + m_mask * m_disp
+
+if __name__ == '__main__':
+    print("***********************************************************",
+            file=sys.stderr)
+    print("             SEMANTIX - UNICAMP DATALAB 2018", file=sys.stderr)
+    print("***********************************************************",
+            file=sys.stderr)
+    argp = argparse.ArgumentParser(description='Do depth extraction tasks')
+    argp.add_argument("-data", dest='data_folder', type=str, nargs=1,
+            help='Usage: -data <path_to_your_data_folder>', required=True)
+    argp.add_argument("-class", dest='classes', type=str, nargs='+',
+            help='Usage: -class <class0_name> <class1_name>..<n-th_class_name>',
+            required=True)
+    argp.add_argument("-checkpoint_path", dest='checkpoint_path', type=str,
+            nargs=1, help='Usage: -checkpoint_path <monodepth_checkpoint>',
+            required=True)
+    argp.add_argument("-encoder", dest='encoder', type=str, nargs=1,
+            help='Usage: -encoder <vgg | resnet50>', required=False,
+            default=['vgg'])
+    argp.add_argument("-depth_dim", dest='depth_dim', type=int, nargs=2,
+            help='Usage: -depth_dim <input_height> <input_width> (of \
+                  monodepth)', required=False, default=[256, 512])
+    argp.add_argument("-batch_size", dest='batch_size', type=int, nargs=1,
+            help='Usage: -batch_size <frames_per_monodepth_run>',
+            required=False, default=[8])
+    argp.add_argument("-num_threads", dest='num_threads', type=int, nargs=1,
+            help='Usage: -num_threads <images_decoded_in_parallel>',
+            required=False, default=[4])
+    argp.add_argument("-depth_format", dest='depth_format', type=str,
+            nargs=1, choices=FORMATS,
+            help='Usage: -depth_format <' + ' | '.join(FORMATS) + 
+                 '> (default: plasma)', required=False, default=['plasma'])
+    argp.add_argument("-write_threads", dest='write_threads', type=int,
+            nargs=1, help='Usage: -write_threads <encoding_threads>',
+            required=False, default=[4])
+    argp.add_argument("-from_video", dest='from_video', action='store_true',
+            help='Usage: -from_video (depth of the frames of the videos, \
+                  not of the frame_ images)', required=False)
+    argp.add_argument("-ext", dest='ext', type=str, nargs=1,
+            help='Usage: -ext <file_extension> .mp4 | .avi | ... (with \
+                  -from_video)', required=False, default=[None])
+
+    try:
+        args = argp.parse_args()
+    except:
+        argp.print_help(sys.stderr)
+        exit(1)
+
+    if args.from_video and args.ext[0] is None:
+        print("-from_video needs the -ext of the videos", file=sys.stderr)
+        exit(1)
+
+    estimator = Depth_estimator(args.checkpoint_path[0], args.encoder[0],
+                                args.depth_dim[0], args.depth_dim[1],
+                                args.batch_size[0], args.num_threads[0])
+    writer = Depth_writer(args.depth_format[0], DEPTH_SIZE,
+                          args.write_threads[0])
+    depth_extractor = Depth_extractor(estimator, writer, args.classes,
+                                      args.ext[0], args.from_video)
+    depth_extractor.extract(args.data_folder[0])
+    print ("done")
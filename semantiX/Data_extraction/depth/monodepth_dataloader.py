@@ -16,10 +16,26 @@ import tensorflow as tf
 def string_length_tf(t):
   return tf.py_func(len, [t], [tf.int64])
 
+# Batches (or test pairs) decoded ahead of the model
+PREFETCH = 2
+
 class MonodepthDataloader(object):
-    """monodepth dataloader"""
+    """monodepth dataloader
+
+    A tf.data pipeline: the lines of filenames_file are decoded, resized
+    and, for training, augmented by num_threads parallel calls, and the
+    batches are prefetched while the model runs.
+
+    mode 'images' is the batch depth mode: filenames_file is a 1-D string
+    tensor of image paths, left_image_batch holds each image followed by its
+    mirror image (2 * batch_size images) and initializer starts the pass
+    over the paths fed.
+
+    With num_shards, the loader only reads the lines shard_index,
+    shard_index + num_shards..., the input of one training replica.
+    """
 
-    def __init__(self, data_path, filenames_file, params, dataset, mode):
+    def __init__(self, data_path, filenames_file, params, dataset, mode, num_shards=1, shard_index=0):
         self.data_path = data_path
         self.params = params
         self.dataset = dataset
@@ -27,49 +43,77 @@ class MonodepthDataloader(object):
 
         self.left_image_batch  = None
         self.right_image_batch = None
+        self.initializer = None
 
-        input_queue = tf.train.string_input_producer([filenames_file], shuffle=False)
-        line_reader = tf.TextLineReader()
-        _, line = line_reader.read(input_queue)
-
-        split_line = tf.string_split([line]).values
-
-        # we load only one image for test, except if we trained a stereo model
-        if mode == 'test' and not self.params.do_stereo:
-            left_image_path  = tf.string_join([self.data_path, split_line[0]])
-            left_image_o  = self.read_image(left_image_path)
+        if mode == 'images':
+            lines = tf.data.Dataset.from_tensor_slices(filenames_file)
         else:
-            left_image_path  = tf.string_join([self.data_path, split_line[0]])
-            right_image_path = tf.string_join([self.data_path, split_line[1]])
-            left_image_o  = self.read_image(left_image_path)
-            right_image_o = self.read_image(right_image_path)
+            lines = tf.data.TextLineDataset(filenames_file)
+        if num_shards > 1:
+            lines = lines.shard(num_shards, shard_index)
 
         if mode == 'train':
-            # randomly flip images
-            do_flip = tf.random_uniform([], 0, 1)
-            left_image  = tf.cond(do_flip > 0.5, lambda: tf.image.flip_left_right(right_image_o), lambda: left_image_o)
-            right_image = tf.cond(do_flip > 0.5, lambda: tf.image.flip_left_right(left_image_o),  lambda: right_image_o)
-
-            # randomly augment images
-            do_augment  = tf.random_uniform([], 0, 1)
-            left_image, right_image = tf.cond(do_augment > 0.5, lambda: self.augment_image_pair(left_image, right_image), lambda: (left_image, right_image))
-
-            left_image.set_shape( [None, None, 3])
-            right_image.set_shape([None, None, 3])
-
-            # capacity = min_after_dequeue + (num_threads + a small safety margin) * batch_size
+            # the buffer the shuffle_batch queue used to keep
             min_after_dequeue = 2048
-            capacity = min_after_dequeue + 4 * params.batch_size
-            self.left_image_batch, self.right_image_batch = tf.train.shuffle_batch([left_image, right_image],
-                        params.batch_size, capacity, min_after_dequeue, params.num_threads)
+            pairs = lines.shuffle(min_after_dequeue).repeat()
+            pairs = pairs.map(self.parse_train, num_parallel_calls=params.num_threads)
+            pairs = pairs.batch(params.batch_size).prefetch(PREFETCH)
+            iterator = pairs.make_one_shot_iterator()
+            self.left_image_batch, self.right_image_batch = iterator.get_next()
+            self.left_image_batch.set_shape( [params.batch_size, params.height, params.width, 3])
+            self.right_image_batch.set_shape([params.batch_size, params.height, params.width, 3])
 
         elif mode == 'test':
-            self.left_image_batch = tf.stack([left_image_o,  tf.image.flip_left_right(left_image_o)],  0)
-            self.left_image_batch.set_shape( [2, None, None, 3])
-
+            pairs = lines.map(self.parse_test, num_parallel_calls=params.num_threads)
+            pairs = pairs.prefetch(PREFETCH * params.num_threads)
+            iterator = pairs.make_one_shot_iterator()
             if self.params.do_stereo:
-                self.right_image_batch = tf.stack([right_image_o,  tf.image.flip_left_right(right_image_o)],  0)
+                self.left_image_batch, self.right_image_batch = iterator.get_next()
                 self.right_image_batch.set_shape( [2, None, None, 3])
+            else:
+                self.left_image_batch = iterator.get_next()
+            self.left_image_batch.set_shape( [2, None, None, 3])
+
+        elif mode == 'images':
+            pairs = lines.map(self.parse_image, num_parallel_calls=params.num_threads)
+            pairs = pairs.batch(params.batch_size).prefetch(PREFETCH)
+            iterator = pairs.make_initializable_iterator()
+            self.initializer = iterator.initializer
+            self.left_image_batch = tf.reshape(iterator.get_next(), [-1, params.height, params.width, 3])
+
+    def parse_train(self, line):
+        split_line = tf.string_split([line]).values
+        left_image_o  = self.read_image(tf.string_join([self.data_path, split_line[0]]))
+        right_image_o = self.read_image(tf.string_join([self.data_path, split_line[1]]))
+
+        # randomly flip images
+        do_flip = tf.random_uniform([], 0, 1)
+        left_image  = tf.cond(do_flip > 0.5, lambda: tf.image.flip_left_right(right_image_o), lambda: left_image_o)
+        right_image = tf.cond(do_flip > 0.5, lambda: tf.image.flip_left_right(left_image_o),  lambda: right_image_o)
+
+        # randomly augment images
+        do_augment  = tf.random_uniform([], 0, 1)
+        left_image, right_image = tf.cond(do_augment > 0.5, lambda: self.augment_image_pair(left_image, right_image), lambda: (left_image, right_image))
+
+        left_image.set_shape( [None, None, 3])
+        right_image.set_shape([None, None, 3])
+        return left_image, right_image
+
+    def parse_test(self, line):
+        # we load only one image for test, except if we trained a stereo model
+        split_line = tf.string_split([line]).values
+        left_image_o = self.read_image(tf.string_join([self.data_path, split_line[0]]))
+        left_image = tf.stack([left_image_o,  tf.image.flip_left_right(left_image_o)],  0)
+        if not self.params.do_stereo:
+            return left_image
+
+        right_image_o = self.read_image(tf.string_join([self.data_path, split_line[1]]))
+        right_image = tf.stack([right_image_o,  tf.image.flip_left_right(right_image_o)],  0)
+        return left_image, right_image
+
+    def parse_image(self, image_path):
+        image = self.read_image(image_path)
+        return tf.stack([image, tf.image.flip_left_right(image)], 0)
 
     def augment_image_pair(self, left_image, right_image):
         # randomly shift gamma
@@ -96,12 +140,9 @@ class MonodepthDataloader(object):
         return left_image_aug, right_image_aug
 
     def read_image(self, image_path):
-        # tf.decode_image does not return the image size, this is an ugly workaround to handle both jpeg and png
-        path_length = string_length_tf(image_path)[0]
-        file_extension = tf.substr(image_path, path_length - 3, 3)
-        file_cond = tf.equal(file_extension, 'jpg')
-        
-        image  = tf.cond(file_cond, lambda: tf.image.decode_jpeg(tf.read_file(image_path)), lambda: tf.image.decode_png(tf.read_file(image_path)))
+        # tf.decode_image does not return the image size, the magic number of the file tells jpeg from png
+        contents = tf.read_file(image_path)
+        image  = tf.cond(tf.image.is_jpeg(contents), lambda: tf.image.decode_jpeg(contents, channels=3), lambda: tf.image.decode_png(contents, channels=3))
 
         # if the dataset is cityscapes, we crop the last fifth to remove the car hood
         if self.dataset == 'cityscapes':
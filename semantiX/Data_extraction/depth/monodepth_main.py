@@ -26,7 +26,7 @@ from average_gradients import *
 
 parser = argparse.ArgumentParser(description='Monodepth TensorFlow implementation.')
 
-parser.add_argument('--mode',                      type=str,   help='train or test', default='train')
+parser.add_argument('--mode',                      type=str,   help='train, test or scaling', default='train')
 parser.add_argument('--model_name',                type=str,   help='model name', default='monodepth')
 parser.add_argument('--encoder',                   type=str,   help='type of encoder, vgg or resnet50', default='vgg')
 parser.add_argument('--dataset',                   type=str,   help='dataset to train on, kitti, or cityscapes', default='kitti')
@@ -44,6 +44,10 @@ parser.add_argument('--do_stereo',                             help='if set, wil
 parser.add_argument('--wrap_mode',                 type=str,   help='bilinear sampler wrap mode, edge or border', default='border')
 parser.add_argument('--use_deconv',                            help='if set, will use transposed convolutions', action='store_true')
 parser.add_argument('--num_gpus',                  type=int,   help='number of GPUs to use for training', default=1)
+parser.add_argument('--num_replicas',              type=int,   help='number of CPU replicas to train with, each on its own shard of the data', default=1)
+parser.add_argument('--intra_op_threads',          type=int,   help='threads each op of the replicas can use, 0 for all the cores', default=0)
+parser.add_argument('--scaling_replicas',          type=int,   help='replica counts timed by the scaling mode', nargs='+', default=[1, 2, 4])
+parser.add_argument('--scaling_steps',             type=int,   help='steps timed for each replica count by the scaling mode', default=20)
 parser.add_argument('--num_threads',               type=int,   help='number of threads to use for data loading', default=8)
 parser.add_argument('--output_directory',          type=str,   help='output directory for test disparities, if empty outputs to checkpoint folder', default='')
 parser.add_argument('--log_directory',             type=str,   help='directory to save checkpoints and summaries', default='')
@@ -69,6 +73,65 @@ def count_text_lines(file_path):
     f.close()
     return len(lines)
 
+def replica_devices(num_replicas):
+    """Devices of the towers: a CPU device per replica, or the GPUs."""
+    if num_replicas > 1:
+        return ['/cpu:%d' % i for i in range(num_replicas)]
+    return ['/gpu:%d' % i for i in range(args.num_gpus)]
+
+def session_config(num_replicas):
+    """Session with a CPU device per replica, whose towers run concurrently."""
+    if num_replicas > 1:
+        return tf.ConfigProto(allow_soft_placement=True,
+                              device_count={'CPU': num_replicas},
+                              inter_op_parallelism_threads=2 * num_replicas,
+                              intra_op_parallelism_threads=args.intra_op_threads)
+    return tf.ConfigProto(allow_soft_placement=True)
+
+def build_towers(params, opt_step, num_replicas):
+    """Towers of the model, one per device, and their averaged gradients.
+
+    CPU replicas read their own shard of the data, batch_size / num_replicas
+    images each, the GPU towers split a single batch.
+    """
+    devices = replica_devices(num_replicas)
+    if len(devices) > 1 and params.batch_size % len(devices) != 0:
+        raise ValueError('batch_size {} is not divisible by the {} towers'.format(params.batch_size, len(devices)))
+
+    if num_replicas > 1:
+        replica_params = params._replace(batch_size=params.batch_size // num_replicas)
+        dataloaders = [MonodepthDataloader(args.data_path, args.filenames_file, replica_params, args.dataset, 'train', num_replicas, i) for i in range(num_replicas)]
+        left_splits  = [dataloader.left_image_batch  for dataloader in dataloaders]
+        right_splits = [dataloader.right_image_batch for dataloader in dataloaders]
+    else:
+        dataloader = MonodepthDataloader(args.data_path, args.filenames_file, params, args.dataset, 'train')
+        left  = dataloader.left_image_batch
+        right = dataloader.right_image_batch
+
+        # split for each gpu
+        left_splits  = tf.split(left,  len(devices), 0)
+        right_splits = tf.split(right, len(devices), 0)
+
+    tower_grads  = []
+    tower_losses = []
+    reuse_variables = None
+    with tf.variable_scope(tf.get_variable_scope()):
+        for i in range(len(devices)):
+            with tf.device(devices[i]):
+
+                model = MonodepthModel(params, 'train', left_splits[i], right_splits[i], reuse_variables, i)
+
+                loss = model.total_loss
+                tower_losses.append(loss)
+
+                reuse_variables = True
+
+                grads = opt_step.compute_gradients(loss)
+
+                tower_grads.append(grads)
+
+    return average_gradients(tower_grads), tf.reduce_mean(tower_losses)
+
 def train(params):
     """Training loop."""
 
@@ -91,45 +154,19 @@ def train(params):
 
         print("total number of samples: {}".format(num_training_samples))
         print("total number of steps: {}".format(num_total_steps))
+        if args.num_replicas > 1:
+            print("CPU replicas: {}, {} images each per step".format(args.num_replicas, params.batch_size // args.num_replicas))
 
-        dataloader = MonodepthDataloader(args.data_path, args.filenames_file, params, args.dataset, args.mode)
-        left  = dataloader.left_image_batch
-        right = dataloader.right_image_batch
-
-        # split for each gpu
-        left_splits  = tf.split(left,  args.num_gpus, 0)
-        right_splits = tf.split(right, args.num_gpus, 0)
-
-        tower_grads  = []
-        tower_losses = []
-        reuse_variables = None
-        with tf.variable_scope(tf.get_variable_scope()):
-            for i in range(args.num_gpus):
-                with tf.device('/gpu:%d' % i):
-
-                    model = MonodepthModel(params, args.mode, left_splits[i], right_splits[i], reuse_variables, i)
-
-                    loss = model.total_loss
-                    tower_losses.append(loss)
-
-                    reuse_variables = True
-
-                    grads = opt_step.compute_gradients(loss)
-
-                    tower_grads.append(grads)
-
-        grads = average_gradients(tower_grads)
+        grads, total_loss = build_towers(params, opt_step, args.num_replicas)
 
         apply_gradient_op = opt_step.apply_gradients(grads, global_step=global_step)
 
-        total_loss = tf.reduce_mean(tower_losses)
-
         tf.summary.scalar('learning_rate', learning_rate, ['model_0'])
         tf.summary.scalar('total_loss', total_loss, ['model_0'])
         summary_op = tf.summary.merge_all('model_0')
 
         # SESSION
-        config = tf.ConfigProto(allow_soft_placement=True)
+        config = session_config(args.num_replicas)
         sess = tf.Session(config=config)
 
         # SAVER
@@ -145,8 +182,6 @@ def train(params):
         # INIT
         sess.run(tf.global_variables_initializer())
         sess.run(tf.local_variables_initializer())
-        coordinator = tf.train.Coordinator()
-        threads = tf.train.start_queue_runners(sess=sess, coord=coordinator)
 
         # LOAD CHECKPOINT IF SET
         if args.checkpoint_path != '':
@@ -167,6 +202,8 @@ def train(params):
                 time_sofar = (time.time() - start_time) / 3600
                 training_time_left = (num_total_steps / step - 1.0) * time_sofar
                 print_string = 'batch {:>6} | examples/s: {:4.2f} | loss: {:.5f} | time elapsed: {:.2f}h | time left: {:.2f}h'
+                if args.num_replicas > 1:
+                    print_string += ' | examples/s per replica: {:4.2f}'.format(examples_per_sec / args.num_replicas)
                 print(print_string.format(step, examples_per_sec, loss_value, time_sofar, training_time_left))
                 summary_str = sess.run(summary_op)
                 summary_writer.add_summary(summary_str, global_step=step)
@@ -175,6 +212,49 @@ def train(params):
 
         train_saver.save(sess, args.log_directory + '/' + args.model_name + '/model', global_step=num_total_steps)
 
+        if num_total_steps > start_step:
+            examples_per_sec = (num_total_steps - start_step) * params.batch_size / (time.time() - start_time)
+            print('examples/s: {:4.2f} over the whole training, with {} replica(s)'.format(examples_per_sec, args.num_replicas))
+
+def scaling(params):
+    """Examples/s of training with each of the replica counts of --scaling_replicas.
+
+    The batch is the same for every count, split across the replicas, so a
+    count with a perfect scaling is count times as fast as a single replica.
+    The efficiency is the speedup over the first count divided by the ratio
+    of the counts. Nothing is saved.
+    """
+
+    results = []
+    for num_replicas in args.scaling_replicas:
+        with tf.Graph().as_default(), tf.device('/cpu:0'):
+            opt_step = tf.train.AdamOptimizer(args.learning_rate)
+            grads, total_loss = build_towers(params, opt_step, num_replicas)
+            apply_gradient_op = opt_step.apply_gradients(grads)
+
+            sess = tf.Session(config=session_config(num_replicas))
+            sess.run(tf.global_variables_initializer())
+            sess.run(tf.local_variables_initializer())
+
+            # the first steps fill the input pipelines and allocate the buffers
+            for step in range(3):
+                sess.run(apply_gradient_op)
+            start_time = time.time()
+            for step in range(args.scaling_steps):
+                sess.run(apply_gradient_op)
+            examples_per_sec = args.scaling_steps * params.batch_size / (time.time() - start_time)
+            sess.close()
+
+        results.append((num_replicas, examples_per_sec))
+        print('replicas: {:>3} | examples/s: {:4.2f}'.format(num_replicas, examples_per_sec))
+
+    first_replicas, first_examples_per_sec = results[0]
+    print('replicas | examples/s | speedup | efficiency')
+    for num_replicas, examples_per_sec in results:
+        speedup = examples_per_sec / first_examples_per_sec
+        efficiency = speedup / (num_replicas / first_replicas)
+        print('{:>8} | {:>10.2f} | {:>6.2f}x | {:>9.1%}'.format(num_replicas, examples_per_sec, speedup, efficiency))
+
 def test(params):
     """Test function."""
 
@@ -194,8 +274,6 @@ def test(params):
     # INIT
     sess.run(tf.global_variables_initializer())
     sess.run(tf.local_variables_initializer())
-    coordinator = tf.train.Coordinator()
-    threads = tf.train.start_queue_runners(sess=sess, coord=coordinator)
 
     # RESTORE
     if args.checkpoint_path == '':
@@ -247,6 +325,8 @@ def main(_):
         train(params)
     elif args.mode == 'test':
         test(params)
+    elif args.mode == 'scaling':
+        scaling(params)
 
 if __name__ == '__main__':
     tf.app.run()
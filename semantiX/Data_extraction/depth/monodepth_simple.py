@@ -68,8 +68,6 @@ def test_simple(params):
     # INIT
     sess.run(tf.global_variables_initializer())
     sess.run(tf.local_variables_initializer())
-    coordinator = tf.train.Coordinator()
-    threads = tf.train.start_queue_runners(sess=sess, coord=coordinator)
 
     # RESTORE
     restore_path = args.checkpoint_path.split(".")[0]
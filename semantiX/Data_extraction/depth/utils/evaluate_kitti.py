@@ -1,5 +1,5 @@
 import numpy as np
-import cv, cv2
+import cv2
 import argparse
 from evaluation_utils import *
 
@@ -11,6 +11,9 @@ parser.add_argument('--min_depth',           type=float, help='minimum depth for
 parser.add_argument('--max_depth',           type=float, help='maximum depth for evaluation',        default=80)
 parser.add_argument('--eigen_crop',                      help='if set, crops according to Eigen NIPS14',   action='store_true')
 parser.add_argument('--garg_crop',                       help='if set, crops according to Garg  ECCV16',   action='store_true')
+parser.add_argument('--num_workers',         type=int,   help='processes making the eigen ground truth',    default=1)
+parser.add_argument('--cache_path',          type=str,   help='.npz file caching the eigen ground truth',   default='')
+parser.add_argument('--lin_interp',                      help='if set, evaluates on the interpolated eigen ground truth', action='store_true')
 
 args = parser.parse_args()
 
@@ -25,37 +28,25 @@ if __name__ == '__main__':
         gt_depths, pred_depths, pred_disparities_resized = convert_disps_to_depths_kitti(gt_disparities, pred_disparities)
 
     elif args.split == 'eigen':
-        num_samples = 697
         test_files = read_text_lines(args.gt_path + 'eigen_test_files.txt')
-        gt_files, gt_calib, im_sizes, im_files, cams = read_file_data(test_files, args.gt_path)
+        gt_depths, im_sizes, focal_lengths, baselines, test_ids = load_gt_eigen(test_files, args.gt_path,
+                                                                                args.cache_path, args.num_workers,
+                                                                                args.lin_interp)
 
-        num_test = len(im_files)
-        gt_depths = []
+        num_samples = len(gt_depths)
         pred_depths = []
         for t_id in range(num_samples):
-            camera_id = cams[t_id]  # 2 is left, 3 is right
-            depth = generate_depth_map(gt_calib[t_id], gt_files[t_id], im_sizes[t_id], camera_id, False, True)
-            gt_depths.append(depth.astype(np.float32))
-
-            disp_pred = cv2.resize(pred_disparities[t_id], (im_sizes[t_id][1], im_sizes[t_id][0]), interpolation=cv2.INTER_LINEAR)
+            # Predictions follow the whole test list, missing images included
+            disp_pred = cv2.resize(pred_disparities[test_ids[t_id]], (im_sizes[t_id][1], im_sizes[t_id][0]), interpolation=cv2.INTER_LINEAR)
             disp_pred = disp_pred * disp_pred.shape[1]
 
             # need to convert from disparity to depth
-            focal_length, baseline = get_focal_length_baseline(gt_calib[t_id], camera_id)
-            depth_pred = (baseline * focal_length) / disp_pred
+            depth_pred = (baselines[t_id] * focal_lengths[t_id]) / disp_pred
             depth_pred[np.isinf(depth_pred)] = 0
 
             pred_depths.append(depth_pred)
 
-    rms     = np.zeros(num_samples, np.float32)
-    log_rms = np.zeros(num_samples, np.float32)
-    abs_rel = np.zeros(num_samples, np.float32)
-    sq_rel  = np.zeros(num_samples, np.float32)
-    d1_all  = np.zeros(num_samples, np.float32)
-    a1      = np.zeros(num_samples, np.float32)
-    a2      = np.zeros(num_samples, np.float32)
-    a3      = np.zeros(num_samples, np.float32)
-    
+    masks = []
     for i in range(num_samples):
         
         gt_depth = gt_depths[i]
@@ -81,20 +72,21 @@ if __name__ == '__main__':
                     crop = np.array([0.3324324 * gt_height,  0.91351351 * gt_height,   
                                      0.0359477 * gt_width,   0.96405229 * gt_width]).astype(np.int32)
 
-                crop_mask = np.zeros(mask.shape)
-                crop_mask[crop[0]:crop[1],crop[2]:crop[3]] = 1
+                crop_mask = np.zeros(mask.shape, bool)
+                crop_mask[crop[0]:crop[1],crop[2]:crop[3]] = True
                 mask = np.logical_and(mask, crop_mask)
 
         if args.split == 'kitti':
-            gt_disp = gt_disparities[i]
-            mask = gt_disp > 0
-            pred_disp = pred_disparities_resized[i]
+            mask = gt_disparities[i] > 0
 
-            disp_diff = np.abs(gt_disp[mask] - pred_disp[mask])
-            bad_pixels = np.logical_and(disp_diff >= 3, (disp_diff / gt_disp[mask]) >= 0.05)
-            d1_all[i] = 100.0 * bad_pixels.sum() / mask.sum()
+        masks.append(mask)
 
-        abs_rel[i], sq_rel[i], rms[i], log_rms[i], a1[i], a2[i], a3[i] = compute_errors(gt_depth[mask], pred_depth[mask])
+    # All the metrics in one pass over the masked pixels of every sample
+    if args.split == 'kitti':
+        d1_all = compute_d1_all_batch(gt_disparities, pred_disparities_resized, masks)
+    else:
+        d1_all = np.zeros(num_samples, np.float32)
+    abs_rel, sq_rel, rms, log_rms, a1, a2, a3 = compute_errors_batch(gt_depths, pred_depths, masks)
 
     print("{:>10}, {:>10}, {:>10}, {:>10}, {:>10}, {:>10}, {:>10}, {:>10}".format('abs_rel', 'sq_rel', 'rms', 'log_rms', 'd1_all', 'a1', 'a2', 'a3'))
     print("{:10.4f}, {:10.4f}, {:10.3f}, {:10.3f}, {:10.3f}, {:10.3f}, {:10.3f}, {:10.3f}".format(abs_rel.mean(), sq_rel.mean(), rms.mean(), log_rms.mean(), d1_all.mean(), a1.mean(), a2.mean(), a3.mean()))
@@ -1,9 +1,11 @@
 import numpy as np
 import pandas as pd
 import os
-import cv, cv2
-from collections import Counter
+import cv2
+import json
 import pickle
+from concurrent.futures import ProcessPoolExecutor
+from scipy.interpolate import LinearNDInterpolator
 
 def compute_errors(gt, pred):
     thresh = np.maximum((gt / pred), (pred / gt))
@@ -23,6 +25,43 @@ def compute_errors(gt, pred):
 
     return abs_rel, sq_rel, rmse, rmse_log, a1, a2, a3
 
+def masked_batch(gts, preds, masks):
+    # The masked pixels of every sample, one after the other, and the sample
+    # each of them comes from
+    counts = np.array([mask.sum() for mask in masks])
+    gt = np.concatenate([gt[mask] for (gt, mask) in zip(gts, masks)])
+    pred = np.concatenate([pred[mask] for (pred, mask) in zip(preds, masks)])
+    samples = np.repeat(np.arange(len(masks)), counts)
+    return gt.astype(np.float64), pred.astype(np.float64), samples, counts
+
+def compute_errors_batch(gts, preds, masks):
+    # compute_errors of every sample, in a single pass over all of them
+    gt, pred, samples, counts = masked_batch(gts, preds, masks)
+
+    def sample_mean(values):
+        return np.bincount(samples, values, len(counts)) / counts
+
+    thresh = np.maximum((gt / pred), (pred / gt))
+    a1 = sample_mean(thresh < 1.25   )
+    a2 = sample_mean(thresh < 1.25 ** 2)
+    a3 = sample_mean(thresh < 1.25 ** 3)
+
+    rmse = np.sqrt(sample_mean((gt - pred) ** 2))
+
+    rmse_log = np.sqrt(sample_mean((np.log(gt) - np.log(pred)) ** 2))
+
+    abs_rel = sample_mean(np.abs(gt - pred) / gt)
+
+    sq_rel = sample_mean(((gt - pred)**2) / gt)
+
+    return abs_rel, sq_rel, rmse, rmse_log, a1, a2, a3
+
+def compute_d1_all_batch(gt_disps, pred_disps, masks):
+    gt, pred, samples, counts = masked_batch(gt_disps, pred_disps, masks)
+    disp_diff = np.abs(gt - pred)
+    bad_pixels = np.logical_and(disp_diff >= 3, (disp_diff / gt) >= 0.05)
+    return 100.0 * np.bincount(samples, bad_pixels, len(counts)) / counts
+
 ###############################################################################
 #######################  KITTI
 
@@ -74,34 +113,44 @@ def read_text_lines(file_path):
     lines = [l.rstrip() for l in lines]
     return lines
 
-def read_file_data(files, data_root):
+def read_file_paths(files, data_root):
+    # The velodyne file, calibration folder and image of every test file,
+    # without opening any of them
     gt_files = []
     gt_calib = []
-    im_sizes = []
     im_files = []
-    cams = []
-    num_probs = 0
     for filename in files:
         filename = filename.split()[0]
         splits = filename.split('/')
-        camera_id = np.int32(splits[2][-1:])   # 2 is left, 3 is right
         date = splits[0]
         im_id = splits[4][:10]
-        file_root = '{}/{}'
-        
-        im = filename
+
         vel = '{}/{}/velodyne_points/data/{}.bin'.format(splits[0], splits[1], im_id)
 
-        if os.path.isfile(data_root + im):
-            gt_files.append(data_root + vel)
-            gt_calib.append(data_root + date + '/')
-            im_sizes.append(cv2.imread(data_root + im).shape[:2])
-            im_files.append(data_root + im)
+        gt_files.append(data_root + vel)
+        gt_calib.append(data_root + date + '/')
+        im_files.append(data_root + filename)
+
+    return gt_files, gt_calib, im_files
+
+def read_file_data(files, data_root):
+    gt_files = []
+    gt_calib = []
+    im_sizes = []
+    im_files = []
+    cams = []
+    num_probs = 0
+    for (vel, calib, im) in zip(*read_file_paths(files, data_root)):
+        if os.path.isfile(im):
+            gt_files.append(vel)
+            gt_calib.append(calib)
+            im_sizes.append(cv2.imread(im).shape[:2])
+            im_files.append(im)
             cams.append(2)
         else:
             num_probs += 1
-            print('{} missing'.format(data_root + im))
-    print num_probs, 'files missing'
+            print('{} missing'.format(im))
+    print(num_probs, 'files missing')
 
     return gt_files, gt_calib, im_sizes, im_files, cams
 
@@ -123,7 +172,15 @@ def lin_interp(shape, xyd):
     return disparity
 
 
+# Parsed calibration files, by path: the samples of a drive share them
+calib_files = dict()
+
 def read_calib_file(path):
+    if path not in calib_files:
+        calib_files[path] = parse_calib_file(path)
+    return calib_files[path]
+
+def parse_calib_file(path):
     # taken from https://github.com/hunse/kitti
     float_chars = set("0123456789.e+- ")
     data = {}
@@ -135,7 +192,7 @@ def read_calib_file(path):
             if float_chars.issuperset(value):
                 # try to cast to float array
                 try:
-                    data[key] = np.array(map(float, value.split(' ')))
+                    data[key] = np.array(list(map(float, value.split(' '))))
                 except ValueError:
                     # casting error: data[key] already eq. value, so pass
                     pass
@@ -201,16 +258,16 @@ def generate_depth_map(calib_dir, velo_file_name, im_shape, cam=2, interp=False,
 
     # project to image
     depth = np.zeros((im_shape))
-    depth[velo_pts_im[:, 1].astype(np.int), velo_pts_im[:, 0].astype(np.int)] = velo_pts_im[:, 2]
+    depth[velo_pts_im[:, 1].astype(int), velo_pts_im[:, 0].astype(int)] = velo_pts_im[:, 2]
 
-    # find the duplicate points and choose the closest depth
+    # find the duplicate points and choose the closest depth, written where
+    # the first point of each duplicate index is
     inds = sub2ind(depth.shape, velo_pts_im[:, 1], velo_pts_im[:, 0])
-    dupe_inds = [item for item, count in Counter(inds).iteritems() if count > 1]
-    for dd in dupe_inds:
-        pts = np.where(inds==dd)[0]
-        x_loc = int(velo_pts_im[pts[0], 0])
-        y_loc = int(velo_pts_im[pts[0], 1])
-        depth[y_loc, x_loc] = velo_pts_im[pts, 2].min()
+    _, first, group, count = np.unique(inds, return_index=True, return_inverse=True, return_counts=True)
+    closest = np.full(len(first), np.inf)
+    np.minimum.at(closest, group.ravel(), velo_pts_im[:, 2])
+    dupes = first[count > 1]
+    depth[velo_pts_im[dupes, 1].astype(int), velo_pts_im[dupes, 0].astype(int)] = closest[count > 1]
     depth[depth<0] = 0
 
     if interp:
@@ -222,3 +279,87 @@ def generate_depth_map(calib_dir, velo_file_name, im_shape, cam=2, interp=False,
 
 
 
+
+
+def eigen_sample(sample):
+    # Ground truth of a sample of the eigen split, in a worker of the pool
+    calib_dir, velo_file_name, im_file, cam, interp = sample
+    im_shape = cv2.imread(im_file).shape[:2]
+    depth = generate_depth_map(calib_dir, velo_file_name, im_shape, cam, interp, True)
+    if interp:
+        depth = depth[1]
+    focal_length, baseline = get_focal_length_baseline(calib_dir, cam)
+    return depth.astype(np.float32), im_shape, focal_length, baseline
+
+def file_stamp(path):
+    try:
+        return [os.path.getmtime(path), os.path.getsize(path)]
+    except OSError:
+        return None
+
+def eigen_stamp(gt_files, gt_calib, im_files, interp):
+    # What the cached ground truth was made from: any change makes it again
+    stamp = [interp]
+    for calib_dir in sorted(set(gt_calib)):
+        stamp.append([calib_dir, file_stamp(calib_dir + 'calib_cam_to_cam.txt'),
+                      file_stamp(calib_dir + 'calib_velo_to_cam.txt')])
+    for (vel, im) in zip(gt_files, im_files):
+        stamp.append([vel, file_stamp(vel), im, file_stamp(im)])
+    return json.dumps(stamp)
+
+def load_gt_cache(cache_path, stamp):
+    try:
+        with np.load(cache_path) as cache:
+            if str(cache['stamp']) != stamp:
+                return None
+            num_samples = len(cache['im_sizes'])
+            gt_depths = [cache['depth_{}'.format(i)] for i in range(num_samples)]
+            im_sizes = [tuple(im_size) for im_size in cache['im_sizes']]
+            return (gt_depths, im_sizes, list(cache['focal_lengths']), list(cache['baselines']),
+                    [int(t_id) for t_id in cache['test_ids']])
+    except (IOError, OSError, ValueError, KeyError):
+        return None
+
+def save_gt_cache(cache_path, stamp, gt_depths, im_sizes, focal_lengths, baselines, test_ids):
+    depths = dict(('depth_{}'.format(i), depth) for (i, depth) in enumerate(gt_depths))
+    # np.savez_compressed adds .npz to names without it
+    tmp_path = cache_path + '.tmp.npz'
+    np.savez_compressed(tmp_path, stamp=np.array(stamp), im_sizes=np.array(im_sizes),
+                        focal_lengths=np.array(focal_lengths), baselines=np.array(baselines),
+                        test_ids=np.array(test_ids, np.int64),
+                        **depths)
+    os.replace(tmp_path, cache_path)
+
+def load_gt_eigen(files, data_root, cache_path='', num_workers=1, interp=False, cam=2):
+    # Ground truth depths, image sizes, focal lengths and baselines of the
+    # eigen split, from the cache when it is up to date, and the position in
+    # files of each of them: missing images are skipped
+    gt_files, gt_calib, im_files = read_file_paths(files, data_root)
+    present = [os.path.isfile(im) for im in im_files]
+    for (im, found) in zip(im_files, present):
+        if not found:
+            print('{} missing'.format(im))
+    print(present.count(False), 'files missing')
+    test_ids = [t_id for (t_id, found) in enumerate(present) if found]
+    gt_files, gt_calib, im_files = [[path for (path, found) in zip(paths, present) if found]
+                                    for paths in (gt_files, gt_calib, im_files)]
+
+    stamp = eigen_stamp(gt_files, gt_calib, im_files, interp)
+    if cache_path:
+        cached = load_gt_cache(cache_path, stamp)
+        if cached is not None:
+            print('ground truth loaded from {}'.format(cache_path))
+            return cached
+
+    samples = [(calib_dir, vel, im, cam, interp) for (calib_dir, vel, im) in zip(gt_calib, gt_files, im_files)]
+    if num_workers > 1:
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            results = list(executor.map(eigen_sample, samples,
+                                        chunksize=max(1, len(samples) // (4 * num_workers))))
+    else:
+        results = [eigen_sample(sample) for sample in samples]
+    gt_depths, im_sizes, focal_lengths, baselines = [list(values) for values in zip(*results)]
+
+    if cache_path:
+        save_gt_cache(cache_path, stamp, gt_depths, im_sizes, focal_lengths, baselines, test_ids)
+    return gt_depths, im_sizes, focal_lengths, baselines, test_ids
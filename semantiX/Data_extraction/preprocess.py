@@ -0,0 +1,438 @@
+import argparse
+import itertools
+import os
+import queue
+import sys
+import threading
+import time
+
+# The extractors live in the folder of their stream
+DATA_EXTRACTION_DIR = os.path.dirname(os.path.abspath(__file__))
+for stream in ['temporal', 'visual', 'depth']:
+    sys.path.insert(0, os.path.join(DATA_EXTRACTION_DIR, stream))
+sys.path.insert(0, DATA_EXTRACTION_DIR)
+
+import flow_backends
+from optflow_extractor import Optflow_extractor
+from visual_rhythm_extractor import Visual_Rythm_extractor
+from frame_extractor import Frame_extractor, Frame_writer, FIRST
+from video_reader import Video_reader
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+''' Documentation: class Decode_bus
+
+    Decodes each video of a dataset once and hands its frames to every
+    stream extracted from it, instead of each extractor decoding the video
+    again:
+
+    flow: the flow_x and flow_y images (optflow_extractor.py)
+    rhythm: the ritmo_*_h.jpg images read by the ritmo stream, and the
+    vertical ritmo_*_v.jpg ones beside them (visual_rhythm_extractor.py)
+    frames: the frame_ (or depth_) images (frame_extractor.py)
+    depth: the 224x224 depth_ images, monodepth run by batches of frames
+    and written by a Depth_writer (monodepth_batch.py)
+
+    The methods are:
+
+    extract
+    extract_class
+    extract_video
+    consume
+
+    extract: calls to extract_class for it's multiple classes
+
+    extract_class: extracts the videos of a class. With more than one
+    worker, the videos are extracted in parallel by a pool of processes,
+    one video per process.
+
+    extract_video: decodes a video, in order, with Video_reader
+    (video_reader.py), and puts every frame in the queue of each consumer.
+    Every consumer runs in its own thread, so the streams are extracted
+    concurrently. Queues hold at most queue_size frames: a consumer behind
+    makes the decoding wait instead of frames piling up in memory.
+
+    consume: the loop of the thread of a consumer. A consumer that fails
+    keeps emptying its queue, so the decoding never blocks, and its error
+    is raised once the video is decoded.
+
+    A consumer has three methods: start(video, path, reader) before the
+    first frame, consume(frame) for every frame, in order, and finish(),
+    after the last frame, which gives a summary of what was written. By
+    then, reader.length() is the exact amount of frames decoded. Frames are
+    shared by the consumers and must not be changed.
+'''
+
+# Frames waiting in the queue of each consumer
+QUEUE_SIZE = 16
+
+CONSUMERS = ['flow', 'rhythm', 'frames', 'depth']
+
+class Flow_consumer:
+
+    def __init__(self, extractor):
+        self.extractor = extractor
+
+    def start(self, video, path, reader):
+        self.path = path
+        self.skip = (self.extractor.resume and
+                     self.extractor.extracted(video, path))
+        self.video = video
+        self.prvs = None
+        self.counter = 1
+
+    def consume(self, frame):
+        if self.skip:
+            return
+        next = self.extractor.gray(frame)
+        if self.prvs is not None:
+            self.extractor.write(self.path, self.counter,
+                    self.extractor.resize(*self.extractor.flow(self.prvs,
+                    next)))
+            self.counter += 1
+        self.prvs = next
+
+    def finish(self):
+        if self.skip:
+            return 'flows already extracted'
+        self.extractor.mark_extracted(self.video, self.path, self.counter - 1)
+        return str(self.counter - 1) + ' flows'
+
+class Rhythm_consumer:
+
+    def __init__(self, extractor, window):
+        self.extractor = extractor
+        self.window = window
+
+    def start(self, video, path, reader):
+        self.path = path
+        self.reader = reader
+        self.hor = []
+        self.ver = []
+        self.shape = (0, 0)
+
+    def consume(self, frame):
+        h, v = self.extractor.profile(frame)
+        self.hor.append(h)
+        self.ver.append(v)
+        self.shape = frame.shape
+
+    def finish(self):
+        hor, ver = self.extractor.stack(self.hor, self.ver, self.shape[1],
+                                        self.shape[0])
+        self.hor = []
+        self.ver = []
+        windows = self.extractor.windows(hor, ver, self.reader.length(),
+                                         self.window, self.path)
+        return str(windows) + ' ritmo_*_h.jpg (and _v.jpg) windows'
+
+class Frame_consumer:
+
+    def __init__(self, extractor):
+        self.extractor = extractor
+
+    def start(self, video, path, reader):
+        self.writer = Frame_writer(self.extractor, path)
+
+    def consume(self, frame):
+        self.writer.put(frame)
+
+    def finish(self):
+        return str(self.writer.close()) + ' frames'
+
+class Depth_consumer:
+
+    def __init__(self, checkpoint_path, encoder, input_height, input_width,
+                 batch_size, depth_format='plasma'):
+        self.checkpoint_path = checkpoint_path
+        self.depth_format = depth_format
+        self.encoder = encoder
+        self.input_height = input_height
+        self.input_width = input_width
+        self.batch_size = batch_size
+        self.estimator = None
+
+    def __getstate__(self):
+        # The session stays in its process, a worker restores its own
+        state = dict(self.__dict__)
+        state['estimator'] = None
+        return state
+
+    def start(self, video, path, reader):
+        from monodepth_batch import Depth_estimator, Depth_writer
+        if self.estimator is None:
+            self.estimator = Depth_estimator(self.checkpoint_path,
+                             self.encoder, self.input_height,
+                             self.input_width, self.batch_size)
+        self.writer = Depth_writer(self.depth_format)
+        self.path = path
+        self.count = FIRST['depth']
+        self.batch = []
+
+    def consume(self, frame):
+        self.batch.append(frame)
+        if len(self.batch) == self.batch_size:
+            self.flush()
+
+    def flush(self):
+        names = [self.path + '/depth_' + str(self.count + i).zfill(5) for i
+                 in range(len(self.batch))]
+        self.writer.write(names, self.estimator.estimate(self.batch))
+        self.count += len(self.batch)
+        self.batch = []
+
+    def finish(self):
+        if len(self.batch) > 0:
+            self.flush()
+        self.writer.close()
+        return str(self.count - FIRST['depth']) + ' depths'
+
+class Decode_bus:
+
+    def __init__(self, classes, ext, consumers, queue_size=QUEUE_SIZE,
+                 workers=1):
+        self.classes = classes
+        self.ext = ext
+        self.consumers = consumers
+        self.queue_size = queue_size
+        self.workers = workers
+        self.classes_dirs = []
+        self.classes_videos = []
+
+    def extract(self, data_folder):
+
+        self.get_dirs(data_folder)
+
+        for i in range(len(self.classes)):
+            self.extract_class(data_folder, self.classes_videos[i],
+                    self.classes_dirs[i], self.classes[i])
+
+    def extract_class(self, data_folder, videos, dirs, class_):
+
+        print(class_ + ': ' + str(len(videos)) + ' videos', flush=True)
+        begin = time.perf_counter()
+        frames = 0
+        paths = [data_folder + class_ + '/' + dir for dir in dirs]
+
+        def progress(video, result):
+            amount, summaries = result
+            print(video + ': ' + str(amount) + ' frames decoded, ' +
+                  ', '.join(summaries), flush=True)
+            return amount
+
+        try:
+            if self.workers > 1:
+                with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                    futures = dict([(executor.submit(self.extract_video,
+                                   video, path), video) for (video, path) in
+                                   zip(videos, paths)])
+                    for future in as_completed(futures):
+                        frames += progress(futures[future], future.result())
+            else:
+                for (video, path) in zip(videos, paths):
+                    frames += progress(video, self.extract_video(video,
+                                       path))
+        except IOError as e:
+            print(e, file=sys.stderr)
+            exit(1)
+
+        seconds = time.perf_counter() - begin
+        print(class_ + ': ' + str(frames) + ' frames in ' +
+              "{0:.1f}s ({1:.1f} frames/sec)".format(seconds, frames /
+              max(seconds, 1e-9)), flush=True)
+
+    def extract_video(self, video, path):
+
+        reader = Video_reader(video, threads=1 if self.workers > 1 else 0)
+        try:
+            frames = reader.frames()
+            first = next(frames, None)
+        except IOError:
+            raise IOError("Inside every folder in dataset it's expected a " +
+                          "valid video with name equal to the folder + " +
+                          self.ext + ", can't open " + video)
+
+        for consumer in self.consumers:
+            consumer.start(video, path, reader)
+
+        queues = [queue.Queue(maxsize=self.queue_size) for consumer in
+                  self.consumers]
+        errors = [None] * len(self.consumers)
+        summaries = [None] * len(self.consumers)
+        threads = [threading.Thread(target=self.consume, args=(i, queues[i],
+                   errors, summaries)) for i in range(len(self.consumers))]
+        for thread in threads:
+            thread.start()
+
+        amount = 0
+        try:
+            if first is not None:
+                for frame in itertools.chain([first], frames):
+                    for q in queues:
+                        q.put(frame)
+                    amount += 1
+        finally:
+            # The consumers stop even if the decoding fails
+            for q in queues:
+                q.put(None)
+            for thread in threads:
+                thread.join()
+            reader.release()
+
+        for error in errors:
+            if error is not None:
+                raise error
+        return amount, summaries
+
+    def consume(self, i, frames, errors, summaries):
+
+        consumer = self.consumers[i]
+        while True:
+            frame = frames.get()
+            if frame is None:
+                break
+            if errors[i] is not None:
+                continue
+            try:
+                consumer.consume(frame)
+            except Exception as e:
+                errors[i] = e
+
+        if errors[i] is None:
+            try:
+                summaries[i] = consumer.finish()
+            except Exception as e:
+                errors[i] = e
+
+    def get_dirs(self, data_folder):
+
+        for c in self.classes:
+            self.classes_dirs.append([f for f in os.listdir(data_folder + c)
+                        if os.path.isdir(os.path.join(data_folder, c, f))])
+            self.classes_dirs[-1].sort()
+
+            self.classes_videos.append([])
+            for f in self.classes_dirs[-1]:
+                self.classes_videos[-1].append(data_folder + c+ '/' + f +
+                                   '/' + f + self.ext)
+
+            self.classes_videos[-1].sort()
+
+if __name__ == '__main__':
+    print("***********************************************************",
+            file=sys.stderr)
+    print("             SEMANTIX - UNICAMP DATALAB 2018", file=sys.stderr)
+    print("***********************************************************",
+            file=sys.stderr)
+    argp = argparse.ArgumentParser(description='Do preprocessing tasks')
+    argp.add_argument("-data", dest='data_folder', type=str, nargs=1,
+            help='Usage: -data <path_to_your_data_folder>', required=True)
+    argp.add_argument("-class", dest='classes', type=str, nargs='+',
+            help='Usage: -class <class0_name> <class1_name>..<n-th_class_name>',
+            required=True)
+    argp.add_argument("-ext", dest='ext', type=str, nargs=1,
+            help='Usage: -ext <file_extension> .mp4 | .avi | ...', required=True)
+    argp.add_argument("-consumers", dest='consumers', type=str, nargs='+',
+            choices=CONSUMERS,
+            help='Usage: -consumers ' + ' '.join(CONSUMERS) +
+                 ' (streams extracted from the frames decoded)',
+            required=True)
+    argp.add_argument("-queue_size", dest='queue_size', type=int, nargs=1,
+            help='Usage: -queue_size <frames_waiting_for_each_consumer>',
+            required=False, default=[QUEUE_SIZE])
+    argp.add_argument("-workers", dest='workers', type=int, nargs=1,
+            help='Usage: -workers <videos_extracted_in_parallel>',
+            required=False, default=[1])
+    # flow
+    argp.add_argument("-input_dim", dest='input_dim', type=int, nargs=2,
+            help='Usage: -input_dim <x_dimension> <y_dimension>',
+            required=False, default=[224, 224])
+    argp.add_argument("-flow_dim", dest='flow_dim', type=int, nargs=2,
+            help='Usage: -flow_dim <x_dimension> <y_dimension> (resolution \
+                  the flow is computed at; default: the one of the video)',
+            required=False, default=None)
+    argp.add_argument("-backend", dest='backend', type=str, nargs=1,
+            choices=flow_backends.BACKENDS,
+            help='Usage: -backend <' + ' | '.join(flow_backends.BACKENDS) +
+                 '> (default: farneback)',
+            required=False, default=['farneback'])
+    argp.add_argument("-flow_z", dest='flow_z', action='store_true',
+            help='Usage: -flow_z (also writes flow_z)', required=False)
+    argp.add_argument("-resume", dest='resume', action='store_true',
+            help='Usage: -resume (skips the flows already extracted)',
+            required=False)
+    # rhythm
+    argp.add_argument("-mean", dest='input_mean', type=int, nargs=1,
+            help='Usage: -mean <vr_mean> ', required=False, default=[1])
+    argp.add_argument("-window", dest='window', type=int, nargs=1,
+            help='Usage: -window <sliding_window_size>',
+            required=False, default=[10])
+    # frames
+    argp.add_argument("-prefix", dest='prefix', type=str, nargs=1,
+            choices=list(FIRST.keys()),
+            help='Usage: -prefix <depth | frame> (default: frame)',
+            required=False, default=['frame'])
+    argp.add_argument("-resize", dest='resize', action='store_true',
+            help='Usage: -resize (frames are written at 224x224)',
+            required=False)
+    argp.add_argument("-threads", dest='threads', type=int, nargs=1,
+            help='Usage: -threads <encoding_threads_per_video>',
+            required=False, default=[4])
+    # depth
+    argp.add_argument("-checkpoint_path", dest='checkpoint_path', type=str,
+            nargs=1, help='Usage: -checkpoint_path <monodepth_checkpoint>',
+            required=False, default=[None])
+    argp.add_argument("-encoder", dest='encoder', type=str, nargs=1,
+            help='Usage: -encoder <vgg | resnet50>', required=False,
+            default=['vgg'])
+    argp.add_argument("-depth_dim", dest='depth_dim', type=int, nargs=2,
+            help='Usage: -depth_dim <input_height> <input_width> (of \
+                  monodepth)', required=False, default=[256, 512])
+    argp.add_argument("-batch_size", dest='batch_size', type=int, nargs=1,
+            help='Usage: -batch_size <frames_per_monodepth_run>',
+            required=False, default=[8])
+    argp.add_argument("-depth_format", dest='depth_format', type=str,
+            nargs=1, choices=['plasma', 'gray', 'gray16'],
+            help='Usage: -depth_format <plasma | gray | gray16> (default: \
+                  plasma)', required=False, default=['plasma'])
+
+    try:
+        args = argp.parse_args()
+    except:
+        argp.print_help(sys.stderr)
+        exit(1)
+
+    consumers = []
+    if 'flow' in args.consumers:
+        if args.input_dim != [224, 224]:
+            print("-input_dim 224 224 are obrigatory so far. sorry.",
+                   file=sys.stderr)
+            exit(1)
+        consumers.append(Flow_consumer(Optflow_extractor(args.classes,
+                         args.input_dim[0], args.input_dim[1], args.ext[0],
+                         args.flow_z, 1, args.resume, args.flow_dim,
+                         args.backend[0])))
+    if 'rhythm' in args.consumers:
+        consumers.append(Rhythm_consumer(Visual_Rythm_extractor(args.classes,
+                         args.input_mean[0], args.ext[0]), args.window[0]))
+    if 'frames' in args.consumers:
+        if 'depth' in args.consumers and args.prefix[0] == 'depth':
+            print("-prefix depth would overwrite the depth images, use \
+                   -prefix frame with -consumers depth", file=sys.stderr)
+            exit(1)
+        consumers.append(Frame_consumer(Frame_extractor(args.classes,
+                         args.ext[0], args.prefix[0], args.resize,
+                         args.threads[0])))
+    if 'depth' in args.consumers:
+        if args.checkpoint_path[0] is None:
+            print("-consumers depth needs a -checkpoint_path",
+                  file=sys.stderr)
+            exit(1)
+        consumers.append(Depth_consumer(args.checkpoint_path[0],
+                         args.encoder[0], args.depth_dim[0],
+                         args.depth_dim[1], args.batch_size[0],
+                         args.depth_format[0]))
+
+    bus = Decode_bus(args.classes, args.ext[0], consumers,
+                     args.queue_size[0], args.workers[0])
+    bus.extract(args.data_folder[0])
+    print ("done")
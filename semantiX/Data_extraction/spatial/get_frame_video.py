@@ -1,10 +1,21 @@
 import argparse
+import os
+import sys
 
-import numpy as np
+# The frames are extracted by the engine of Data_extraction/depth
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+                os.path.abspath(__file__))), 'depth'))
+from frame_extractor import Frame_extractor
 
 if __name__ == '__main__':
-    parser = argparse.ArgumentParser(description='get frame Video')
-    parser.add_argument('-video', type=str, default='', required=True)
+    argp = argparse.ArgumentParser(description='get frame Video')
+    argp.add_argument('-video', type=str, default='', required=True)
+    argp.add_argument("-resize", dest='resize', action='store_true',
+            help='Usage: -resize (frames are written at 224x224)',
+            required=False)
+    argp.add_argument("-threads", dest='threads', type=int, nargs=1,
+            help='Usage: -threads <encoding_threads>',
+            required=False, default=[4])
 
     try:
         args = argp.parse_args()
@@ -12,20 +23,12 @@ if __name__ == '__main__':
         argp.print_help(sys.stderr)
         exit(1)
 
-    cap = cv2.VideoCapture(args.video)
-
-    if cap.isOpened() is False:
+    if not os.path.isfile(args.video):
         print("Error opening video stream or file")
-    
-    i = 0
-    while cap.isOpened():
-        i+=1
-        ret_val, image = cap.read()
-
-        if ret_val == False:
-            break
-
-        cv2.imwrite(video + '/frame_' + str(i).zfill(5) + '.jpg', image)
+        exit(1)
 
-    cv2.destroyAllWindows()
-logger.debug('finished+')
+    # Frames are stored in the folder of the video, as frame_00001.jpg...
+    extractor = Frame_extractor([], None, 'frame', args.resize,
+                                args.threads[0])
+    extractor.extract_video(args.video, os.path.dirname(os.path.abspath(
+                            args.video)))
@@ -0,0 +1,105 @@
+import numpy as np
+import cv2
+
+''' Documentation: flow_backends
+
+    Optical flow methods the temporal stream can be extracted with. A
+    backend has a single method, flow(prvs, next), that takes two
+    consecutive gray frames (uint8) and returns their flow as a float32
+    array (height, width, 2) of displacements in x and y, like
+    cv2.calcOpticalFlowFarneback does. Optflow_extractor encodes it into
+    flow_x and flow_y the same way whatever the backend is.
+
+    farneback: cv2.calcOpticalFlowFarneback with the parameters the
+    temporal stream was always extracted with (0.702, 5, 10, 2, 7, 1.5, 0)
+    dis_ultrafast, dis_fast, dis_medium: cv2.DISOpticalFlow with the preset
+    of the same name, from the cheapest to the most accurate. Only these
+    need an OpenCV with DIS (3.4, or opencv_contrib), they fail when created
+    otherwise
+    difference: a proxy of the flow made of the difference of the frames,
+    the normal flow -It * grad(I) / |grad(I)|^2, which only sees the motion
+    along the gradient of the image, at the cost of a few filters
+
+    create returns a backend by name. Backends can be sent to other
+    processes, the OpenCV objects they hold are created again on first use.
+'''
+
+BACKENDS = ['farneback', 'dis_ultrafast', 'dis_fast', 'dis_medium',
+            'difference']
+
+class Farneback:
+
+    def __init__(self):
+        self.name = 'farneback'
+
+    def flow(self, prvs, next):
+        return cv2.calcOpticalFlowFarneback(prvs, next, None,
+                0.702, 5, 10, 2, 7, 1.5, 0)
+
+class DIS:
+
+    # Names of the OpenCV constants, looked up only when a DIS backend is
+    # created: builds without DIS can still use the other backends
+    PRESETS = {'ultrafast': 'DISOPTICAL_FLOW_PRESET_ULTRAFAST',
+               'fast': 'DISOPTICAL_FLOW_PRESET_FAST',
+               'medium': 'DISOPTICAL_FLOW_PRESET_MEDIUM'}
+
+    def __init__(self, preset):
+        self.name = 'dis_' + preset
+        self.preset = preset
+        self.dis = None
+        self.factory()
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['dis'] = None
+        return state
+
+    def factory(self):
+
+        # DIS is in the main module since OpenCV 3.4, and in the optflow
+        # module of opencv_contrib before
+        if hasattr(cv2, 'DISOpticalFlow_create'):
+            return (cv2.DISOpticalFlow_create, getattr(cv2,
+                    self.PRESETS[self.preset]))
+        optflow = getattr(cv2, 'optflow', None)
+        if optflow is not None and hasattr(optflow, 'createOptFlow_DIS'):
+            return (optflow.createOptFlow_DIS, getattr(optflow,
+                    self.PRESETS[self.preset]))
+        raise ValueError('The flow backend ' + self.name + ' needs DIS ' +
+                         'optical flow, missing in OpenCV ' + cv2.__version__
+                         + ' (it is in OpenCV 3.4 or in opencv_contrib)')
+
+    def flow(self, prvs, next):
+        if self.dis is None:
+            create, preset = self.factory()
+            self.dis = create(preset)
+        return self.dis.calc(prvs, next, None)
+
+class Difference:
+
+    def __init__(self):
+        self.name = 'difference'
+        # Keeps the division stable where the image is flat
+        self.epsilon = 1.0
+
+    def flow(self, prvs, next):
+        prvs = cv2.GaussianBlur(prvs, (5, 5), 0).astype(np.float32)
+        next = cv2.GaussianBlur(next, (5, 5), 0).astype(np.float32)
+
+        dt = next - prvs
+        dx = cv2.Sobel(next, cv2.CV_32F, 1, 0, ksize=3) / 8
+        dy = cv2.Sobel(next, cv2.CV_32F, 0, 1, ksize=3) / 8
+        scale = -dt / (dx*dx + dy*dy + self.epsilon)
+        return np.dstack((scale*dx, scale*dy))
+
+def create(name):
+
+    if name == 'farneback':
+        return Farneback()
+    elif name.startswith('dis_') and name[4:] in DIS.PRESETS:
+        return DIS(name[4:])
+    elif name == 'difference':
+        return Difference()
+    raise ValueError('Unknown flow backend ' + name + ', expected one of ' +
+                     ', '.join(BACKENDS))
@@ -0,0 +1,251 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import numpy as np
+import flow_backends
+from optflow_extractor import Optflow_extractor
+from video_reader import Video_reader
+
+''' Documentation: class Flow_benchmark
+
+    Compares the backends of flow_backends.py on a dataset (laid out as
+    <data>/<class>/<video>/<video><ext>), to pick the cheapest flow that
+    keeps the fall classification good enough.
+
+    speed: the frames of every video are decoded (and shrunk to flow_dim,
+    if there is one) once, out of the timing, and each backend computes and
+    encodes (Optflow_extractor.flow) the flow of every pair of consecutive
+    frames. It gives the flows/sec of each backend and its speedup over
+    Farneback.
+
+    metrics: for each backend, the flows of the dataset are extracted into
+    <work>/<backend>/data (a copy of the dataset made of links to the
+    videos) by optflow_extractor.py, their features by streams_fextractor.py
+    (temporal stream, with the VGG16_temporal and flow_mean.mat given) and
+    train.py cross-trains on them with a fixed seed, so every backend is
+    evaluated on the same folds. The metrics of train.py (-metrics) are read
+    back. The scripts of -dataset (URFD by default) are used, the outputs of
+    each one go to <work>/<backend>/<script>.log.
+
+    With -speed_only, only the speed is measured.
+'''
+
+TEMPORAL_DIR = os.path.dirname(os.path.abspath(__file__))
+SEMANTIX_DIR = os.path.dirname(os.path.dirname(TEMPORAL_DIR))
+
+class Flow_benchmark:
+
+    def __init__(self, data_folder, classes, ext, x_size, y_size, flow_dim,
+                 max_frames):
+        self.data_folder = data_folder
+        self.classes = classes
+        self.ext = ext
+        self.x_size = x_size
+        self.y_size = y_size
+        self.flow_dim = flow_dim
+        self.max_frames = max_frames
+
+        self.extractor = Optflow_extractor(classes, x_size, y_size, ext,
+                                           flow_dim=flow_dim)
+        self.extractor.get_dirs(data_folder)
+
+    def frames(self):
+
+        # Gray frames of every video, as the extractor computes flows on them
+        videos = []
+        for class_videos in self.extractor.classes_videos:
+            for video in class_videos:
+                reader = Video_reader(video)
+                frames = []
+                for frame in reader.frames():
+                    if (self.max_frames is not None and 
+                        len(frames) == self.max_frames):
+                        break
+                    frames.append(self.extractor.gray(frame))
+                reader.release()
+                videos.append(frames)
+        return videos
+
+    def speed(self, backends):
+
+        videos = self.frames()
+        results = dict()
+        for backend in backends:
+            self.extractor.backend = flow_backends.create(backend)
+            flows = 0
+            begin = time.perf_counter()
+            for frames in videos:
+                for prvs, next in zip(frames[:-1], frames[1:]):
+                    self.extractor.flow(prvs, next)
+                    flows += 1
+            seconds = time.perf_counter() - begin
+            results[backend] = {'flows': flows, 'seconds': seconds,
+                                'flows_per_sec': flows / max(seconds, 1e-9)}
+            print(backend + ': ' + str(flows) + ' flows in ' +
+                  "{0:.1f}s ({1:.1f} flows/sec)".format(seconds,
+                  results[backend]['flows_per_sec']), flush=True)
+
+        if 'farneback' in results:
+            for backend in results:
+                results[backend]['speedup'] = (results[backend]
+                    ['flows_per_sec'] / results['farneback']['flows_per_sec'])
+        return results
+
+    def script(self, work, name, path, arguments):
+
+        with open(os.path.join(work, name + '.log'), 'w') as log:
+            code = subprocess.call([sys.executable, path] + arguments,
+                                   cwd=work, stdout=log,
+                                   stderr=subprocess.STDOUT)
+        if code != 0:
+            print(name + ' failed, see ' + os.path.join(work, name + '.log'),
+                  file=sys.stderr)
+            exit(1)
+
+    def metrics(self, backend, work, dataset, model, flow_mean, workers,
+                nsplits, epochs, seed):
+
+        # Scripts run inside work
+        work = os.path.abspath(os.path.join(work, backend))
+        data = os.path.join(work, 'data') + '/'
+        for c, dirs in zip(self.classes, self.extractor.classes_dirs):
+            for dir in dirs:
+                os.makedirs(os.path.join(data, c, dir), exist_ok=True)
+                link = os.path.join(data, c, dir, dir + self.ext)
+                if not os.path.lexists(link):
+                    os.symlink(os.path.abspath(os.path.join(
+                               self.data_folder, c, dir, dir + self.ext)),
+                               link)
+
+        for name, target in [('VGG16_temporal', model),
+                             ('flow_mean.mat', flow_mean)]:
+            if not os.path.lexists(os.path.join(work, name)):
+                os.symlink(os.path.abspath(target), os.path.join(work, name))
+
+        arguments = ['-data', data, '-class'] + self.classes + ['-input_dim',
+                     str(self.x_size), str(self.y_size), '-ext', self.ext,
+                     '-backend', backend, '-workers', str(workers),
+                     '-resume']
+        if self.flow_dim is not None:
+            arguments += ['-flow_dim'] + [str(d) for d in self.flow_dim]
+        self.script(work, 'optflow_extractor', os.path.join(TEMPORAL_DIR,
+                    'optflow_extractor.py'), arguments)
+
+        self.script(work, 'streams_fextractor', os.path.join(SEMANTIX_DIR,
+                    dataset, 'streams_fextractor.py'), ['-data', data,
+                    '-streams', 'temporal', '-class'] + self.classes + ['-id',
+                    backend, '-ext', self.ext])
+
+        self.script(work, 'train', os.path.join(SEMANTIX_DIR, dataset,
+                    'train.py'), ['-actions', 'cross-train', '-streams',
+                    'temporal', '-class'] + self.classes + ['-ep',
+                    str(epochs), '-lr', '0.0001', '-w0', '1', '-mini_batch',
+                    '64', '-id', backend, '-batch_norm', 'True', '-fold_norm',
+                    '2', '-kfold', 'video', '-nsplits', str(nsplits), '-seed',
+                    str(seed), '-metrics', 'metrics.json'])
+
+        with open(os.path.join(work, 'metrics.json')) as f:
+            return json.load(f)['temporal']
+
+if __name__ == '__main__':
+    print("***********************************************************",
+            file=sys.stderr)
+    print("             SEMANTIX - UNICAMP DATALAB 2018", file=sys.stderr)
+    print("***********************************************************",
+            file=sys.stderr)
+    argp = argparse.ArgumentParser(description='Do flow benchmark tasks')
+    argp.add_argument("-data", dest='data_folder', type=str, nargs=1,
+            help='Usage: -data <path_to_your_data_folder>', required=True)
+    argp.add_argument("-class", dest='classes', type=str, nargs='+',
+            help='Usage: -class <class0_name> <class1_name>..<n-th_class_name>',
+            required=True)
+    argp.add_argument("-ext", dest='ext', type=str, nargs=1,
+            help='Usage: -ext <file_extension> .mp4 | .avi | ...', required=True)
+    argp.add_argument("-backends", dest='backends', type=str, nargs='+',
+            choices=flow_backends.BACKENDS,
+            help='Usage: -backends ' + ' '.join(flow_backends.BACKENDS) +
+                 ' (default: all)',
+            required=False, default=flow_backends.BACKENDS)
+    argp.add_argument("-input_dim", dest='input_dim', type=int, nargs=2,
+            help='Usage: -input_dim <x_dimension> <y_dimension>',
+            required=False, default=[224, 224])
+    argp.add_argument("-flow_dim", dest='flow_dim', type=int, nargs=2,
+            help='Usage: -flow_dim <x_dimension> <y_dimension> (resolution \
+                  the flow is computed at; default: the one of the video)',
+            required=False, default=None)
+    argp.add_argument("-max_frames", dest='max_frames', type=int, nargs=1,
+            help='Usage: -max_frames <frames_of_each_video_timed> (default: \
+                  all)',
+            required=False, default=[None])
+    argp.add_argument("-speed_only", dest='speed_only', action='store_true',
+            help='Usage: -speed_only (no extraction nor training)',
+            required=False)
+    argp.add_argument("-work", dest='work', type=str, nargs=1,
+            help='Usage: -work <folder_for_the_flows_features_and_logs>',
+            required=False, default=['flow_benchmark'])
+    argp.add_argument("-dataset", dest='dataset', type=str, nargs=1,
+            help='Usage: -dataset <folder_of_the_scripts> URFD | FDD | \
+                  Hockey', required=False, default=['URFD'])
+    argp.add_argument("-model", dest='model', type=str, nargs=1,
+            help='Usage: -model <path_to_VGG16_temporal>',
+            required=False, default=['VGG16_temporal'])
+    argp.add_argument("-flow_mean", dest='flow_mean', type=str, nargs=1,
+            help='Usage: -flow_mean <path_to_flow_mean.mat>',
+            required=False, default=['flow_mean.mat'])
+    argp.add_argument("-workers", dest='workers', type=int, nargs=1,
+            help='Usage: -workers <videos_extracted_in_parallel>',
+            required=False, default=[1])
+    argp.add_argument("-nsplits", dest='nsplits', type=int, nargs=1,
+            help='Usage: -nsplits <K: many splits you want (>1)>',
+            required=False, default=[5])
+    argp.add_argument("-ep", dest='ep', type=int, nargs=1,
+            help='Usage: -ep <num_of_epochs>', required=False, default=[500])
+    argp.add_argument("-seed", dest='seed', type=int, nargs=1,
+            help='Usage: -seed <x> (folds of the cross-train)',
+            required=False, default=[1])
+    argp.add_argument("-output", dest='output', type=str, nargs=1,
+            help='Usage: -output <results_json_file>', required=False,
+            default=[None])
+
+    try:
+        args = argp.parse_args()
+    except:
+        argp.print_help(sys.stderr)
+        exit(1)
+
+    benchmark = Flow_benchmark(args.data_folder[0], args.classes, args.ext[0],
+                    args.input_dim[0], args.input_dim[1], args.flow_dim,
+                    args.max_frames[0])
+
+    print("### Speed", flush=True)
+    results = dict([(backend, {'speed': speed}) for backend, speed in
+                    benchmark.speed(args.backends).items()])
+
+    if not args.speed_only:
+        for backend in args.backends:
+            print("### Metrics of " + backend, flush=True)
+            results[backend]['metrics'] = benchmark.metrics(backend,
+                args.work[0], args.dataset[0], args.model[0],
+                args.flow_mean[0], args.workers[0], args.nsplits[0],
+                args.ep[0], args.seed[0])
+
+    print("\n{0:14s} {1:>12s} {2:>8s} {3:>9s} {4:>12s} {5:>12s}".format(
+          'backend', 'flows/sec', 'speedup', 'accuracy', 'sensitivity',
+          'specificity'))
+    for backend in args.backends:
+        speed = results[backend]['speed']
+        line = "{0:14s} {1:12.1f} {2:7.2f}x".format(backend,
+               speed['flows_per_sec'], speed.get('speedup', float('nan')))
+        if 'metrics' in results[backend]:
+            metrics = results[backend]['metrics']['avg']
+            line += " {0:9.4f} {1:12.4f} {2:12.4f}".format(
+                    metrics['accuracy'], metrics['sensitivity'],
+                    metrics['specificity'])
+        print(line, flush=True)
+
+    if args.output[0] is not None:
+        with open(args.output[0], 'w') as f:
+            json.dump(results, f, indent=4)
@@ -1,10 +1,12 @@
-import keras
-from resnet152 import Scale
-from keras.models import load_model
-from keras.utils.generic_utils import CustomObjectScope 
+#import keras
+#from resnet152 import Scale
+#from keras.models import load_model
+#from keras.utils.generic_utils import CustomObjectScope 
 import math
 import sys
 import argparse
+import json
+import time
 import numpy as np
 import scipy.io as sio
 import os
@@ -12,6 +14,11 @@ import glob
 import h5py
 import cv2
 import gc
+import flow_backends
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+                __file__))))
+from video_reader import Video_reader
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 ''' This code is based on Núñez-Marcos, A., Azkune, G., & Arganda-Carreras, 
     I. (2017). "Vision-Based Fall Detection with Convolutional Neural Networks"
@@ -26,19 +33,70 @@ import gc
 
     extract
     extract_optflow
+    extract_video
+    decode_threads
+    extracted
+    mark_extracted
+    write
+    gray
+    flow
+    resize
+    clean_magnitude
 
     The only method that should be called outside of this class is:
 
     extract: simply calls to extract_optflow for it's multiple classes
 
     extract_optflow: extracts opticalflows from videos using Farnebacks's
-    algorithm and stores in the same folder that the video is.
+    algorithm and stores in the same folder that the video is. With more
+    than one worker, the videos are extracted in parallel by a pool of
+    processes, one video per process; the first video a worker fails on is
+    reported and ends the extraction.
+
+    extract_video: extracts the flows of a single video, raising IOError if
+    it can't be read. Only flow_x (the angle) and flow_y (the normalized
+    magnitude) are read by the temporal stream, flow_z (the BGR
+    visualization) is written only if asked for.
+    Once a video is done, a .optflow.json file in its folder records it, so
+    with resume the videos already extracted (and not changed since) are
+    skipped. Videos are read by Video_reader (Data_extraction/video_reader.py).
+
+    decode_threads: the threads FFmpeg decodes a video with, 1 when the
+    videos are extracted by a pool of processes.
+
+    extracted: whether the .optflow.json of a video says it was already
+    extracted, from the same video and with the same options.
+
+    mark_extracted: writes the .optflow.json of a video.
+
+    write: writes flow_x, flow_y and flow_z (if there is one) of a flow.
+
+    gray: the gray frame the flow is computed on. By default the flow is
+    computed at the resolution of the video; with a flow_dim (the input_dim
+    of the model, or any working resolution) frames are first shrunk to it,
+    averaging the pixels they cover (INTER_AREA), which makes Farneback
+    cost proportional to the working resolution instead of the one of the
+    video.
+
+    flow: flow_x, flow_y and, if asked for, flow_z of two consecutive gray
+    frames. The flow is computed by a backend of flow_backends.py, Farneback
+    by default.
+
+    resize: with a flow_dim, flows are written at input_dim, like the images
+    the temporal stream reads. The angle (flow_x) is resized with nearest
+    neighbour, since it wraps around, the magnitude is interpolated.
+
+    clean_magnitude: sets to 0, in place, the NaN and Inf values that
+    cartToPolar may return in the magnitude of a flow.
 '''
 
+# Record of the videos already extracted, inside the folder of each video
+DONE_FILE = '.optflow.json'
 
 class Optflow_extractor:
 
-    def __init__(self, classes, x_size, y_size, ext):
+    def __init__(self, classes, x_size, y_size, ext, flow_z=False, 
+                 workers=1, resume=False, flow_dim=None, backend='farneback'):
         self.classes = classes 
         self.ext = ext
         self.classes_dirs = []
@@ -48,9 +106,24 @@ class Optflow_extractor:
         self.class_value = []
         self.x_size = x_size
         self.y_size = y_size
+        self.flow_z = flow_z
+        self.workers = workers
+        self.resume = resume
+        self.backend = flow_backends.create(backend)
+        self.flow_dim = None
+        if flow_dim is not None:
+            self.flow_dim = list(flow_dim)
 
     def extract(self, data_folder):
 
+        '''
+            todo: this isn't fine and only will work for urfd data set
+        '''
+        if self.x_size != 224 or self.y_size != 224:
+            print("-input_dim 224 224 are obrigatory so far. sorry.",
+                   file=sys.stderr)
+            exit(1)
+
         self.get_dirs(data_folder)
     
         for i in range(len(self.classes)):
@@ -60,61 +133,189 @@ class Optflow_extractor:
 
     def extract_optflow(self, data_folder, videos, dirs, class_):
 
-        for (video, dir) in zip(videos, dirs): 
-            print(dir)
-            counter = 1
-            cap = cv2.VideoCapture(video)
-            success, frame1 = cap.read()
-            try:
-                prvs = cv2.cvtColor(frame1, cv2.COLOR_BGR2GRAY)
-            except cv2.error as e:
-                print("Inside every folder in dataset it's expected a valid" +
-                "(non-empty) video with name equal to the folder + .mp4." +
-                "In your case, inside %s it's expected a %s video" 
-                % (data_folder + class_ + '/' + dir, video)
-                , file=sys.stderr)
-                exit(1)
-            hsv = np.zeros_like(frame1)
-            hsv[...,1] = 255
-            path = data_folder + class_ +  '/' + dir
-            while True:
-                success, frame2 = cap.read()
-                if success == False:
-                    break
-
-                next = cv2.cvtColor(frame2, cv2.COLOR_BGR2GRAY)
-                flow = cv2.calcOpticalFlowFarneback(prvs, next, None, 
-                        0.702, 5, 10, 2, 7, 1.5, 0)
-                mag, ang = cv2.cartToPolar(flow[...,0], flow[...,1])
-                # todo: (ALERT) because of a unknown reason cartToPolar is 
-                # returning -inf for some mag positions and than normalize
-                # gets all 0...
-                for i in range(len(mag)):
-                    for j in range(len(mag[i])):
-                        if math.isnan(mag[i][j]) or math.isinf(mag[i][j]):
-                            mag[i][j] = 0
-                hsv[...,0] = ang*180/np.pi/2
-                hsv[...,2] = cv2.normalize(mag, None, 0, 255, cv2.NORM_MINMAX)
-                bgr = cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)
-
-                '''
-                    todo: this isn't fine and only will work for urfd data set
-                '''
-                if self.x_size != 224 or self.y_size != 224:
-                    print("-input_dim 224 224 are obrigatory so far. sorry.",
-                           file=sys.stderr)
+        print(class_ + ': ' + str(len(videos)) + ' videos', flush=True)
+        begin = time.perf_counter()
+        flows = 0
+        done = 0
+        jobs = list(zip(videos, dirs))
+
+        def progress(dir, amount):
+            done_ratio = done / max(1, len(jobs))
+            if amount is None:
+                status = 'already extracted'
+            else:
+                status = str(amount) + ' flows'
+            print("\rProgress: [{0:50s}] {1:.1f}% {2}: {3}".format('#' * 
+                  int(done_ratio * 50), done_ratio*100, dir, status).ljust(
+                  100), end="", flush=True)
+
+        if self.workers > 1:
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                futures = dict([(executor.submit(self.extract_video, 
+                               data_folder, video, dir, class_), (video, dir)) 
+                               for (video, dir) in jobs])
+                for future in as_completed(futures):
+                    video, dir = futures[future]
+                    try:
+                        amount = future.result()
+                    except Exception as e:
+                        # The videos not started yet are dropped, the ones
+                        # running are waited for before exiting
+                        print("\nError extracting " + video + ": " + str(e),
+                              file=sys.stderr, flush=True)
+                        # cancel_futures of shutdown needs Python 3.9
+                        for pending in futures:
+                            pending.cancel()
+                        executor.shutdown(wait=False)
+                        exit(1)
+                    done += 1
+                    flows += amount or 0
+                    progress(dir, amount)
+        else:
+            for (video, dir) in jobs: 
+                try:
+                    amount = self.extract_video(data_folder, video, dir, 
+                                                class_)
+                except IOError as e:
+                    print("\n" + str(e), file=sys.stderr)
                     exit(1)
+                done += 1
+                flows += amount or 0
+                progress(dir, amount)
+
+        seconds = time.perf_counter() - begin
+        print("\n" + class_ + ': ' + str(flows) + ' flows in ' + 
+              "{0:.1f}s ({1:.1f} flows/sec)".format(seconds, flows / 
+              max(seconds, 1e-9)), flush=True)
+
+    def extract_video(self, data_folder, video, dir, class_):
+
+        path = data_folder + class_ +  '/' + dir
+        if self.resume and self.extracted(video, path):
+            return None
+
+        counter = 1
+        try:
+            reader = Video_reader(video, threads=self.decode_threads())
+            frames = reader.frames()
+            prvs = self.gray(next(frames))
+        except (IOError, StopIteration) as e:
+            # Raised, not exit(1): in a worker of the pool, the parent
+            # reports the video and stops the extraction
+            raise IOError("Inside every folder in dataset it's expected a " +
+            "valid (non-empty) video with name equal to the folder + .mp4. " +
+            "In your case, inside %s it's expected a %s video" 
+            % (data_folder + class_ + '/' + dir, video))
+        for frame in frames:
+            next_ = self.gray(frame)
+            self.write(path, counter, self.resize(*self.flow(prvs, next_)))
+            counter += 1
+            prvs = next_
+        reader.release()
+
+        self.mark_extracted(video, path, counter - 1)
+        return counter - 1
+
+    def decode_threads(self):
+
+        # With a pool of processes, one decoding thread each
+        if self.workers > 1:
+            return 1
+        return 0
+
+    def extracted(self, video, path):
+
+        try:
+            with open(os.path.join(path, DONE_FILE)) as f:
+                done = json.load(f)
+            return (done['mtime'] == self.mtime(video) and (done['flow_z'] 
+                    or not self.flow_z) and done.get('flow_dim') == 
+                    self.flow_dim and done.get('backend', 'farneback') == 
+                    self.backend.name)
+        except (OSError, ValueError, KeyError):
+            return False
+
+    def mark_extracted(self, video, path, flows):
+
+        # Written last, a video interrupted is extracted again
+        done_file = os.path.join(path, DONE_FILE)
+        with open(done_file + '.tmp', 'w') as f:
+            json.dump({'mtime': self.mtime(video), 'flows': flows, 
+                       'flow_z': self.flow_z, 'flow_dim': self.flow_dim,
+                       'backend': self.backend.name}, f)
+        os.replace(done_file + '.tmp', done_file)
+
+    def mtime(self, video):
+
+        if os.path.isfile(video):
+            return os.path.getmtime(video)
+        return 0
+
+    def write(self, path, counter, flows):
+
+        flow_x, flow_y, flow_z = flows
+        cv2.imwrite(path + '/' + 'flow_x_' + str(counter).zfill(5) + 
+                '.jpg', flow_x)
+        cv2.imwrite(path + '/' + 'flow_y_' + str(counter).zfill(5) +
+                '.jpg', flow_y)
+        if flow_z is not None:
+            cv2.imwrite(path + '/' + 'flow_z_' + str(counter).zfill(5) + 
+                    '.jpg', flow_z)
+
+    def gray(self, frame):
+
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        if self.flow_dim is None:
+            return gray
+
+        x_dim, y_dim = self.flow_dim
+        if x_dim < gray.shape[0] or y_dim < gray.shape[1]:
+            interpolation = cv2.INTER_AREA
+        else:
+            interpolation = cv2.INTER_LINEAR
+        return cv2.resize(gray, (y_dim, x_dim), interpolation=interpolation)
+
+    def flow(self, prvs, next):
+
+        flow = self.backend.flow(prvs, next)
+        mag, ang = cv2.cartToPolar(flow[...,0], flow[...,1])
+        # todo: (ALERT) because of a unknown reason cartToPolar is 
+        # returning -inf for some mag positions and than normalize
+        # gets all 0...
+        self.clean_magnitude(mag)
+
+        # Same values the hsv image used to get: the angle in [0, 180) and
+        # the magnitude normalized to [0, 255], truncated to uint8
+        flow_x = (ang*180/np.pi/2).astype(np.uint8)
+        flow_y = cv2.normalize(mag, None, 0, 255, 
+                               cv2.NORM_MINMAX).astype(np.uint8)
+
+        flow_z = None
+        if self.flow_z:
+            hsv = np.empty(shape=flow_x.shape + (3,), dtype=np.uint8)
+            hsv[...,0] = flow_x
+            hsv[...,1] = 255
+            hsv[...,2] = flow_y
+            flow_z = cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)
+
+        return flow_x, flow_y, flow_z
+
+    def resize(self, flow_x, flow_y, flow_z):
+
+        if self.flow_dim is None or flow_x.shape == (self.x_size, 
+                                                     self.y_size):
+            return flow_x, flow_y, flow_z
+
+        size = (self.y_size, self.x_size)
+        flow_x = cv2.resize(flow_x, size, interpolation=cv2.INTER_NEAREST)
+        flow_y = cv2.resize(flow_y, size, interpolation=cv2.INTER_LINEAR)
+        if flow_z is not None:
+            flow_z = cv2.resize(flow_z, size, interpolation=cv2.INTER_LINEAR)
+        return flow_x, flow_y, flow_z
+
+    def clean_magnitude(self, mag):
 
-                cv2.imwrite(path + '/' + 'flow_x_' + str(counter).zfill(5) + 
-                        '.jpg', hsv[..., 0])
-                cv2.imwrite(path + '/' + 'flow_y_' + str(counter).zfill(5) +
-                        '.jpg', hsv[..., 2])
-                cv2.imwrite(path + '/' + 'flow_z_' + str(counter).zfill(5) + 
-                        '.jpg', bgr)
-                counter += 1
-                prvs = next
-            cap.release()
-            cv2.destroyAllWindows()
+        mag[~np.isfinite(mag)] = 0
 
     def get_dirs(self, data_folder):
 
@@ -146,6 +347,26 @@ if __name__ == '__main__':
             help='Usage: -input_dim <x_dimension> <y_dimension>', required=True)
     argp.add_argument("-ext", dest='ext', type=str, nargs=1, 
             help='Usage: -ext <file_extension> .mp4 | .avi | ...', required=True)
+    argp.add_argument("-flow_z", dest='flow_z', action='store_true',
+            help='Usage: -flow_z (also writes flow_z, the BGR visualization \
+                  of the flow, not used by the temporal stream)',
+            required=False)
+    argp.add_argument("-workers", dest='workers', type=int, nargs=1,
+            help='Usage: -workers <videos_extracted_in_parallel>', 
+            required=False, default=[1])
+    argp.add_argument("-resume", dest='resume', action='store_true',
+            help='Usage: -resume (skips the videos already extracted)',
+            required=False)
+    argp.add_argument("-flow_dim", dest='flow_dim', type=int, nargs=2,
+            help='Usage: -flow_dim <x_dimension> <y_dimension> (resolution \
+                  the flow is computed at, e.g. the input_dim; default: the \
+                  one of the video)',
+            required=False, default=None)
+    argp.add_argument("-backend", dest='backend', type=str, nargs=1,
+            choices=flow_backends.BACKENDS,
+            help='Usage: -backend <' + ' | '.join(flow_backends.BACKENDS) + 
+                 '> (default: farneback)',
+            required=False, default=['farneback'])
     
     try:
         args = argp.parse_args()
@@ -154,7 +375,9 @@ if __name__ == '__main__':
         exit(1)
 
     optflow_extractor = Optflow_extractor(args.classes, args.input_dim[0],
-                        args.input_dim[1], args.ext[0])
+                        args.input_dim[1], args.ext[0], args.flow_z, 
+                        args.workers[0], args.resume, args.flow_dim,
+                        args.backend[0])
     optflow_extractor.extract(args.data_folder[0])
 
 '''
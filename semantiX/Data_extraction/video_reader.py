@@ -0,0 +1,267 @@
+import bisect
+import json
+import os
+import cv2
+
+''' Documentation: class Video_reader
+
+    The way the extractors of Data_extraction read a video, instead of a
+    plain cv2.VideoCapture.
+
+    The methods are:
+
+    frames
+    read
+    length
+    width
+    height
+    fps
+    release
+
+    frames: all the frames of the video, in order. Decoding every frame
+    also gives the exact amount of frames and the index of the video for
+    free, so a video read to the end is never decoded again to count it.
+
+    read: amount frames from the frame first, with frame accurate random
+    access. From the index, the reader goes forward from where it is when
+    no key frame is on the way (no seek), or seeks otherwise, and checks
+    the timestamp of the frame it lands on: a container that can't seek to
+    the exact frame is decoded from the start.
+
+    length: the exact amount of frames, counted from the decoded stream,
+    not CAP_PROP_FRAME_COUNT, which comes from the container and is wrong
+    for some of them.
+
+    width, height, fps: of the video, as the container gives them.
+
+    The index of a video is its amount of frames, the timestamp of each
+    frame and its key frames. It is written next to the video, as
+    .<video>.index.json, and used again while the video doesn't change.
+    Building it without frames() only grabs the frames, they are never
+    converted to images.
+
+    With a size (width, height), frames are shrunk to it as they are
+    decoded (INTER_AREA, INTER_LINEAR to grow them). threads is the amount
+    of threads FFmpeg decodes with, 0 lets OpenCV choose; with a pool of
+    processes, 1 avoids many threads fighting for the same cores. Only the
+    FFmpeg of the local OpenCV build is used, with OpenCV's own backends
+    as the fallback, and the key frames and timestamps are only recorded
+    when that build gives them.
+'''
+
+INDEX_SUFFIX = '.index.json'
+KEY_FRAME = ord('I')
+# Without key frames in the index, farther than that a seek is done
+SEEK_DISTANCE = 16
+
+class Video_reader:
+
+    def __init__(self, video, size=None, threads=0, cache=True):
+        self.video = video
+        self.size = size
+        self.threads = threads
+        self.cache = cache
+        self.cap = None
+        # Number of the next frame decoded
+        self.position = 0
+        self.index = self.load_index()
+
+    def open(self):
+
+        if self.cap is not None:
+            self.cap.release()
+
+        cap = None
+        params = []
+        if self.threads > 0 and hasattr(cv2, 'CAP_PROP_N_THREADS'):
+            params = [cv2.CAP_PROP_N_THREADS, self.threads]
+        try:
+            cap = cv2.VideoCapture(self.video, cv2.CAP_FFMPEG, params)
+        except (cv2.error, TypeError, AttributeError):
+            pass
+        if cap is None or not cap.isOpened():
+            cap = cv2.VideoCapture(self.video)
+        if not cap.isOpened():
+            raise IOError("Can't open " + self.video)
+
+        self.cap = cap
+        self.position = 0
+
+    def frames(self):
+
+        self.open()
+        pts = []
+        key_frames = []
+        while self.cap.grab():
+            stamp = self.get('CAP_PROP_PTS')
+            key = self.get('CAP_PROP_FRAME_TYPE') == KEY_FRAME
+            ret, frame = self.cap.retrieve()
+            if ret == False:
+                break
+            pts.append(stamp)
+            if key:
+                key_frames.append(self.position)
+            self.position += 1
+            yield self.shrink(frame)
+
+        if self.index is None:
+            self.save_index(pts, key_frames)
+
+    def read(self, first, amount):
+
+        index = self.get_index()
+        last = min(first + amount, index['frames'])
+        if first >= last:
+            return []
+
+        self.seek(first)
+        frames = []
+        exact = index['pts'][first] is None
+        while self.position < last:
+            if not self.cap.grab():
+                break
+            if not exact and self.get('CAP_PROP_PTS') != index['pts'][first]:
+                exact = True
+                # The seek missed the frame, decoded from the start
+                self.open()
+                self.forward(first)
+                continue
+            exact = True
+            ret, frame = self.cap.retrieve()
+            if ret == False:
+                break
+            self.position += 1
+            frames.append(self.shrink(frame))
+        return frames
+
+    def seek(self, first):
+
+        if self.cap is None:
+            self.open()
+        if first == self.position:
+            return
+
+        key_frames = self.get_index()['key_frames']
+        if key_frames:
+            # The key frame a seek to first decodes from
+            key = key_frames[max(0, bisect.bisect_right(key_frames,
+                                                        first) - 1)]
+            ahead = self.position < first and key <= self.position
+        else:
+            ahead = self.position < first <= self.position + SEEK_DISTANCE
+        if ahead:
+            self.forward(first)
+        else:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, first)
+            self.position = first
+
+    def forward(self, first):
+
+        while self.position < first and self.cap.grab():
+            self.position += 1
+
+    def shrink(self, frame):
+
+        if self.size is None or (frame.shape[1], frame.shape[0]) == tuple(
+                                 self.size):
+            return frame
+        if self.size[0] < frame.shape[1] or self.size[1] < frame.shape[0]:
+            interpolation = cv2.INTER_AREA
+        else:
+            interpolation = cv2.INTER_LINEAR
+        return cv2.resize(frame, tuple(self.size),
+                          interpolation=interpolation)
+
+    def get(self, name):
+
+        # Properties missing in older OpenCV builds are None
+        if not hasattr(cv2, name):
+            return None
+        value = self.cap.get(getattr(cv2, name))
+        if value == -1:
+            return None
+        return value
+
+    def length(self):
+
+        return self.get_index()['frames']
+
+    def width(self):
+
+        if self.cap is None:
+            self.open()
+        return int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+
+    def height(self):
+
+        if self.cap is None:
+            self.open()
+        return int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+    def fps(self):
+
+        if self.cap is None:
+            self.open()
+        return self.cap.get(cv2.CAP_PROP_FPS)
+
+    def get_index(self):
+
+        if self.index is None:
+            # Only grabbed, the frames are never converted
+            self.open()
+            pts = []
+            key_frames = []
+            while self.cap.grab():
+                pts.append(self.get('CAP_PROP_PTS'))
+                if self.get('CAP_PROP_FRAME_TYPE') == KEY_FRAME:
+                    key_frames.append(self.position)
+                self.position += 1
+            self.save_index(pts, key_frames)
+        return self.index
+
+    def index_file(self):
+
+        return os.path.join(os.path.dirname(self.video), '.' +
+                            os.path.basename(self.video) + INDEX_SUFFIX)
+
+    def stamp(self):
+
+        try:
+            return [os.path.getmtime(self.video),
+                    os.path.getsize(self.video)]
+        except OSError:
+            return None
+
+    def load_index(self):
+
+        if not self.cache:
+            return None
+        try:
+            with open(self.index_file()) as f:
+                index = json.load(f)
+            if index['stamp'] == self.stamp() and index['frames'] == len(
+                                                            index['pts']):
+                return index
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        return None
+
+    def save_index(self, pts, key_frames):
+
+        self.index = {'stamp': self.stamp(), 'frames': len(pts), 'pts': pts,
+                      'key_frames': key_frames}
+        if not self.cache:
+            return
+        # A folder that can't be written only loses the cache
+        try:
+            with open(self.index_file() + '.tmp', 'w') as f:
+                json.dump(self.index, f)
+            os.replace(self.index_file() + '.tmp', self.index_file())
+        except OSError:
+            pass
+
+    def release(self):
+
+        if self.cap is not None:
+            self.cap.release()
+            self.cap = None
@@ -12,6 +12,9 @@ import glob
 import h5py
 import cv2
 import gc
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+                __file__))))
+from video_reader import Video_reader
 
 ''' Documentation: class Visual_Rythm_extractor
     
@@ -19,14 +22,49 @@ import gc
 
     extract
     extract_visual_rythm
+    profiles
+    profile
+    stack
+    windows
+    resize
+    weights
 
     The only method that should be called outside of this class is:
 
     extract: simply calls to extract_visual_rythm for it's multiple classes
 
     extract_visual_rythm: extracts vertical and horizontal visual rythm from the video.
+
+    profiles: decodes a video once, in order, and keeps for every frame its
+    horizontal profile (the mean of its rows, or its centre row) and its
+    vertical profile (the mean of its columns, or its centre column). The
+    length of the video is the exact amount of frames Video_reader decoded
+    (Data_extraction/video_reader.py), not the frame count of its container.
+
+    profile: the horizontal and vertical profiles of a single frame.
+
+    stack: the profiles of all the frames of a video as uint8 arrays.
+
+    windows: writes the visual rythm of every window of window frames: the
+    forward windows (frames fi..fi+window-1, for each fi) and then the
+    backward ones (frames fi..fi-window+1, from the last frame), numbered in
+    that order as ritmo_<count>_h.jpg and ritmo_<count>_v.jpg, and returns
+    the amount of windows written. Windows are sliding views of the
+    profiles, nothing is decoded again. The ritmo stream of the
+    streams_fextractor of each dataset only reads the ritmo_*_h.jpg images,
+    one per window as the other streams; the ritmo_*_v.jpg ones are the
+    vertical rhythm, kept beside them but not a stream.
+
+    resize: the 224x224 images of many windows at once. The profiles are
+    resized along their length once for all the frames, and the windows
+    along time with the weights of the same linear interpolation cv2.resize
+    does (up to a rounding of 1).
 '''
 
+# Side of the images written
+RYTHM_SIZE = 224
+# Windows resized at once
+WINDOWS_BATCH = 64
 
 class Visual_Rythm_extractor:
 
@@ -52,96 +90,110 @@ class Visual_Rythm_extractor:
 
         for (video, dir) in zip(videos, dirs): 
             print (video) 
-            #print(dir)
             path = data_folder + class_ +  '/' + dir 
-            cap = cv2.VideoCapture(video)
-            #sucess, frame1 = cap.read( )
-            #print (sucess)
-            length = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-            width = cap.get(cv2.CAP_PROP_FRAME_WIDTH)   # float
-            height = cap.get(cv2.CAP_PROP_FRAME_HEIGHT) # float
-            #print (width)
-            #print (height)
-            hor_vr = np.array([]).reshape(0,int(width),3)
-            ver_vr = np.array([]).reshape(0,int(height),3)
-            #window = 10 
-            count = 1
-            for fi in range (0,(length+1)-window):
-                #print (fi)
-                foward = True
-                self.vr(video, width, height, hor_vr, ver_vr, fi, window, path, foward, count)
-                count = count + 1
-            print ("---------------------------------###---------------------------------------")
-            for fi in range (length-1,(length)-window, -1):
-                #print (fi)
-                foward =  False
-                self.vr (video, width, height, hor_vr, ver_vr, fi, window, path, foward, count)
-                count = count + 1
-                
-    def vr (self, video, width, height, hor_vr, ver_vr, fi, window, path, foward, count):
-        cap = cv2.VideoCapture(video)
-        
-        if foward == True:
-            ff = fi + window
-            for fr in range(fi,ff):
-                #print (fr)
-                #print (fr+10)
-                cap.set(1,fr);
-                ret, img = cap.read()
-                #print (ret)
-                if ret == True:
-                    #print ('TRUE')
-                    #frames+=1
-                    if(self.mean):
-                        #print ('if')
-                        hor = np.mean(img, axis=0)
-                        ver = np.mean(img, axis=1)
-                    else:
-                        #print ('else')
-                        hor = img[int(height/2),:]
-                        ver = img[:,int(width/2)]
-                    hor_vr = np.vstack([hor_vr,[hor]])
-                    ver_vr = np.vstack([ver_vr,[ver]])
-                    #print (hor_vr)
-                else:
-                    #print ('breaked')
-                    break
-        else:
-            ff = (fi + 1) - window
-            #print (ff)
-            for fr in range(fi,ff-1,-1):
-                #print (fr)
-                #print (fr-10)
-                cap.set(1,fr);
-                ret, img = cap.read()
-                #print (ret)
-                if ret == True:
-                    #print ('TRUE')
-                    #frames+=1
-                    if(self.mean):
-                        #print ('if')
-                        hor = np.mean(img, axis=0)
-                        ver = np.mean(img, axis=1)
-                    else:
-                        #print ('else')
-                        hor = img[int(height/2),:]
-                        ver = img[:,int(width/2)]
-                    hor_vr = np.vstack([hor_vr,[hor]])
-                    ver_vr = np.vstack([ver_vr,[ver]])
-                    #print (hor_vr)
-                else:
-                    #print ('breaked')
-                    break
-
-        hor_vr = hor_vr.astype(np.uint8)
-        ver_vr = ver_vr.astype(np.uint8)
-        ph = path + '/ritmo_'+str(count).zfill(5)+'_h.jpg'
-        pv = path + '/ritmo_'+str(count).zfill(5)+'_v.jpg'
-        img1 = cv2.resize(np.asarray(hor_vr), (224, 224))
-        cv2.imwrite(ph, img1)
-    
-        cap.release()
-        #cv2.destroyAllWindows()
+            hor, ver, length = self.profiles(video)
+            self.windows(hor, ver, length, window, path)
+
+    def profiles(self, video):
+
+        reader = Video_reader(video)
+        hor = []
+        ver = []
+        for img in reader.frames():
+            h, v = self.profile(img)
+            hor.append(h)
+            ver.append(v)
+
+        hor, ver = self.stack(hor, ver, reader.width(), reader.height())
+        reader.release()
+        return hor, ver, reader.length()
+
+    def profile(self, img):
+
+        if(self.mean):
+            return np.mean(img, axis=0), np.mean(img, axis=1)
+        # Copies, a view would keep the whole frame alive
+        return (img[img.shape[0]//2,:].copy(), 
+                img[:,img.shape[1]//2].copy())
+
+    def stack(self, hor, ver, width, height):
+
+        # Truncated to uint8, as the images always were
+        hor = np.asarray(hor).reshape(len(hor), int(width), 3)
+        ver = np.asarray(ver).reshape(len(ver), int(height), 3)
+        return hor.astype(np.uint8), ver.astype(np.uint8)
+
+    def windows(self, hor, ver, length, window, path):
+
+        # (first frame, frames, backward) of every window, in the order they
+        # are numbered. A window that goes past the frames decoded is cut
+        frames = len(hor)
+        windows = []
+        for fi in range(0, (length+1)-window):
+            windows.append((fi, min(window, frames - fi), False))
+        for fi in range(length-1, (length)-window, -1):
+            first = max(fi - window + 1, 0)
+            windows.append((first, max(0, min(fi + 1, frames) - first), True))
+
+        written = 0
+        for profile, suffix in [(hor, '_h.jpg'), (ver, '_v.jpg')]:
+            if frames == 0:
+                break
+            written = 0
+            wide = cv2.resize(profile.astype(np.float32), (RYTHM_SIZE, 
+                              frames), interpolation=cv2.INTER_LINEAR)
+            for begin in range(0, len(windows), WINDOWS_BATCH):
+                batch = windows[begin:begin + WINDOWS_BATCH]
+                for (count, img) in zip(range(begin + 1, begin + len(batch) 
+                                        + 1), self.resize(wide, batch)):
+                    if img is not None:
+                        cv2.imwrite(path + '/ritmo_' + str(count).zfill(5) +
+                                    suffix, img)
+                        written += 1
+        return written
+
+    def resize(self, wide, windows):
+
+        images = [None] * len(windows)
+
+        # Windows of the same amount of frames share their interpolation
+        for amount in set([w[1] for w in windows if w[1] > 0]):
+            weights = self.weights(amount)
+            picked = [i for i in range(len(windows)) if windows[i][1] == 
+                      amount]
+            # Every window of amount frames as a view of wide, with time as
+            # its last axis (sliding_window_view needs numpy 1.20)
+            views = np.lib.stride_tricks.as_strided(wide, shape=(len(wide) - 
+                    amount + 1,) + wide.shape[1:] + (amount,), strides=
+                    wide.strides + (wide.strides[0],), writeable=False)
+            stacked = views[[windows[i][0] for i in picked]]
+            backward = np.asarray([windows[i][2] for i in picked])
+            if backward.any():
+                stacked[backward] = stacked[backward][..., ::-1]
+            resized = np.einsum('ij,bcdj->bicd', weights, stacked)
+            resized = np.clip(np.rint(resized), 0, 255).astype(np.uint8)
+            for i, img in zip(picked, resized):
+                images[i] = img
+
+        return images
+
+    def weights(self, amount):
+
+        # Linear interpolation from amount rows to RYTHM_SIZE rows, with the
+        # pixel centres cv2.resize uses
+        weights = np.zeros(shape=(RYTHM_SIZE, amount), dtype=np.float32)
+        for i in range(RYTHM_SIZE):
+            f = (i + 0.5) * amount / RYTHM_SIZE - 0.5
+            j = int(np.floor(f))
+            a = f - j
+            if j < 0:
+                j, a = 0, 0.0
+            if j >= amount - 1:
+                j, a = amount - 1, 0.0
+            weights[i, j] += 1 - a
+            if a > 0:
+                weights[i, j + 1] += a
+        return weights
 
     def get_dirs(self, data_folder):
 
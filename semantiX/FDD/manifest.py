@@ -0,0 +1,213 @@
+import fnmatch
+import gzip
+import json
+import os
+import cv2
+
+''' Documentation: class Manifest
+
+    Index of a data folder organized as <data>/<class>/<video>/, built with
+    a single walk over the tree and kept in a compact file (a gzipped json,
+    .manifest.json.gz inside the data folder) to be reused by the next runs.
+
+    For each class it keeps the sorted list of its video folders and, for
+    each video folder, the sorted list of its files, the amount of files of
+    each kind of image (frame_, flow_x, flow_y, pose_, ...), the newest
+    mtime among the files of each kind and the amount of frames and fps of
+    its video.
+
+    A class, or a video folder, is listed again only when the mtime of its
+    directory changed since it was indexed (when PATTERNS changed, the
+    images of its folders are counted and stat'ed again), and a video is
+    opened again only when its own mtime changed. Everything else comes
+    from the index, so a run over an unchanged dataset costs one stat per
+    directory.
+
+    scan
+    counts
+    newest_files
+    stat_files
+    save
+    dirs
+    mtime
+    names
+    files
+    count
+    newest
+    video
+
+    Videos are identified, as in the registry of feature_store, by
+    'class/dir'.
+'''
+
+# Kinds of images produced by Data_extraction. The ritmo stream is the
+# horizontal rhythm, the ritmo_*_v.jpg images beside it are not a stream
+PATTERNS = {'frame': 'frame_*.jpg', 'flow_x': 'flow_x*.jpg',
+            'flow_y': 'flow_y*.jpg', 'pose': 'pose_*.jpg',
+            'ritmo': 'ritmo_*_h.jpg', 'depth': 'depth_*.jpg',
+            'saliency': 'saliency_*.png'}
+
+MANIFEST_FILE = '.manifest.json.gz'
+
+class Manifest:
+
+    def __init__(self, data_folder, classes, path=None):
+        self.data_folder = data_folder
+        self.classes = classes
+        if path is None:
+            path = os.path.join(data_folder, MANIFEST_FILE)
+        self.path = path
+
+        self.index = {'classes': dict(), 'videos': dict()}
+        # Names of a video filtered by a pattern, computed once per run
+        self.filtered = dict()
+        self.changed = False
+
+    def scan(self):
+
+        cached = {'classes': dict(), 'videos': dict()}
+        if os.path.isfile(self.path):
+            try:
+                with gzip.open(self.path, 'rt') as f:
+                    cached = json.load(f)
+            except (OSError, ValueError):
+                print("### Rebuilding the broken manifest " + self.path,
+                      flush=True)
+
+        # Classes and videos that are not in data_folder anymore are dropped
+        self.index = {'classes': dict(), 'videos': dict(),
+                      'patterns': PATTERNS}
+        self.changed = cached.get('patterns') != PATTERNS
+        for c in self.classes:
+            path = os.path.join(self.data_folder, c)
+            mtime = os.path.getmtime(path)
+            entry = cached['classes'].get(c)
+            if entry is None or entry['mtime'] != mtime:
+                self.changed = True
+                entry = {'mtime': mtime, 'dirs': sorted([f for f in
+                         os.listdir(path) if os.path.isdir(
+                         os.path.join(path, f))])}
+            self.index['classes'][c] = entry
+
+            for dir in entry['dirs']:
+                key = c + '/' + dir
+                folder = os.path.join(path, dir)
+                mtime = os.path.getmtime(folder)
+                video = cached['videos'].get(key)
+                if video is None or video['mtime'] != mtime:
+                    self.changed = True
+                    video = {'mtime': mtime, 'names': sorted(os.listdir(
+                             folder)), 'videos': video['videos'] if
+                             video is not None else dict()}
+                # Images are counted and stat'ed once per change of the
+                # folder, not on every run
+                if 'newest' not in video or cached.get('patterns') != \
+                   PATTERNS:
+                    self.changed = True
+                    video['counts'] = self.counts(video['names'])
+                    video['newest'] = self.newest_files(folder,
+                                                        video['names'])
+                self.index['videos'][key] = video
+
+        self.filtered = dict()
+
+    def counts(self, names):
+        return dict([(kind, len(fnmatch.filter(names, pattern))) for kind,
+                    pattern in PATTERNS.items()])
+
+    def newest_files(self, folder, names):
+        return dict([(kind, max([0] + list(self.stat_files(folder,
+                    fnmatch.filter(names, pattern))))) for kind, pattern in
+                    PATTERNS.items()])
+
+    def stat_files(self, folder, names):
+
+        # mtimes of the files of a folder, a file removed since the folder
+        # was listed is skipped
+        for name in names:
+            try:
+                yield os.path.getmtime(os.path.join(folder, name))
+            except OSError:
+                pass
+
+    def save(self):
+
+        if not self.changed:
+            return
+
+        # The index is replaced at once, and it's only a cache: if it can't
+        # be written the next run just scans again
+        try:
+            with gzip.open(self.path + '.tmp', 'wt') as f:
+                json.dump(self.index, f, separators=(',', ':'))
+            os.replace(self.path + '.tmp', self.path)
+            self.changed = False
+        except OSError as error:
+            print("### Manifest not saved: " + str(error), flush=True)
+
+    def dirs(self, c):
+        return self.index['classes'][c]['dirs']
+
+    def mtime(self, key):
+        return self.index['videos'][key]['mtime']
+
+    def names(self, key):
+        return self.index['videos'][key]['names']
+
+    def files(self, key, pattern):
+
+        if (key, pattern) not in self.filtered:
+            self.filtered[(key, pattern)] = fnmatch.filter(self.names(key),
+                                                           pattern)
+        return self.filtered[(key, pattern)]
+
+    def count(self, key, pattern):
+
+        for kind in PATTERNS:
+            if PATTERNS[kind] == pattern:
+                return self.index['videos'][key]['counts'][kind]
+        return len(self.files(key, pattern))
+
+    def newest(self, key, *patterns):
+
+        # Newest mtime among the files of a folder matched by the patterns,
+        # 0 without any, from the index for the patterns of PATTERNS
+        newest = 0
+        for pattern in patterns:
+            kinds = [kind for kind in PATTERNS if PATTERNS[kind] == pattern]
+            if kinds:
+                newest = max(newest, self.index['videos'][key]['newest'][
+                             kinds[0]])
+            else:
+                newest = max([newest] + list(self.stat_files(os.path.join(
+                             self.data_folder, key), self.files(key,
+                             pattern))))
+        return newest
+
+    def video(self, key, ext):
+
+        # Amount of frames, fps and mtime of the video of a folder, opened
+        # only if it's new or changed
+        dir = key.split('/')[-1]
+        path = os.path.join(self.data_folder, key, dir + ext)
+        videos = self.index['videos'][key]['videos']
+
+        mtime = 0
+        if os.path.isfile(path):
+            mtime = os.path.getmtime(path)
+
+        video = videos.get(dir + ext)
+        if video is None or video['mtime'] != mtime:
+            self.changed = True
+            video = {'mtime': mtime, 'frames': 0, 'fps': 0.0}
+            if mtime != 0:
+                cap = cv2.VideoCapture(path)
+                if cap.isOpened():
+                    video['frames'] = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+                    video['fps'] = cap.get(cv2.CAP_PROP_FPS)
+                cap.release()
+            videos[dir + ext] = video
+
+        video = dict(video)
+        video['path'] = path
+        return video
@@ -3,14 +3,21 @@ from keras.models import load_model
 from keras import backend as K
 import math
 import sys
+import time
+import json
 import argparse
 import numpy as np
 import scipy.io as sio
 import os
-import glob
 import h5py
 import cv2
-import gc
+import collections
+import queue
+import threading
+import psutil
+from concurrent.futures import ThreadPoolExecutor
+import feature_store
+import manifest
 
 ''' This code is based on Núñez-Marcos, A., Azkune, G., & Arganda-Carreras, 
     I. (2017). "Vision-Based Fall Detection with Convolutional Neural Networks"
@@ -19,6 +26,893 @@ import gc
     Semantix. 
 '''
 
+''' Documentation: class Profiler
+
+    Timers and counters of the stages of extraction, to tell what bounds a
+    run. For each stage it keeps the time spent, the amount of items (images
+    or stacks) and of bytes that went through it:
+
+    decode: reading images (or a video) on the prefetch workers
+    wait_decode: forward pass thread waiting for a decoded chunk
+    stack: assembly of the stacks (or frames) into the batches
+    mean: subtraction of the flow mean
+    predict: forward passes
+    write: hdf5 writes, on the writer thread
+    wait_write: forward pass thread waiting for the writer
+
+    decode runs on several threads, so its time may be longer than the run.
+    For each video it also keeps the time the forward pass thread spent on
+    it, so its stacks/sec and images/sec.
+
+    summary gives all of it as a dict, ready to be dumped as json. If every
+    is more than 0, tick prints a summary (without the videos) in a single
+    json line to stderr every that many seconds.
+'''
+
+
+class Profiler:
+
+    stages = ['decode', 'wait_decode', 'stack', 'mean', 'predict', 'write',
+              'wait_write']
+
+    def __init__(self, every=0):
+        self.every = every
+        self.lock = threading.Lock()
+        self.begin = time.time()
+        self.last = self.begin
+        self.times = dict([(stage, 0.0) for stage in self.stages])
+        self.items = dict([(stage, 0) for stage in self.stages])
+        self.bytes = dict([(stage, 0) for stage in self.stages])
+        # Per 'stream class/dir': stacks, images and seconds
+        self.videos = collections.OrderedDict()
+
+    def add(self, stage, seconds, items=0, nbytes=0):
+        with self.lock:
+            self.times[stage] += seconds
+            self.items[stage] += items
+            self.bytes[stage] += nbytes
+
+    def video(self, stream, key, stacks, images, seconds):
+        name = stream + ' ' + key
+        if name not in self.videos:
+            self.videos[name] = [0, 0, 0.0]
+        self.videos[name][0] += stacks
+        self.videos[name][1] += images
+        self.videos[name][2] += seconds
+
+    def images(self, data):
+
+        # Amount of images in a decoded chunk: a list of frames, or flows
+        # with an image in each channel
+        if isinstance(data, list):
+            return len(data)
+        return data.shape[2]
+
+    def nbytes(self, data):
+
+        if isinstance(data, list):
+            return sum([image.nbytes for image in data])
+        return data.nbytes
+
+    def tick(self):
+        if self.every <= 0 or time.time() - self.last < self.every:
+            return
+        self.last = time.time()
+        print(json.dumps(self.summary(False)), file=sys.stderr, flush=True)
+
+    def summary(self, videos=True):
+        wall = time.time() - self.begin
+        stacks = sum([video[0] for video in self.videos.values()])
+        images = sum([video[1] for video in self.videos.values()])
+
+        summary = {'wall': wall, 'stacks': stacks, 'images': images,
+                   'stacks_per_sec': stacks / max(wall, 1e-9),
+                   'images_per_sec': images / max(wall, 1e-9), 
+                   'stages': dict()}
+        with self.lock:
+            for stage in self.stages:
+                summary['stages'][stage] = {'time': self.times[stage],
+                        'items': self.items[stage], 
+                        'bytes': self.bytes[stage],
+                        'items_per_sec': self.items[stage] / 
+                                         max(self.times[stage], 1e-9)}
+
+        if videos:
+            summary['videos'] = [{'video': name, 'stacks': video[0], 
+                    'images': video[1], 'time': video[2], 
+                    'stacks_per_sec': video[0] / max(video[2], 1e-9),
+                    'images_per_sec': video[1] / max(video[2], 1e-9)} 
+                    for name, video in self.videos.items()]
+        return summary
+
+
+''' Documentation: class Batch
+
+    Keras pays a full dispatch for every call to predict, so feeding one stack
+    (or frame) at a time wastes most of the time of extraction. A Batch
+    collects batch_size inputs and runs them through the CNN in a single
+    forward pass.
+
+    If a mean is given, it's subtracted from the whole batch, in place, just
+    before the forward pass.
+
+    If a Profiler is given, the copies into the batch, the mean subtraction
+    and the forward passes are timed.
+
+    Every input is queued together with the hdf5 datasets and the row where
+    its feature vector belongs, so a batch can mix stacks from the end of a
+    video with stacks from the beginning of the next one. The outputs of a
+    forward pass are handed, with their rows, to a Writer.
+
+    flush needs to be called once after the last input is added.
+'''
+
+
+class Batch:
+
+    def __init__(self, model, batch_size, writer, mean=None, profiler=None):
+        self.model = model
+        self.batch_size = batch_size
+        self.writer = writer
+        self.mean = mean
+        self.profiler = profiler
+        self.inputs = None
+        self.targets = []
+
+    def add(self, data, dataset_features, dataset_labels, row, label):
+        # Inputs are copied, so the caller can reuse its buffers
+        if self.inputs is None:
+            self.inputs = np.zeros(shape=(self.batch_size,) + data.shape,
+                                   dtype=np.float32)
+
+        begin = time.perf_counter()
+        self.inputs[len(self.targets)] = data
+        self.targets.append((dataset_features, dataset_labels, row, label))
+        if self.profiler is not None:
+            self.profiler.add('stack', time.perf_counter() - begin, 1, 
+                              self.inputs[0].nbytes)
+
+        if len(self.targets) == self.batch_size:
+            self.flush()
+
+    def flush(self):
+        amount = len(self.targets)
+        if amount == 0:
+            return
+
+        begin = time.perf_counter()
+        if self.mean is not None:
+            self.inputs[:amount] -= self.mean
+        middle = time.perf_counter()
+
+        predictions = self.model.predict(self.inputs[:amount], 
+                                         batch_size=amount)
+
+        if self.profiler is not None:
+            nbytes = self.inputs[:amount].nbytes
+            if self.mean is not None:
+                self.profiler.add('mean', middle - begin, amount, nbytes)
+            self.profiler.add('predict', time.perf_counter() - middle, 
+                              amount, nbytes)
+
+        self.writer.put(predictions, self.targets)
+        self.targets = []
+
+
+''' Documentation: class Writer
+
+    Stores the outputs of the forward passes in the hdf5 datasets from a
+    background thread, so the next forward pass doesn't wait for the disk.
+    At most depth outputs wait to be written, after that put blocks.
+
+    Rows that are consecutive in the same dataset are written with a single
+    slice assignment.
+
+    wait returns once everything put so far is written, close also stops
+    the thread. An error while writing is raised again by the next call to
+    put, wait or close.
+
+    If a Profiler is given, the writes and the time put and wait block are
+    timed.
+'''
+
+
+class Writer:
+
+    def __init__(self, depth, profiler=None):
+        self.queue = queue.Queue(maxsize=max(1, depth))
+        self.profiler = profiler
+        self.error = None
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def put(self, predictions, targets):
+        self.check()
+        begin = time.perf_counter()
+        self.queue.put((predictions, targets))
+        if self.profiler is not None:
+            self.profiler.add('wait_write', time.perf_counter() - begin)
+
+    def wait(self):
+        begin = time.perf_counter()
+        self.queue.join()
+        if self.profiler is not None:
+            self.profiler.add('wait_write', time.perf_counter() - begin)
+        self.check()
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self.check()
+
+    def check(self):
+        if self.error is not None:
+            raise self.error
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                # After an error, outputs are only drained
+                if self.error is None:
+                    begin = time.perf_counter()
+                    self.write(*item)
+                    if self.profiler is not None:
+                        self.profiler.add('write', time.perf_counter() - 
+                                          begin, len(item[1]), item[0].nbytes)
+            except Exception as error:
+                self.error = error
+            finally:
+                self.queue.task_done()
+
+    def write(self, predictions, targets):
+        amount = len(targets)
+
+        start = 0
+        for end in range(1, amount + 1):
+            if end < amount:
+                features, labels, row, _ = targets[end - 1]
+                next_features, _, next_row, _ = targets[end]
+                if next_features is features and next_row == row + 1:
+                    continue
+
+            features, labels, row, _ = targets[start]
+            truth = [target[3] for target in targets[start:end]]
+            features[row:row + end - start, :] = predictions[start:end]
+            labels[row:row + end - start, :] = np.reshape(truth, (-1, 1))
+            start = end
+
+
+''' Documentation: class Prefetch
+
+    Decodes images ahead of the forward passes. Each job is a function and
+    its arguments, usually the decoding of a chunk of a video; map runs the
+    jobs on a pool of worker threads (OpenCV releases the GIL while it
+    decodes) and gives back their results in order, keeping at most depth
+    jobs submitted ahead of the one being consumed.
+
+    If a Profiler is given, the jobs are timed, together with the images
+    they decode.
+'''
+
+
+class Prefetch:
+
+    def __init__(self, workers, depth, profiler=None):
+        self.pool = ThreadPoolExecutor(max_workers=max(1, workers))
+        self.depth = max(1, depth)
+        self.profiler = profiler
+
+    def map(self, jobs):
+        submitted = collections.deque()
+        for job in jobs:
+            submitted.append(self.pool.submit(self.run, job))
+            if len(submitted) > self.depth:
+                yield submitted.popleft().result()
+
+        while len(submitted) > 0:
+            yield submitted.popleft().result()
+
+    def run(self, job):
+        begin = time.perf_counter()
+        data = job[0](*job[1:])
+        if self.profiler is not None:
+            self.profiler.add('decode', time.perf_counter() - begin, 
+                              self.profiler.images(data), 
+                              self.profiler.nbytes(data))
+        return data
+
+    def close(self):
+        self.pool.shutdown()
+
+
+''' Documentation: class Stacks
+
+    Temporal stream inputs are stacks of sliding_height consecutive optical
+    flows, flow_x and flow_y interleaved, so every flow image belongs to up to
+    sliding_height different stacks. Instead of copying each image into all of
+    its stacks, Stacks decodes every image once, as uint8, into a buffer of
+    shape (x_size, y_size, 2*frames) where channel 2*k is flow_x of the k-th
+    frame in the buffer and channel 2*k+1 is its flow_y.
+
+    With this layout the i-th stack is just the slice [:, :, 2*i:2*i+20] of the
+    buffer, a view that costs no copy. Conversion to float and mean
+    subtraction are left to the Batch the stack is added to.
+
+    The buffer holds capacity stacks. Videos are walked in chunks: read
+    decodes the frames of a chunk that are not in the previous one, it
+    touches nothing but its own output so it can run on a Prefetch worker,
+    and load puts them in the buffer. The last sliding_height-1 frames of a
+    chunk are moved to the front of the buffer to start the next one instead
+    of being decoded again, so the chunks of a video must be loaded in order.
+'''
+
+
+class Stacks:
+
+    def __init__(self, x_size, y_size, sliding_height, capacity):
+        self.x_size = x_size
+        self.y_size = y_size
+        self.sliding_height = sliding_height
+        self.frames = np.zeros(shape=(x_size, y_size, 
+                        2*(capacity + sliding_height - 1)), dtype=np.uint8)
+        # Amount of frames of the last chunk loaded
+        self.loaded = 0
+
+    def read(self, flow_x_files, flow_y_files, first, amount):
+        # Stacks [first, first + amount) need frames [first, end), the ones
+        # before begin were read with the previous chunk
+        end = first + amount + self.sliding_height - 1
+        if first == 0:
+            begin = 0
+        else:
+            begin = first + self.sliding_height - 1
+
+        frames = np.zeros(shape=(self.x_size, self.y_size, 2*(end - begin)),
+                          dtype=np.uint8)
+        for k in range(begin, end):
+            frames[:, :, 2*(k - begin)] = cv2.imread(flow_x_files[k],
+                                                     cv2.IMREAD_GRAYSCALE)
+            frames[:, :, 2*(k - begin)+1] = cv2.imread(flow_y_files[k],
+                                                       cv2.IMREAD_GRAYSCALE)
+        return frames
+
+    def load(self, frames, amount):
+        needed = amount + self.sliding_height - 1
+
+        # Frames already in the buffer are moved to its beginning
+        keep = needed - frames.shape[2] // 2
+        if keep > 0:
+            self.frames[:, :, :2*keep] = self.frames[:, :, 
+                                         2*(self.loaded - keep):2*self.loaded]
+
+        self.frames[:, :, 2*keep:2*needed] = frames
+        self.loaded = needed
+
+    def stack(self, i):
+        # i-th stack of the last chunk loaded
+        return self.frames[:, :, 2*i:2*(i + self.sliding_height)]
+
+
+''' Documentation: class Video
+
+    Source of the spatial and temporal streams when they are extracted
+    straight from the video of a folder (-from_video), with no frame_ or
+    flow_ images in between. The video is decoded only once, in order, and
+    the optical flow of every pair of consecutive frames is computed on the
+    fly, with the same Farneback parameters and the same encoding used by
+    Data_extraction/temporal/optflow_extractor.py: flow_x is the angle of the
+    flow and flow_y its normalized magnitude.
+
+    read gives back, for a chunk of stacks, what a stream needs of it: the
+    frames of the chunk for the spatial stream and, for the temporal stream,
+    the flows that Stacks.read would have read from the flow_x and flow_y
+    images. The first stream that asks for a chunk decodes it, the others
+    get the same copy, so a chunk is decoded once for all streams. Chunks
+    are decoded in order whatever the order the Prefetch workers run them.
+
+    If dump is set, the frames and flows are also written as frame_, flow_x_
+    and flow_y_ images into the folder of the video, like the Data_extraction
+    scripts do.
+'''
+
+
+class Video:
+
+    # Streams that can be computed from the video
+    streams = ['spatial', 'temporal']
+
+    def __init__(self, path, frames, mtime, x_size, y_size, sliding_height,
+                 dump=None):
+        self.path = path
+        # Amount of frames and mtime of the video, 0 if it can't be read
+        self.frames = frames
+        self.mtime = mtime
+        self.x_size = x_size
+        self.y_size = y_size
+        self.sliding_height = sliding_height
+        self.dump = dump
+
+        # Streams that will read this video
+        self.consumers = set()
+        self.condition = threading.Condition()
+        # Chunks decoded but not yet read by every consumer
+        self.chunks = dict()
+        self.next = 0
+
+    def read(self, stream, first, amount):
+        with self.condition:
+            while first not in self.chunks and first != self.next:
+                self.condition.wait()
+
+            if first not in self.chunks:
+                self.chunks[first] = [self.decode(first, amount),
+                                      len(self.consumers)]
+                self.next = first + amount
+                self.condition.notify_all()
+
+            chunk = self.chunks[first]
+            chunk[1] -= 1
+            if chunk[1] == 0:
+                del self.chunks[first]
+
+        return chunk[0][stream]
+
+    def decode(self, first, amount):
+        # Stacks [first, first + amount) need frames [first, first + amount)
+        # and flows [first, end), flow k is computed from frames k and k+1.
+        # Flows before begin were computed with the previous chunk
+        end = first + amount + self.sliding_height - 1
+        if first == 0:
+            begin = 0
+            self.cap = cv2.VideoCapture(self.path)
+            self.position = 0
+            self.pending = []
+            self.last = None
+        else:
+            begin = first + self.sliding_height - 1
+
+        flows = None
+        if 'temporal' in self.consumers:
+            flows = np.zeros(shape=(self.x_size, self.y_size, 
+                             2*(end - begin)), dtype=np.uint8)
+
+        # Frames [position, end] are the ones still to decode
+        while self.position <= end:
+            frame = self.next_frame()
+            self.pending.append(frame)
+            if self.dump is not None:
+                cv2.imwrite(self.dump + '/frame_' + 
+                            str(self.position + 1).zfill(5) + '.jpg', frame)
+
+            if flows is not None:
+                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                if self.position > 0:
+                    k = self.position - 1
+                    flow_x, flow_y = self.flow(self.gray, gray)
+                    flows[:, :, 2*(k - begin)] = flow_x
+                    flows[:, :, 2*(k - begin)+1] = flow_y
+                    if self.dump is not None:
+                        name = str(k + 1).zfill(5) + '.jpg'
+                        cv2.imwrite(self.dump + '/flow_x_' + name, flow_x)
+                        cv2.imwrite(self.dump + '/flow_y_' + name, flow_y)
+                self.gray = gray
+
+            self.position += 1
+
+        # Frames after the chunk start the next one
+        frames = self.pending[:amount]
+        self.pending = self.pending[amount:]
+
+        if self.position == self.frames:
+            self.cap.release()
+
+        return {'spatial': frames, 'temporal': flows}
+
+    def next_frame(self):
+        ret, frame = self.cap.read()
+        if not ret:
+            # The amount of frames in the header of some videos is wrong, the
+            # last frame decoded is repeated up to it
+            if self.last is None:
+                self.last = np.zeros(shape=(self.x_size, self.y_size, 3), 
+                                     dtype=np.uint8)
+            print("\nWARNING: " + self.path + " has no frame " + 
+                  str(self.position), flush=True)
+            return self.last
+
+        if frame.shape[:2] != (self.x_size, self.y_size):
+            frame = cv2.resize(frame, (self.y_size, self.x_size))
+        self.last = frame
+        return frame
+
+    def flow(self, prvs, next):
+        flow = cv2.calcOpticalFlowFarneback(prvs, next, None, 0.702, 5, 10,
+                                            2, 7, 1.5, 0)
+        mag, ang = cv2.cartToPolar(flow[..., 0], flow[..., 1])
+
+        # Cleaning NaN and Inf values
+        mag[~np.isfinite(mag)] = 0
+        ang[~np.isfinite(ang)] = 0
+
+        flow_x = (ang*180/np.pi/2).astype(np.uint8)
+        flow_y = cv2.normalize(mag, None, 0, 255,
+                               cv2.NORM_MINMAX).astype(np.uint8)
+        return flow_x, flow_y
+
+
+''' Documentation: class Stream
+
+    Everything that extraction keeps for one stream: the model of the stream,
+    its output files, the registry of the videos already extracted, its Batch
+    and, for the temporal stream, its Stacks. Fextractor drives one Stream for
+    each stream being extracted, so all of them are filled in a single walk
+    over the dataset.
+
+    scan: registers a video folder, given the manifest of the dataset (or the
+    Video its frames are computed from)
+    patterns: the files of a video folder the stream reads, the ones its
+    registry entry (and -resume) depend on
+    open: opens (or creates) the hdf5 files and finds the videos to extract
+    start: creates the Batch and Stacks of the stream
+    jobs: decoding jobs of a video, in chunks, to be run by a Prefetch
+    add: queues a decoded chunk for the forward passes
+    flush: runs the inputs left in an incomplete batch
+    close: registers the last videos and rebuilds the files in order
+
+    This code produces 4 files for each stream, plus a json registry of the
+    videos already extracted. The samples file also has the index of the
+    videos (see feature_store).
+
+    features_file contain arrays of size num_features. Each array is the
+    output of VGG16 to a data information and is composed of values in the
+    range [0, 1].
+
+    Just to remember, data information is what this stream consider as an
+    input. RGB streams use a frame, and STACK streams use a stack of frames.
+'''
+
+
+class Stream:
+
+    def __init__(self, stream, model, id, num_classes, num_features, 
+                 sliding_height):
+
+        self.stream = stream
+        self.num_features = num_features
+        self.sliding_height = sliding_height
+
+        '''
+            Each stream need to have its file with correct names
+        '''
+        if stream == 'temporal':
+            self.file_name = 'flow_x*.jpg'
+            self.file_name_1 = 'flow_y*.jpg'
+        elif stream == 'pose':
+            self.file_name = 'pose_*.jpg'
+        elif stream == 'spatial':
+            self.file_name = 'frame_*.jpg'
+        elif stream == 'ritmo':
+            # Horizontal rhythm only, one image per window as the other
+            # streams
+            self.file_name = 'ritmo_*_h.jpg'
+        elif stream == 'depth':
+            self.file_name = 'depth_*.jpg'
+        elif stream == 'saliency':
+            self.file_name = 'saliency_*.png'
+        else:
+            print("INVALID STREAM ERROR")
+            print("VALIDS STREAMS: {temporal, spatial, pose, ritmo, depth, saliency}") 
+            exit(1)
+
+        self.features_file = stream + '_features_' + id  + '.h5'
+        self.labels_file = stream + '_labels_' + id  + '.h5'
+        self.samples_file = stream + '_samples_' + id  + '.h5'
+        self.num_file = stream + '_num_' + id  + '.h5'
+        self.videos_file = stream + '_videos_' + id  + '.json'
+
+        self.features_key = 'features' 
+        self.labels_key = 'labels'
+        self.samples_key = 'samples'
+        self.num_key = 'num'
+
+        print("### Model loading: " + model, flush=True)
+        self.model = load_model(model)
+
+        # 'class/dir', folder, label, amount of frames, newest mtime of the
+        # files read (or of the video) and amount of samples of every video
+        self.keys = []
+        self.folders = []
+        self.labels = []
+        self.frames = []
+        self.mtimes = []
+        self.samples = []
+        self.sources = []
+        self.num_class = [0 for c in range(num_classes)]
+
+    def scan(self, c, key, folder, manifest, video=None):
+
+        if video is not None and self.stream in Video.streams:
+            # Frames and optical flows are computed from the video, that
+            # has one frame more than optical flows
+            nb_files = video.frames
+            if self.stream == 'temporal':
+                nb_files -= 1
+            mtime = video.mtime
+        else:
+            video = None
+            nb_files = manifest.count(key, self.file_name)
+            # Only the files of the stream: other images written into the
+            # folder (-dump_jpeg, depth_, ritmo_...) don't make it extract
+            # the video again
+            mtime = manifest.newest(key, *self.patterns())
+
+        # if file_name == 'flow_x_*.jpg'
+        # then 
+        #   we have len(files) equals to the amount of optical flows
+        #   which is the amount of len(files) - 1 for every other
+        #   file_name
+
+        # if it is a temporal stream or any other STACK-like stream
+        if self.stream == 'temporal':
+            nb_datas = nb_files - self.sliding_height + 1
+        else:
+            # Removing last datas from all streams to match the
+            # amount of data present on temporal sream
+            nb_datas = nb_files - self.sliding_height
+
+        if nb_datas > 0:
+            self.num_class[c] += 1
+            self.keys.append(key)
+            self.folders.append(folder)
+            self.labels.append(c)
+            self.frames.append(nb_files)
+            self.mtimes.append(mtime)
+            self.samples.append(nb_datas)
+            self.sources.append(video)
+
+    def patterns(self):
+
+        # Files of a video folder this stream reads
+        if self.stream == 'temporal':
+            return [self.file_name, self.file_name_1]
+        return [self.file_name]
+
+    def open(self, dtype, compression, resume):
+
+        # Videos already extracted, that didn't change since then, are kept
+        self.videos = dict()
+        if resume and os.path.isfile(self.features_file) and \
+           os.path.isfile(self.labels_file):
+            self.videos = feature_store.read_videos(self.videos_file)
+
+        # File to store the extracted features and datasets to store them
+        # IMPORTANT NOTE: 'w' mode totally erases previous data
+        if len(self.videos) > 0:
+            self.h5features = h5py.File(self.features_file, 'a')
+            self.h5labels = h5py.File(self.labels_file, 'a')
+            self.dataset_features = self.h5features[self.features_key]
+            self.dataset_labels = self.h5labels[self.labels_key]
+        else:
+            self.h5features = h5py.File(self.features_file, 'w')
+            self.h5labels = h5py.File(self.labels_file, 'w')
+            self.dataset_features = feature_store.create_features(
+                    self.h5features, self.features_key, 0, self.num_features, 
+                    dtype, compression, resizable=True)
+            self.dataset_labels = feature_store.create_labels(self.h5labels, 
+                    self.labels_key, 0, resizable=True)
+
+        # New rows go after the last registered video, anything there is left
+        # from an interrupted extraction
+        self.cont = 0
+        for video in self.videos.values():
+            self.cont = max(self.cont, video['start'] + video['samples'])
+
+        # Folders of the videos to extract, and their indexes
+        self.todo = dict()
+        for v in range(len(self.keys)):
+            video = self.videos.get(self.keys[v])
+            if video is None or video['frames'] != self.frames[v] or \
+               video['mtime'] != self.mtimes[v]:
+                self.todo[self.folders[v]] = v
+
+        self.nb_todo_data = sum([self.samples[v] for v in self.todo.values()])
+        print("### {}: {} of {} videos to extract".format(self.stream, 
+              len(self.todo), len(self.keys)), flush=True)
+        self.dataset_features.resize(self.cont + self.nb_todo_data, axis=0)
+        self.dataset_labels.resize(self.cont + self.nb_todo_data, axis=0)
+
+    def start(self, batch_size, writer, flow_mean, x_size, y_size, 
+              amount_datas, profiler=None):
+
+        self.writer = writer
+        self.profiler = profiler
+        # Videos whose features may still be waiting in the batch
+        self.pending = []
+
+        # Inputs are packed in batches that may span more than one video, the
+        # outputs of each forward pass are scattered back to their rows
+        if self.stream == 'temporal':
+            self.batch = Batch(self.model, batch_size, writer,
+                               flow_mean.astype(np.float32), profiler)
+            self.stacks = Stacks(x_size, y_size, self.sliding_height, 
+                                 amount_datas)
+        else:
+            self.batch = Batch(self.model, batch_size, writer, 
+                               profiler=profiler)
+
+    def jobs(self, v, manifest, amount_datas):
+
+        video = self.sources[v]
+        if video is not None:
+            # Chunks are computed from the video, once for all its streams
+            video.consumers.add(self.stream)
+
+        data_images = [self.folders[v] + '/' + name for name in 
+                       manifest.files(self.keys[v], self.file_name)]
+
+        if self.stream == 'temporal':
+            data_images_1 = [self.folders[v] + '/' + name for name in 
+                             manifest.files(self.keys[v], self.file_name_1)]
+        else:
+            # Removing unmatched frames from other streams
+            data_images = data_images[:-self.sliding_height]
+
+        # Every chunk has amount_datas stacks, except the last one of a video
+        # that gets what remains of it. Last -sliding_height + 1 OF frames
+        # dont get a stack, for other streams data_images already is matched
+        # with temporal
+        jobs = []
+        for first in range(0, self.samples[v], amount_datas):
+            amount = min(amount_datas, self.samples[v] - first)
+            if video is not None:
+                jobs.append((self, v, first, amount, (video.read, 
+                             self.stream, first, amount)))
+            elif self.stream == 'temporal':
+                jobs.append((self, v, first, amount, (self.stacks.read, 
+                             data_images, data_images_1, first, amount)))
+            else:
+                jobs.append((self, v, first, amount, (self.read_frames,
+                             data_images[first:first + amount])))
+        return jobs
+
+    def read_frames(self, files):
+
+        # Decoding of a chunk of frames, runs on a prefetch worker
+        return [cv2.imread(f) for f in files]
+
+    def add(self, v, first, amount, data, checkpoint):
+
+        label = self.labels[v]
+        if first == 0:
+            self.pending.append((self.keys[v], {'frames': self.frames[v], 
+                                 'mtime': self.mtimes[v], 'start': self.cont,
+                                 'samples': self.samples[v], 'label': label}))
+
+        # Queue each stack, the feed-forward pass happens when the batch is
+        # full
+        if self.stream == 'temporal':
+            begin = time.perf_counter()
+            self.stacks.load(data, amount)
+            if self.profiler is not None:
+                self.profiler.add('stack', time.perf_counter() - begin)
+            for i in range(amount):
+                self.batch.add(self.stacks.stack(i), self.dataset_features,
+                               self.dataset_labels, self.cont, label)
+                self.cont += 1
+        else:
+            for frame in data:
+                self.batch.add(frame, self.dataset_features, 
+                               self.dataset_labels, self.cont, label)
+                self.cont += 1
+
+        if first + amount < self.samples[v]:
+            return
+
+        # Videos are registered once their features are written, it costs
+        # no extra forward pass when the batch ends together with a video
+        if len(self.batch.targets) == 0 or len(self.pending) == checkpoint:
+            self.batch.flush()
+            self.writer.wait()
+            self.save_videos()
+
+    def flush(self):
+
+        # Stacks left in an incomplete batch
+        self.batch.flush()
+
+    def close(self, num_classes):
+
+        # The writer must be closed (or waited) before
+        self.save_videos()
+        self.h5labels.close()
+
+        # Videos removed from data_folder are forgotten
+        self.videos = dict([(key, self.videos[key]) for key in self.keys])
+        self.sort_features()
+        feature_store.write_videos(self.videos_file, self.videos)
+
+        # Labels, samples and num are rebuilt from the registry, in the same
+        # order of the features
+        h5labels = h5py.File(self.labels_file, 'w')
+        h5samples = h5py.File(self.samples_file, 'w')
+        h5num_classes = h5py.File(self.num_file, 'w')
+
+        dataset_labels = feature_store.create_labels(h5labels, 
+                self.labels_key, sum(self.samples), resizable=True)
+        dataset_samples = h5samples.create_dataset(self.samples_key, 
+                shape=(len(self.keys), 1), dtype='int32')  
+        dataset_num = h5num_classes.create_dataset(self.num_key, 
+                shape=(num_classes, 1), dtype='int32')  
+
+        for number in range(len(self.keys)):
+            video = self.videos[self.keys[number]]
+            start = video['start']
+            dataset_labels[start:start + video['samples']] = video['label']
+            dataset_samples[number] = video['samples']
+        
+        for c in range(num_classes):
+            dataset_num[c] = self.num_class[c]
+
+        # Rows, id and label of every video
+        feature_store.create_index(h5samples, self.keys, 
+                [self.videos[key]['samples'] for key in self.keys],
+                [self.videos[key]['label'] for key in self.keys])
+
+        h5labels.close()
+        h5samples.close()
+        h5num_classes.close()
+
+    def save_videos(self):
+
+        # Features must be on disk before their videos are registered
+        self.h5features.flush()
+        self.h5labels.flush()
+
+        for key, video in self.pending:
+            self.videos[key] = video
+        self.pending = []
+        feature_store.write_videos(self.videos_file, self.videos)
+
+    def sort_features(self):
+
+        # Appended videos, and rows of videos that changed or were removed,
+        # leave the features out of the order of keys. Only in this case the
+        # file is copied, video by video, in the right order
+        row = 0
+        in_order = True
+        for key in self.keys:
+            in_order = in_order and self.videos[key]['start'] == row
+            row += self.videos[key]['samples']
+
+        if in_order and self.dataset_features.shape[0] == row:
+            self.h5features.close()
+            return
+
+        print("\n### Sorting " + self.stream + " features", flush=True)
+        h5sorted = h5py.File(self.features_file + '.tmp', 'w')
+        dataset_sorted = feature_store.create_features(h5sorted, 
+                self.features_key, row, self.num_features, 
+                self.dataset_features.dtype, 
+                feature_store.compression_of(self.dataset_features), 
+                resizable=True)
+
+        row = 0
+        for key in self.keys:
+            video = self.videos[key]
+            dataset_sorted[row:row + video['samples']] = self.dataset_features[
+                    video['start']:video['start'] + video['samples']]
+            video['start'] = row
+            row += video['samples']
+
+        h5sorted.close()
+        self.h5features.close()
+        os.replace(self.features_file + '.tmp', self.features_file)
+
+
 ''' Documentation: class Fextractor
 
     As the code present in multi-stream-vgg16.py, this code has a lot of auto-
@@ -62,6 +956,11 @@ import gc
     n-1 frame for optical_flow (actually, only one OF algorithm is being used
     and it uses 2 frames to calculate one OF, so the last frame doesn't match)
 
+    With -from_video, the frames and optical flows of the spatial and temporal
+    streams are computed from video01.mp4 itself while extracting (see class
+    Video), so those images are not needed. They can still be written, with
+    -dump_jpeg.
+
     Now, we have two kind of streams, as already said in multi-stream-vgg16.py.
     STACK stream stacks sliding_height frames to evaluate.
     RGB streams evaluate every frame.
@@ -85,71 +984,59 @@ class Fextractor:
     def __init__(self, classes, id, ext):
 
         self.ext = ext
-        self.folders = []
         
         self.classes = classes
         self.classes.sort()
         self.classes_dirs = []
         self.classes_videos = []
 
-        self.class_value = []
-        self.data_images = []
-        self.data_images_1 = []
-        
         # Some constants defined over a lot of classes.
         self.num_features = 4096    # Number of output of our CNN 
         self.x_size = 224           # X image size
         self.y_size = 224           # Y image size               224x224 pixels 
-        
-        self.id = id
-        # Total amount of data with sliding window=num_images-sliding_height+1
-        self.nb_total_data = 0
-
-    def extract(self, stream, model, data_folder):
 
-        print("### Model loading", flush=True)
-        extractor_model = load_model(model)
+        # Share of the available memory used by the batches and decoded
+        # chunks, the rest is left to the models, and largest sizes worth it
+        self.memory_fraction = 0.5
+        self.max_batch_size = 128
+        self.max_chunk_size = 1000
         
-        # This code produces 4 files for each stream.  
-
-        # features_file contain arrays of size self.num_features. Each array is
-        # the output of VGG16 to a data information and is composed of values       
-        # in the range [0, 1].
-
-        # Just to remember, data information is what this stream consider as an
-        # input. RGB streams use a frame, and STACK streams use a stack of frames. 
+        self.id = id
 
-        features_file = stream + '_features_' + self.id  + '.h5'
-        labels_file = stream + '_labels_' + self.id  + '.h5'
-        samples_file = stream + '_samples_' + self.id  + '.h5'
-        num_file = stream + '_num_' + self.id  + '.h5'
+    def extract(self, streams, models, data_folder, batch_size, dtype,
+                compression, resume, workers, queue_depth, from_video=False,
+                dump_jpeg=False, chunk_size=None, profiler=None):
 
-        features_key = 'features' 
-        labels_key = 'labels'
-        samples_key = 'samples'
-        num_key = 'num'
         sliding_height = 10
 
         '''
-        Function to load the optical flow stacks, do a feed-forward through 
-        the feature extractor (VGG16) and store the output feature vectors in 
-        the file 'features_file' and the labels in 'labels_file'.
+        Function to load the optical flow stacks (and the images of the other
+        streams), do a feed-forward through the feature extractor (VGG16) of
+        each stream and store the output feature vectors, labels, samples and
+        num in the files of the stream (see class Stream). The dataset is 
+        walked once, for all streams together.
         Input:
-        * extractor_model: CNN model until the last two layers.
-        * features_file: path to the hdf5 file where the extracted features are
-        going to be stored
-        * labels_file: path to the hdf5 file where the labels of the features
-        are going to be stored
-        * samples_file: path to the hdf5 file where the number of stacks in 
-        each video is going to be stored
-        * num_file: path to the hdf5 file where the number of fall and not fall
-        videos are going to be stored
-        * features_key: name of the key for the hdf5 file to store the features
-        * labels_key: name of the key for the hdf5 file to store the labels
-        * samples_key: name of the key for the hdf5 file to store the samples
-        * num_key: name of the key for the hdf5 file to store the num
+        * streams: names of the streams to extract
+        * models: CNN models until the last two layers, one for each stream
         * data_folder: folder with class0 and class1 folders
         * sliding_height: height of stack to process
+        * batch_size: amount of stacks (or frames) in each forward pass,
+        None to fit it in the available memory
+        * dtype: float64, float32 or float16, type of the stored features
+        * compression: none, lzf or gzip, filter of the features file (when
+        it's created)
+        * resume: only extract the videos that are new, or that changed,
+        since the last extraction and add them to the existing files
+        * workers: amount of threads decoding images
+        * queue_depth: amount of chunks decoded ahead, and of forward pass
+        outputs waiting to be written
+        * from_video: spatial and temporal inputs are computed from the video
+        of each folder instead of read from its frame_ and flow_ images
+        * dump_jpeg: with from_video, also writes the frame_, flow_x_ and
+        flow_y_ images of the videos
+        * chunk_size: amount of stacks (or frames) decoded at once, None to
+        fit it in the available memory
+        * profiler: Profiler that times the stages of extraction
         '''
 
         try:
@@ -166,251 +1053,136 @@ class Fextractor:
                 file=sys.stderr)
             exit(1)
 
-        dirs = []
-        num_class = []
-
-        # File to store the extracted features and datasets to store them
-        # IMPORTANT NOTE: 'w' mode totally erases previous data
-        print("### Creating h5 files", flush=True)
-        h5features = h5py.File(features_file,'w')
-        h5labels = h5py.File(labels_file,'w')
-        h5samples = h5py.File(samples_file, 'w')
-        h5num_classes = h5py.File(num_file, 'w')
-
-        '''
-            Each stream need to have its file with correct names
-        '''
-        if stream == 'temporal':
-            file_name = '/flow_x*.jpg'
-            file_name_1 = '/flow_y*.jpg'
-        elif stream == 'pose':
-            file_name = '/pose_*.jpg'
-        elif stream == 'spatial':
-            file_name = '/frame_*.jpg'
-        elif stream == 'ritmo':
-            file_name = '/ritmo_*.jpg'
-        elif stream == 'depth':
-            file_name = '/depth_*.jpg'
-        elif stream == 'saliency':
-            file_name = '/saliency_*.png'
-        else:
-            print("INVALID STREAM ERROR")
-            print("VALIDS STREAMS: {temporal, spatial, pose, ritmo, depth, saliency}") 
-            exit(1)
+        # Models stay loaded until every stream is extracted
+        extractors = []
+        for stream, model in zip(streams, models):
+            extractors.append(Stream(stream, model, self.id, 
+                              len(self.classes), self.num_features, 
+                              sliding_height))
 
+        # Video folders come from the manifest (see get_dirs), for all
+        # streams
+        folders = []
         for c in range(len(self.classes)):
-
-            num_class.append(0)
-            #if self.classes[c] != 'Falls' and self.classes[c] != 'NotFalls':
-            #    print("Sorry. Classes possibles are Falls and NotFalls, its \
-            #        hardcoded and will be expanded really soon. Its being \
-            #        used inside Extracting Features for, setting label value")
-            #    exit(1)
-
             for dir in self.classes_dirs[c]: 
-               
-                self.data = glob.glob(data_folder + self.classes[c] + '/' + 
-                                  dir + file_name)
-                    
-                # if file_name == 'flow_x_*.jpg'
-                # then 
-                #   we have len(self.data) equals to the amount of optical flows
-                #   which is the amount of len(self.data) - 1 for every other
-                #   file_name
-
-                # if it is a temporal stream or any other STACK-like stream
-                if stream == 'temporal':
-                    if len(self.data) >= sliding_height:
-                        # search which cam is being used in this dir
-                        # dir is something like: chute01cam2 or chute01cam2_00
-                        num_class[-1] += 1
-                        self.folders.append(data_folder + self.classes[c] + '/' + dir)
-                        dirs.append(dir)
-                        self.class_value.append(self.classes[c])
-
-                        # Removing last datas from all streams to match the
-                        # amount of data present on temporal sream
-                        self.nb_total_data += len(self.data) - sliding_height + 1
-                else:
-                    if len(self.data) - 1 >= sliding_height:
-                        # search which cam is being used in this dir
-                        # dir is something like: chute01cam2 or chute01cam2_00
-                        num_class[-1] += 1
-                        self.folders.append(data_folder + self.classes[c] + '/' + dir)
-                        dirs.append(dir)
-                        self.class_value.append(self.classes[c])
-
-                        # Removing last datas from all streams to match the
-                        # amount of data present on temporal sream
-                        self.nb_total_data += len(self.data) - sliding_height
-
-        dataset_features = h5features.create_dataset(features_key, 
-                shape=(self.nb_total_data, self.num_features), dtype='float64')
-        dataset_labels = h5labels.create_dataset(labels_key, 
-                shape=(self.nb_total_data, 1), dtype='float64')  
-        dataset_samples = h5samples.create_dataset(samples_key, 
-                shape=(len(self.class_value), 1), dtype='int32')  
-        dataset_num = h5num_classes.create_dataset(num_key, 
-                shape=(len(self.classes), 1), dtype='int32')  
-        
-        for c in range(len(self.classes)):
-            dataset_num[c] = num_class[c]
-
-        number = 0
+                folder = data_folder + self.classes[c] + '/' + dir
+                key = self.classes[c] + '/' + dir
+                folders.append(folder)
+
+                video = None
+                if from_video:
+                    info = self.manifest.video(key, self.ext)
+                    video = Video(info['path'], info['frames'], 
+                                  info['mtime'], self.x_size, self.y_size, 
+                                  sliding_height, 
+                                  folder if dump_jpeg else None)
+
+                for extractor in extractors:
+                    extractor.scan(c, key, folder, self.manifest, video)
+
+        # Videos opened for the first time are kept in the manifest
+        self.manifest.save()
+
+        print("### Opening h5 files", flush=True)
+        for extractor in extractors:
+            extractor.open(dtype, compression, resume)
+
+        # Decoding runs on prefetch workers, forward passes on this thread
+        # and their outputs are stored by the writer thread
+        if profiler is None:
+            profiler = Profiler()
+        prefetch = Prefetch(workers, queue_depth, profiler)
+        writer = Writer(queue_depth, profiler)
+
+        # Amount of stacks (or frames) decoded at once
+        batch_size, amount_datas = self.get_sizes(streams, sliding_height,
+                                        batch_size, chunk_size, queue_depth)
+        for extractor in extractors:
+            extractor.start(batch_size, writer, flow_mean, self.x_size, 
+                            self.y_size, amount_datas, profiler)
+
+        # Most videos to keep waiting for a batch that ends with them
+        checkpoint = 10
+
+        # Chunks of all streams of a video are interleaved, a chunk computed
+        # from a video is then released as soon as possible
+        jobs = []
+        for folder in folders:
+            chunks = [extractor.jobs(extractor.todo[folder], self.manifest,
+                      amount_datas) for extractor in extractors 
+                      if folder in extractor.todo]
+            for k in range(max([0] + [len(chunk) for chunk in chunks])):
+                jobs += [chunk[k] for chunk in chunks if k < len(chunk)]
+
+        nb_todo_data = sum([extractor.nb_todo_data for extractor in 
+                            extractors])
         cont = 0
-        
+
         print("### Extracting Features", flush=True)
-        for folder, dir, classe in zip(self.folders, dirs, self.class_value):
-            self.update_progress(cont/self.nb_total_data)
-        
-            self.data_images = glob.glob(folder + file_name)
-            self.data_images.sort()
+        decoded = prefetch.map([job[4] for job in jobs])
+        begin = time.perf_counter()
+        for (extractor, v, first, amount, _), data in zip(jobs, decoded):
+            middle = time.perf_counter()
+            profiler.add('wait_decode', middle - begin)
+            if first == 0:
+                self.update_progress(cont/nb_todo_data)
+
+            extractor.add(v, first, amount, data, checkpoint)
+            cont += amount
+
+            # Time of the forward pass thread on this chunk, waits included
+            end = time.perf_counter()
+            profiler.video(extractor.stream, extractor.keys[v], amount, 
+                           profiler.images(data), end - begin)
+            profiler.tick()
+            begin = end
+
+        for extractor in extractors:
+            extractor.flush()
+        writer.close()
+        prefetch.close()
+
+        for extractor in extractors:
+            extractor.close(len(self.classes))
+
+    def get_sizes(self, streams, sliding_height, batch_size, chunk_size,
+                  queue_depth):
 
-            if stream == 'temporal':
-                self.data_images_1 = glob.glob(folder + file_name_1)
-                self.data_images_1.sort()
-            else:
-                # Removing unmatched frames from other streams
-                self.data_images = self.data_images[:-sliding_height]
+        '''
+        Batch size and chunk size that fit in the memory available once the
+        models are loaded, unless they are given. Half of the share of each
+        stream goes to its batch: the float32 inputs plus the largest
+        activations of VGG16 (two of x_size x y_size x 64) for each input. The
+        other half goes to its decoded chunks: one being read by the Stacks,
+        queue_depth waiting and one being decoded, uint8, new images only.
+        '''
 
-            label = self.classes.index(classe)
+        available = psutil.virtual_memory().available
+        share = self.memory_fraction * available / len(streams) / 2
+        pixels = self.x_size * self.y_size
 
-            # last -sliding_height + 1 OF frames dont get a stack
+        batch_sizes = []
+        chunk_sizes = []
+        for stream in streams:
             if stream == 'temporal':
-                nb_datas = len(self.data_images) - sliding_height + 1
+                channels = 2*sliding_height
+                decoded = 2*pixels
             else:
-                # for other streams, data_images already is matched with 
-                # temporal
-                nb_datas = len(self.data_images)
-
-            amount_datas = 100 
-            fraction_datas = nb_datas // amount_datas
-
-            iterr = iter(self.data_images)
-            image_c = 0
-            for fraction in range(fraction_datas):
-
-                if stream == 'temporal':
-                    flow = np.zeros(shape=(self.x_size, self.y_size, 2*sliding_height, 
-                                    amount_datas), dtype=np.float64)
-
-                    for i in range(amount_datas + sliding_height -1):
-                        flow_x_file = self.data_images[image_c]
-                        flow_y_file = self.data_images_1[image_c]
-
-                        image_c += 1
-
-                        img_x = cv2.imread(flow_x_file, cv2.IMREAD_GRAYSCALE)
-                        img_y = cv2.imread(flow_y_file, cv2.IMREAD_GRAYSCALE)
-
-                        # Assign an image i to the jth stack in the kth position,
-                        # but also in the j+1th stack in the k+1th position and so 
-                        # on (for sliding window) 
-                        for s in list(reversed(range(min(sliding_height,i+1)))):
-                            if i-s < amount_datas:
-                                flow[:,:,2*s,  i-s] = img_x
-                                flow[:,:,2*s+1,i-s] = img_y
-                        del img_x,img_y
-                        gc.collect()
-
-                    # Restore last images from previous fraction to start next 
-                    # fraction    
-                    image_c = image_c - sliding_height + 1
-                        
-                    # Subtract mean
-                    flow = flow - np.tile(flow_mean[...,np.newaxis], 
-                            (1, 1, 1, flow.shape[3]))
-                    # Transpose for channel ordering (Tensorflow in this case)
-                    flow = np.transpose(flow, (3, 0, 1, 2)) 
-                    predictions = np.zeros((amount_datas, self.num_features), 
-                            dtype=np.float64)
-                    truth = np.zeros((amount_datas, 1), dtype='int8')
-                    # Process each stack: do the feed-forward pass and store in the 
-                    # hdf5 file the output
-                    for i in range(amount_datas):
-                        prediction = extractor_model.predict(
-                                                    np.expand_dims(flow[i, ...], 0))
-                        predictions[i, ...] = prediction
-                        #truth[i] = self.get_media_optflow(label_values, i+(fraction*amount_datas), sliding_height)
-                        truth[i] = label
-                else:
-                    predictions = np.zeros((amount_datas, self.num_features), 
-                            dtype=np.float64)
-                    truth = np.zeros((amount_datas, 1), dtype='int8')
-                    # Process each stack: do the feed-forward pass and store in the 
-                    # hdf5 file the output
-                    for i in range(amount_datas):
-                        frame = next(iterr)
-                        frame = cv2.imread(frame)
-                        predictions[i, ...] = extractor_model.predict(np.expand_dims(frame, 0))
-                        #truth[i] = label_values[i+fraction*amount_frames]
-                        truth[i] = label
-
-                
-                dataset_features[cont:cont+amount_datas,:] = predictions
-                dataset_labels[cont:cont+amount_datas,:] = truth
-                cont += amount_datas
-
-            amount_datas = nb_datas % amount_datas
-            predictions = np.zeros((amount_datas, self.num_features), 
-                    dtype=np.float64)
-            truth = np.zeros((amount_datas, 1), dtype='int8')
+                channels = 3
+                decoded = 3*pixels
 
-            if stream == 'temporal':
-                flow = np.zeros(shape=(self.x_size, self.y_size, 2*sliding_height, 
-                                amount_datas), dtype=np.float64)
-
-                for i in range(amount_datas + sliding_height - 1):
-                    flow_x_file = self.data_images[image_c]
-                    flow_y_file = self.data_images_1[image_c]
-
-                    image_c += 1
-
-                    img_x = cv2.imread(flow_x_file, cv2.IMREAD_GRAYSCALE)
-                    img_y = cv2.imread(flow_y_file, cv2.IMREAD_GRAYSCALE)
-                    # Assign an image i to the jth stack in the kth position,
-                    # but also in the j+1th stack in the k+1th position and so on 
-                    # (for sliding window) 
-                    for s in list(reversed(range(min(sliding_height,i+1)))):
-                        if i-s < amount_datas:
-                            flow[:,:,2*s,  i-s] = img_x
-                            flow[:,:,2*s+1,i-s] = img_y
-                    del img_x,img_y
-                    gc.collect()
-                    
-                # Subtract mean
-                flow = flow - np.tile(flow_mean[...,np.newaxis], 
-                        (1, 1, 1, flow.shape[3]))
-                # Transpose for channel ordering (Tensorflow in this case)
-                flow = np.transpose(flow, (3, 0, 1, 2)) 
-                # Process each stack: do the feed-forward pass and store in the 
-                # hdf5 file the output
-                for i in range(amount_datas):
-                    prediction = extractor_model.predict(np.expand_dims(flow[i, ...],
-                                                                                 0))
-                    predictions[i, ...] = prediction
-                    # this 100 value is related to initial amount_datas
-                    truth[i] = label
-            else:
-                # Process each stack: do the feed-forward pass and store in the 
-                # hdf5 file the output
-                for i in range(amount_datas):
-                    frame = next(iterr)
-                    frame = cv2.imread(frame)
-                    predictions[i, ...] = extractor_model.predict(np.expand_dims(frame, 0))
-                    # this 100 value is related to initial amount_frames
-                    truth[i] = label
-
-            dataset_features[cont:cont+amount_datas,:] = predictions
-            dataset_labels[cont:cont+amount_datas,:] = truth
-            cont += amount_datas
-            dataset_samples[number] = nb_datas
-            number+=1
-
-        h5features.close()
-        h5labels.close()
-        h5samples.close()
-        h5num_classes.close()
+            batch_sizes.append(int(share // (4*pixels*channels + 
+                                             2*4*pixels*64)))
+            chunk_sizes.append(int(share // (decoded*(queue_depth + 2))))
+
+        if batch_size is None:
+            batch_size = max(1, min([self.max_batch_size] + batch_sizes))
+        if chunk_size is None:
+            chunk_size = max(1, min([self.max_chunk_size] + chunk_sizes))
+
+        print("### {:.1f} GB available: batch size {}, chunk size {}".format(
+              available / (1 << 30), batch_size, chunk_size), flush=True)
+        return batch_size, chunk_size
 
     def update_progress(self, workdone):
             print("\rProgress: [{0:50s}] {1:.1f}%".format('#' * int(workdone * 50), workdone*100), end="", flush=True)
@@ -427,10 +1199,15 @@ class Fextractor:
 
     def get_dirs(self, data_folder):
 
+        # The tree is scanned once, only the directories that changed since
+        # the last run are listed again
+        print("### Scanning " + data_folder, flush=True)
+        self.manifest = manifest.Manifest(data_folder, self.classes)
+        self.manifest.scan()
+        self.manifest.save()
+
         for c in self.classes:
-            self.classes_dirs.append([f for f in os.listdir(data_folder + c) 
-                        if os.path.isdir(os.path.join(data_folder, c, f))])
-            self.classes_dirs[-1].sort()
+            self.classes_dirs.append(list(self.manifest.dirs(c)))
 
             self.classes_videos.append([])
             for f in self.classes_dirs[-1]:
@@ -459,6 +1236,51 @@ if __name__ == '__main__':
             help='Usage: -id <identifier_to_this_features>', required=True)
     argp.add_argument("-ext", dest='ext', type=str, nargs=1, 
             help='Usage: -ext <file_extension> .mp4 | .avi | ...', required=True)
+    argp.add_argument("-batch_size", dest='batch_size', type=int, nargs=1,
+            help='Usage: -batch_size <stacks_per_forward_pass> (default: \
+                  fits the available memory)', 
+            required=False, default=[None])
+    argp.add_argument("-chunk_size", dest='chunk_size', type=int, nargs=1,
+            help='Usage: -chunk_size <stacks_decoded_at_once> (default: \
+                  fits the available memory)', 
+            required=False, default=[None])
+    argp.add_argument("-dtype", dest='dtype', type=str, nargs=1,
+            choices=feature_store.FEATURE_DTYPES,
+            help='Usage: -dtype <float64 | float32 | float16>', 
+            required=False, default=['float32'])
+    argp.add_argument("-compression", dest='compression', type=str, nargs=1,
+            choices=feature_store.COMPRESSIONS,
+            help='Usage: -compression <none | lzf | gzip>', 
+            required=False, default=['none'])
+    argp.add_argument("-resume", dest='resume', action='store_true',
+            help='Usage: -resume (keeps the videos already extracted)',
+            required=False)
+    argp.add_argument("-workers", dest='workers', type=int, nargs=1,
+            help='Usage: -workers <decoding_threads>', 
+            required=False, default=[4])
+    argp.add_argument("-queue_depth", dest='queue_depth', type=int, nargs=1,
+            help='Usage: -queue_depth <chunks_decoded_ahead>', 
+            required=False, default=[8])
+    argp.add_argument("-single_pass", dest='single_pass', action='store_true',
+            help='Usage: -single_pass (all streams in one walk, all models \
+                  loaded together)',
+            required=False)
+    argp.add_argument("-profile", dest='profile', type=str, nargs=1,
+            help='Usage: -profile <summary_file.json> (time, items and bytes \
+                  of each stage, stacks/sec and images/sec of each video)', 
+            required=False, default=[None])
+    argp.add_argument("-profile_every", dest='profile_every', type=float, 
+            nargs=1, help='Usage: -profile_every <seconds> (prints the \
+                  stages to stderr, as json lines)', 
+            required=False, default=[0])
+    argp.add_argument("-from_video", dest='from_video', action='store_true',
+            help='Usage: -from_video (spatial and temporal computed from the \
+                  videos, no frame_ or flow_ images needed)',
+            required=False)
+    argp.add_argument("-dump_jpeg", dest='dump_jpeg', action='store_true',
+            help='Usage: -dump_jpeg (with -from_video, also writes frame_, \
+                  flow_x_ and flow_y_ images)',
+            required=False)
     
     try:
         args = argp.parse_args()
@@ -467,13 +1289,32 @@ if __name__ == '__main__':
         exit(1)
 
 
-    for stream in args.streams:
-        print("STREAM: " + stream)
+    # In a single pass every stream is extracted at once, otherwise one
+    # stream after the other (with only one model in memory at a time)
+    if args.single_pass:
+        passes = [args.streams]
+    else:
+        passes = [[stream] for stream in args.streams]
+
+    # A single profiler times every pass
+    profiler = Profiler(args.profile_every[0])
+
+    for streams in passes:
+        print("STREAM: " + ' '.join(streams))
         fextractor = Fextractor(args.classes, args.id[0], args.ext[0])
         fextractor.get_dirs(args.data_folder[0])
-        fextractor.extract(stream, 'VGG16_' + stream, args.data_folder[0])
+        fextractor.extract(streams, ['VGG16_' + stream for stream in streams],
+                           args.data_folder[0], args.batch_size[0], 
+                           args.dtype[0], args.compression[0], args.resume,
+                           args.workers[0], args.queue_depth[0],
+                           args.from_video, args.dump_jpeg, 
+                           args.chunk_size[0], profiler)
         K.clear_session()
 
+    if args.profile[0] is not None:
+        with open(args.profile[0], 'w') as f:
+            json.dump(profiler.summary(), f, indent=4)
+
 '''
     todo: criar excecoes para facilitar o uso
 '''
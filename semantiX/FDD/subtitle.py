@@ -2,8 +2,9 @@ import sys
 import argparse
 import numpy as np
 import h5py
+import feature_store
+import manifest
 import os
-import cv2
 import datetime
 from keras.models import load_model
 ''' Documentation: class Subtitle
@@ -43,10 +44,13 @@ class Subtitle:
 
     def get_dirs(self, data_folder):
 
+        # Folders (and the fps of their videos) come from the manifest of
+        # the dataset, the one streams_fextractor.py uses
+        self.manifest = manifest.Manifest(data_folder, self.classes)
+        self.manifest.scan()
+
         for c in self.classes:
-            self.classes_dirs.append([f for f in os.listdir(data_folder + c) 
-                        if os.path.isdir(os.path.join(data_folder, c, f))])
-            self.classes_dirs[-1].sort()
+            self.classes_dirs.append(list(self.manifest.dirs(c)))
 
             self.classes_videos.append([])
             for f in self.classes_dirs[-1]:
@@ -131,10 +135,10 @@ class Subtitle:
         h5samples = h5py.File(stream + '_samples_' + self.fid + '.h5', 'r')
         h5num = h5py.File(stream + '_num_' + self.fid + '.h5', 'r')
 
-        all_samples = np.asarray(h5samples[self.samples_key])
+        # Stacks [start, end) of every video
+        offsets = feature_store.read_index(h5samples, self.samples_key)['offsets']
         all_num = np.asarray(h5num[self.num_key])
 
-        stack_c = 0
         class_c = 0
         video_c = 0
         all_num = [y for x in all_num for y in x]
@@ -144,19 +148,17 @@ class Subtitle:
             cl = self.classes[class_c]
             for num_video in range(amount_videos):
                 
-                cap = cv2.VideoCapture(list_video[num_video]) 
-                fps = cap.get(cv2.CAP_PROP_FPS) 
+                fps = self.manifest.video(cl + '/' + save_dir[num_video],
+                                          self.ext)['fps']
                 subtitle_c = 0
                 time = 0.0
                 file_write = open(self.data + cl + '/' + save_dir[num_video] +
                         '/' + save_dir[num_video] + '.srt' , 'w')  
 
-                for num_stack in range(stack_c, stack_c + all_samples[video_c+num_video][0]):
+                start, end = offsets[video_c + num_video]
+                for num_stack in range(start, min(end, len(predicted))):
                     subtitle_c += 1
 
-                    if num_stack >= len(predicted):
-                        break
-
                     time += (1 / fps + 0.001)
                     file_write.write("\n")
                     file_write.write("%d\n" % subtitle_c)
@@ -168,12 +170,11 @@ class Subtitle:
                     file_write.write("Output: %d\n" % int(predicted[num_stack]))
                     file_write.write("Truth: %d\n" % Truth[num_stack])
 
-                stack_c += all_samples[video_c + num_video][0]
-                cap.release()
-
             video_c += amount_videos
             class_c += 1
 
+        self.manifest.save()
+
     def pre_result(self, stream):
         self.classifier = load_model(stream + '_classifier_' + self.cid + '.h5')
 
@@ -183,8 +184,8 @@ class Subtitle:
 
         # all_features will contain all the feature vectors extracted from
         # optical flow images
-        self.all_features = h5features[self.features_key]
-        self.all_labels = np.asarray(h5labels[self.labels_key])
+        self.all_features = feature_store.read_features(h5features[self.features_key])
+        self.all_labels = feature_store.read_labels(h5labels[self.labels_key])
 
         predicteds = []
         
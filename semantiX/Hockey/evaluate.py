@@ -10,6 +10,7 @@ import pickle
 from sklearn.externals import joblib
 import numpy as np
 import h5py
+import feature_store
 from sklearn.metrics import confusion_matrix, accuracy_score
 from keras import backend as K
 from keras.layers import Input, Activation, Dense, Dropout
@@ -244,13 +245,13 @@ class Evaluate:
         for stream in streams:
             train_h5features = h5py.File(stream + '_features_' + self.train_id + '.h5', 'r')
             train_h5labels = h5py.File(stream + '_labels_' + self.train_id + '.h5', 'r')
-            X_train = train_h5features[self.features_key]
-            y_train = np.asarray(train_h5labels[self.labels_key])
+            X_train = feature_store.read_features(train_h5features[self.features_key])
+            y_train = feature_store.read_labels(train_h5labels[self.labels_key])
 
             test_h5features = h5py.File(stream + '_features_' + self.test_id + '.h5', 'r')
             test_h5labels = h5py.File(stream + '_labels_' + self.test_id + '.h5', 'r')
-            X_test = test_h5features[self.features_key]
-            y_test = np.asarray(test_h5labels[self.labels_key])
+            X_test = feature_store.read_features(test_h5features[self.features_key])
+            y_test = feature_store.read_labels(test_h5labels[self.labels_key])
 
             # Balance the number of positive and negative samples so that there is the same amount of each of them
             all0 = np.asarray(np.where(y_train==0)[0])
@@ -302,13 +303,13 @@ class Evaluate:
 
             train_h5features = h5py.File(stream + '_features_' + self.train_id + '.h5', 'r')
             train_h5labels = h5py.File(stream + '_labels_' + self.train_id + '.h5', 'r')
-            X_train = train_h5features[self.features_key]
-            y_train = np.asarray(train_h5labels[self.labels_key])
+            X_train = feature_store.read_features(train_h5features[self.features_key])
+            y_train = feature_store.read_labels(train_h5labels[self.labels_key])
 
             test_h5features = h5py.File(stream + '_features_' + self.test_id + '.h5', 'r')
             test_h5labels = h5py.File(stream + '_labels_' + self.test_id + '.h5', 'r')
-            X_test = test_h5features[self.features_key]
-            y_test = np.asarray(test_h5labels[self.labels_key])
+            X_test = feature_store.read_features(test_h5features[self.features_key])
+            y_test = feature_store.read_labels(test_h5labels[self.labels_key])
 
             classifier = load_model(stream + '_classifier_' + self.train_id + '.h5')
 
@@ -501,58 +502,32 @@ class Evaluate:
     def video_random_split(self, stream, train_videos, test_videos):
 
         f = h5py.File(stream + '_features_' + self.train_id + '.h5', 'r')
-        all_f = np.asarray(f[self.features_key])
         s = h5py.File(stream + '_samples_'+ self.train_id + '.h5', 'r')
-        all_s = np.asarray(s[self.samples_key])
         l = h5py.File(stream + '_labels_' + self.train_id + '.h5', 'r')
-        all_l = np.asarray(l[self.labels_key])
-        num = h5py.File(stream + '_num_' + self.train_id + '.h5', 'r')
-        all_num = np.asarray(num[self.num_key])
-        
-        X_train = []
-        X_test = []
-        y_train = []
-        y_test = []
-
-        # For every class
-        c_test = 0
-        c_train = 0
-        
-        for video in range(1, len(all_s)):
-            all_s[video] += all_s[video-1]
-
-        for c in range(len(all_num)):
-
-            # Pass through test_videos from c-th class
-            for video in test_videos[c]:
-                if video != 0:
-                    tam = len(list(range(all_s[video-1][0], all_s[video][0])))
-                    X_test[c_test:c_test+tam] = all_f[all_s[video-1][0]:all_s[video][0]]
-                    y_test[c_test:c_test+tam] = all_l[all_s[video-1][0]:all_s[video][0]]
-                else:
-                    tam = len(list(range(0, all_s[video][0])))
-                    X_test[c_test:c_test+tam] = all_f[0:all_s[video][0]]
-                    y_test[c_test:c_test+tam] = all_l[0:all_s[video][0]]
-                c_test+=tam
-                
-            # Pass through traint_videos from c-th class
-            for video in train_videos[c]:
-                if video != 0:
-                    tam = len(list(range(all_s[video-1][0], all_s[video][0])))
-                    X_train[c_train:c_train+tam] = all_f[all_s[video-1][0]:all_s[video][0]]
-                    y_train[c_train:c_train+tam] = all_l[all_s[video-1][0]:all_s[video][0]]
-                else:
-                    tam = len(list(range(0, all_s[video][0])))
-                    X_train[c_train:c_train+tam] = all_f[0:all_s[video][0]]
-                    y_train[c_train:c_train+tam] = all_l[0:all_s[video][0]]
-                c_train+=tam
 
+        # Rows [start, end) of every video, the features of each set of
+        # videos are read as contiguous slices
+        offsets = feature_store.read_index(s, self.samples_key)['offsets']
+
+        # Videos of every class, one class after the other
+        test = [video for c in range(len(test_videos)) for video in 
+                test_videos[c]]
+        train = [video for c in range(len(train_videos)) for video in 
+                 train_videos[c]]
+
+        X_test = feature_store.read_video_features(f[self.features_key], 
+                                                   offsets, test)
+        y_test = feature_store.read_video_labels(l[self.labels_key], 
+                                                 offsets, test)
+        X_train = feature_store.read_video_features(f[self.features_key], 
+                                                    offsets, train)
+        y_train = feature_store.read_video_labels(l[self.labels_key], 
+                                                  offsets, train)
 
         s.close()
         f.close()
         l.close()
-        num.close()
-        return np.asarray(X_train), np.asarray(X_test), np.asarray(y_train), np.asarray(y_test)
+        return X_train, X_test, y_train, y_test
 
     def evaluate_threshold(self, predicted, _y2):
 
@@ -1,5 +1,6 @@
 import argparse
 import gc
+import json
 import math
 import sys
 import random
@@ -10,6 +11,7 @@ import pickle
 from sklearn.externals import joblib
 import numpy as np
 import h5py
+import feature_store
 from sklearn.metrics import confusion_matrix, accuracy_score, matthews_corrcoef, \
                             classification_report
 from keras import backend as K
@@ -53,7 +55,8 @@ from matplotlib import pyplot as plt
 class Train:
 
     def __init__(self, epochs, learning_rate,
-    classes, weight, mini_batch_size, id, batch_norm, streams, fold_norm, kfold):
+    classes, weight, mini_batch_size, id, batch_norm, streams, fold_norm, kfold,
+    seed=None):
 
         '''
             Necessary parameters to train
@@ -70,6 +73,8 @@ class Train:
         self.num_classes = len(classes)
         self.fold_norm = fold_norm
         self.kfold = kfold
+        # Fixes the folds of the cross-train, None draws new ones every run
+        self.seed = seed
 
         self.id = id
 
@@ -81,6 +86,10 @@ class Train:
         self.mini_batch_size = mini_batch_size
         self.batch_norm = batch_norm
 
+###     Mean and std of the metrics of every strategy, for each combination
+
+        self.results = dict()
+
 ###     Number of streams for each combination
 
         self.num_streams = dict()
@@ -120,21 +129,25 @@ class Train:
         self.mdrs_svm_2 = dict()
         self.accuracies_svm_2 = dict()
 
-    def calc_metrics(self, num_streams, y_test, y_train, test_predicteds,
-                    train_predicteds, key):
+    def average_predicteds(self, num_streams, predicteds, amount):
 
-        avg_predicted = np.zeros(shape=(len(y_test), len(self.classes)), dtype=np.float)
-        train_avg_predicted = np.zeros(shape=(len(y_train), len(self.classes)),  dtype=np.float)
+        # Fusion of the streams: mean of their predictions for each stack
+        avg_predicted = np.zeros(shape=(amount, len(self.classes)), dtype=np.float)
 
-        for j in range(len(y_test)):
+        for j in range(amount):
             for i in range(num_streams):
                 for k in range(len(self.classes)):
-                    avg_predicted[j][k] += (test_predicteds[i][j][k] / num_streams)
+                    avg_predicted[j][k] += (predicteds[i][j][k] / num_streams)
 
-        for j in range(len(y_train)):
-            for i in range(num_streams):
-                for k in range(len(self.classes)):
-                    train_avg_predicted[j][k] += (train_predicteds[i][j][k] / num_streams)
+        return avg_predicted
+
+    def calc_metrics(self, num_streams, y_test, y_train, test_predicteds,
+                    train_predicteds, key):
+
+        avg_predicted = self.average_predicteds(num_streams, test_predicteds,
+                                                len(y_test))
+        train_avg_predicted = self.average_predicteds(num_streams,
+                                        train_predicteds, len(y_train))
 
         test_predicteds = np.asarray(test_predicteds)
         train_predicteds = np.asarray(train_predicteds)
@@ -319,8 +332,7 @@ class Train:
         h5samples_start = h5py.File(self.streams[0] + '_samples_'+ self.id + '.h5', 'r')
         h5num_start = h5py.File(self.streams[0] + '_num_'+ self.id + '.h5', 'r')
 
-        all_features_start = h5features_start[self.features_key]
-        all_labels_start = np.asarray(h5labels_start[self.labels_key])
+        all_labels_start = feature_store.read_labels(h5labels_start[self.labels_key])
         all_samples_start = np.asarray(h5samples_start[self.samples_key])
         all_num_start = np.asarray(h5num_start[self.num_key])
 
@@ -334,7 +346,8 @@ class Train:
         kf = []
         for i in range(len(self.classes)):
             atual = labels_start_index[-1]
-            kf.append(KFold(n_splits=nsplits, shuffle=True))
+            kf.append(KFold(n_splits=nsplits, shuffle=True,
+                            random_state=self.seed))
             labels.append(np.where(all_labels_start==i)[0])
             labels_start_index.append(len(labels[-1]) + atual)
             print("Labels da classe " + self.classes[i]+ " ", end='')
@@ -388,7 +401,7 @@ class Train:
             fold_test_index_label = []
             print("Analisando a classe: " + self.classes[i])
             print("Quantidade de labels: " + str(len(labels[i])))
-            for (a, b) in kf[i].split(all_features_start[labels[i], ...]):
+            for (a, b) in kf[i].split(labels[i]):
                 a = np.asarray(a)
                 b = np.asarray(b)
 
@@ -404,12 +417,12 @@ class Train:
                 print("Analisando a stream " + stream)
                 h5features = h5py.File(stream + '_features_' + self.id + '.h5', 'r')
                 h5labels = h5py.File(stream + '_labels_' + self.id + '.h5', 'r')
-                all_features = h5features[self.features_key]
-                all_labels = np.asarray(h5labels[self.labels_key])
+                all_features = feature_store.read_features(h5features[self.features_key])
+                all_labels = feature_store.read_labels(h5labels[self.labels_key])
 
-                X_train = np.empty(shape=(0, self.num_features), dtype=int)
+                X_train = np.empty(shape=(0, self.num_features), dtype=np.float32)
                 y_train = np.empty(shape=(0,1), dtype=int)
-                X_test = np.empty(shape=(0, self.num_features), dtype=int)
+                X_test = np.empty(shape=(0, self.num_features), dtype=np.float32)
                 y_test = np.empty(shape=(0,1), dtype=int)
                 for i in range(len(self.classes)):
                     X_train = np.concatenate((X_train, all_features[labels[i], ...][all_train_index_label[i][counter], ...]))
@@ -479,13 +492,13 @@ class Train:
             for stream in self.streams:
                 h5features = h5py.File(stream + '_features_' + self.id + '.h5', 'r')
                 h5labels = h5py.File(stream + '_labels_' + self.id + '.h5', 'r')
-                all_features = h5features[self.features_key]
-                all_labels = np.asarray(h5labels[self.labels_key])
+                all_features = feature_store.read_features(h5features[self.features_key])
+                all_labels = feature_store.read_labels(h5labels[self.labels_key])
                 classifier = load_model(stream + '_classifier_' + self.id + '.h5')
 
-                X_train = np.empty(shape=(0, self.num_features), dtype=int)
+                X_train = np.empty(shape=(0, self.num_features), dtype=np.float32)
                 y_train = np.empty(shape=(0, 1), dtype=int)
-                X_test = np.empty(shape=(0, self.num_features), dtype=int)
+                X_test = np.empty(shape=(0, self.num_features), dtype=np.float32)
                 y_test = np.empty(shape=(0, 1), dtype=int)
                 for i in range(len(self.classes)):
                     X_train = np.concatenate((X_train, all_features[labels[i], ...][all_train_index_label[i][counter], ...]))
@@ -636,6 +649,13 @@ class Train:
             self.print_result('3-stream SVM 2', self.sensitivities_svm_2[key], self.specificities_svm_2[key], self.fars_svm_2[key], self.mdrs_svm_2[key], self.accuracies_svm_2[key])
             self.print_result('3-stream BEST', sensitivities_best[key], specificities_best[key], fars_best[key], mdrs_best[key], accuracies_best[key])
 
+            self.results[key] = {
+                'avg': self.summary(self.sensitivities_avg[key], self.specificities_avg[key], self.fars_avg[key], self.mdrs_avg[key], self.accuracies_avg[key]),
+                'avg_svm': self.summary(self.sensitivities_avg_svm[key], self.specificities_avg_svm[key], self.fars_avg_svm[key], self.mdrs_avg_svm[key], self.accuracies_avg_svm[key]),
+                'svm_1': self.summary(self.sensitivities_svm_1[key], self.specificities_svm_1[key], self.fars_svm_1[key], self.mdrs_svm_1[key], self.accuracies_svm_1[key]),
+                'svm_2': self.summary(self.sensitivities_svm_2[key], self.specificities_svm_2[key], self.fars_svm_2[key], self.mdrs_svm_2[key], self.accuracies_svm_2[key]),
+                'best': self.summary(sensitivities_best[key], specificities_best[key], fars_best[key], mdrs_best[key], accuracies_best[key])}
+
         print(''.join(final))
 
     def print_result(self, proc, sensitivities, specificities, fars, mdrs, accuracies):
@@ -647,6 +667,17 @@ class Train:
         print("MDR: %.4f%% (+/- %.4f%%)" % (np.mean(mdrs), np.std(mdrs)))
         print("Accuracy: %.4f%% (+/- %.4f%%)" % (np.mean(accuracies), np.std(accuracies)))
 
+    def summary(self, sensitivities, specificities, fars, mdrs, accuracies):
+
+        # Same values print_result shows, to be saved with -metrics
+        summary = dict()
+        for name, values in [('sensitivity', sensitivities), 
+                             ('specificity', specificities), ('far', fars),
+                             ('mdr', mdrs), ('accuracy', accuracies)]:
+            summary[name] = float(np.mean(values))
+            summary[name + '_std'] = float(np.std(values))
+        return summary
+
     def video_random_generator(self, stream, test_size):
         random.seed(datetime.now())
         s = h5py.File(stream + '_samples_'+ self.id + '.h5', 'r')
@@ -717,58 +748,32 @@ class Train:
     def video_random_split(self, stream, train_videos, test_videos):
 
         f = h5py.File(stream + '_features_' + self.id + '.h5', 'r')
-        all_f = np.asarray(f[self.features_key])
         s = h5py.File(stream + '_samples_'+ self.id + '.h5', 'r')
-        all_s = np.asarray(s[self.samples_key])
         l = h5py.File(stream + '_labels_' + self.id + '.h5', 'r')
-        all_l = np.asarray(l[self.labels_key])
-        num = h5py.File(stream + '_num_' + self.id + '.h5', 'r')
-        all_num = np.asarray(num[self.num_key])
-
-        X_train = []
-        X_test = []
-        y_train = []
-        y_test = []
-
-        # For every class
-        c_test = 0
-        c_train = 0
-
-        for video in range(1, len(all_s)):
-            all_s[video] += all_s[video-1]
-
-        for c in range(len(all_num)):
-
-            # Pass through test_videos from c-th class
-            for video in test_videos[c]:
-                if video != 0:
-                    tam = len(list(range(all_s[video-1][0], all_s[video][0])))
-                    X_test[c_test:c_test+tam] = all_f[all_s[video-1][0]:all_s[video][0]]
-                    y_test[c_test:c_test+tam] = all_l[all_s[video-1][0]:all_s[video][0]]
-                else:
-                    tam = len(list(range(0, all_s[video][0])))
-                    X_test[c_test:c_test+tam] = all_f[0:all_s[video][0]]
-                    y_test[c_test:c_test+tam] = all_l[0:all_s[video][0]]
-                c_test+=tam
-
-            # Pass through traint_videos from c-th class
-            for video in train_videos[c]:
-                if video != 0:
-                    tam = len(list(range(all_s[video-1][0], all_s[video][0])))
-                    X_train[c_train:c_train+tam] = all_f[all_s[video-1][0]:all_s[video][0]]
-                    y_train[c_train:c_train+tam] = all_l[all_s[video-1][0]:all_s[video][0]]
-                else:
-                    tam = len(list(range(0, all_s[video][0])))
-                    X_train[c_train:c_train+tam] = all_f[0:all_s[video][0]]
-                    y_train[c_train:c_train+tam] = all_l[0:all_s[video][0]]
-                c_train+=tam
 
+        # Rows [start, end) of every video, the features of each set of
+        # videos are read as contiguous slices
+        offsets = feature_store.read_index(s, self.samples_key)['offsets']
+
+        # Videos of every class, one class after the other
+        test = [video for c in range(len(test_videos)) for video in 
+                test_videos[c]]
+        train = [video for c in range(len(train_videos)) for video in 
+                 train_videos[c]]
+
+        X_test = feature_store.read_video_features(f[self.features_key], 
+                                                   offsets, test)
+        y_test = feature_store.read_video_labels(l[self.labels_key], 
+                                                 offsets, test)
+        X_train = feature_store.read_video_features(f[self.features_key], 
+                                                    offsets, train)
+        y_train = feature_store.read_video_labels(l[self.labels_key], 
+                                                  offsets, train)
 
         s.close()
         f.close()
         l.close()
-        num.close()
-        return np.asarray(X_train), np.asarray(X_test), np.asarray(y_train), np.asarray(y_test)
+        return X_train, X_test, y_train, y_test
 
     def evaluate_max(self, avg_predicted, y):
 
@@ -978,6 +983,12 @@ if __name__ == '__main__':
         required=False, default='video')
     argp.add_argument("-nsplits", dest='nsplits', type=int, nargs=1,
     help='Usage: -nsplits <K: many splits you want (>1)>', required=False, default=5)
+    argp.add_argument("-seed", dest='seed', type=int, nargs=1,
+        help='Usage: -seed <x> (same folds, and fold normalization, in every run)',
+        required=False, default=[None])
+    argp.add_argument("-metrics", dest='metrics', type=str, nargs=1,
+        help='Usage: -metrics <results_json_file> (mean and std of the metrics of every strategy)',
+        required=False, default=[None])
 
     try:
         args = argp.parse_args()
@@ -988,13 +999,19 @@ if __name__ == '__main__':
     train = Train(args.ep[0], args.lr[0], args.classes,
             args.w0[0], args.mini_batch[0], args.id[0],
             args.batch_norm[0], args.streams, args.fold_norm[0],
-            args.kfold[0])
+            args.kfold[0], args.seed[0])
 
     # Need to sort
     args.streams.sort()
     random.seed(1)
+    if args.seed[0] is not None:
+        np.random.seed(args.seed[0])
     train.real_cross_train(args.nsplits[0])
 
+    if args.metrics[0] is not None:
+        with open(args.metrics[0], 'w') as f:
+            json.dump(train.results, f, indent=4)
+
 '''
     todo: criar excecoes para facilitar o uso
 '''
@@ -10,6 +10,7 @@ import pickle
 from sklearn.externals import joblib
 import numpy as np
 import h5py
+import feature_store
 from sklearn.metrics import confusion_matrix, accuracy_score
 from keras import backend as K
 from keras.layers import Input, Activation, Dense, Dropout
@@ -218,29 +219,29 @@ class Train:
         classes = ['Falls', 'NotFalls']
         for c in classes:
             for cam in cams:
-                tam = len(list(f[c][cam][cam]))
+                tam = f[c][cam][cam].shape[0]
                 if cam == camera:
                     c_test += tam
                 else:
                     c_train += tam
 
-        X_train = np.zeros( shape=(c_train, self.num_features), dtype=np.float64)
+        X_train = np.zeros( shape=(c_train, self.num_features), dtype=np.float32)
         y_train = np.zeros( shape=(c_train, 1), dtype=np.int8)
-        X_test = np.zeros( shape=(c_test, self.num_features), dtype=np.float64)
+        X_test = np.zeros( shape=(c_test, self.num_features), dtype=np.float32)
         y_test = np.zeros( shape=(c_test, 1), dtype=np.int8)
 
         c_test = 0
         c_train = 0
         for c in classes:
             for cam in cams:
-                tam = len(list(f[c][cam][cam]))
+                tam = f[c][cam][cam].shape[0]
                 if cam == camera:
-                    X_test[c_test:c_test + tam].flat = f[c][camera][camera][0:tam]
-                    y_test[c_test:c_test + tam].flat = l[c][camera][camera][0:tam]
+                    X_test[c_test:c_test + tam] = feature_store.read_features(f[c][camera][camera], 0, tam)
+                    y_test[c_test:c_test + tam] = feature_store.read_labels(l[c][camera][camera], 0, tam)
                     c_test += tam
                 else:
-                    X_train[c_train:c_train + tam].flat = f[c][cam][cam][0:tam]
-                    y_train[c_train:c_train + tam].flat = l[c][cam][cam][0:tam]
+                    X_train[c_train:c_train + tam] = feature_store.read_features(f[c][cam][cam], 0, tam)
+                    y_train[c_train:c_train + tam] = feature_store.read_labels(l[c][cam][cam], 0, tam)
                     c_train += tam
         
         f.close()
@@ -594,11 +595,11 @@ class Train:
     def video_random_split(self, stream, train_videos, test_videos):
 
         f = h5py.File(stream + '_features_' + self.id + '.h5', 'r')
-        all_f = np.asarray(f[self.features_key])
+        all_f = feature_store.read_features(f[self.features_key])
         s = h5py.File(stream + '_samples_'+ self.id + '.h5', 'r')
         all_s = np.asarray(s[self.samples_key])
         l = h5py.File(stream + '_labels_' + self.id + '.h5', 'r')
-        all_l = np.asarray(l[self.labels_key])
+        all_l = feature_store.read_labels(l[self.labels_key])
         num = h5py.File(stream + '_num_' + self.id + '.h5', 'r')
         all_num = np.asarray(num[self.num_key])
         
@@ -673,8 +674,8 @@ class Train:
             h5labels = h5py.File(stream + '_labels_' + self.id + '.h5', 'r')
             h5samples = h5py.File(stream + '_samples_' + self.id + '.h5', 'r')
             h5num = h5py.File(stream + '_num_' + self.id + '.h5', 'r')
-            all_features = h5features[self.features_key]
-            all_labels = np.asarray(h5labels[self.labels_key])
+            all_features = feature_store.read_features(h5features[self.features_key])
+            all_labels = feature_store.read_labels(h5labels[self.labels_key])
             all_samples = np.asarray(h5samples[self.samples_key])
             all_num = np.asarray(h5num[self.num_key])
 
@@ -0,0 +1,179 @@
+import json
+import os
+import numpy as np
+
+''' Documentation: feature_store
+
+    Helpers to write and read the hdf5 files produced by streams_fextractor.py.
+
+    Features may be stored as float64 (the original format), float32 or
+    float16. VGG16 computes in float32, so float32 features are identical to
+    the float64 ones at half of the size; float16 halves it again at the cost
+    of some precision. Features are chunked along the sample axis, which
+    makes it possible to compress them with lzf or gzip (with the shuffle
+    filter), and labels are stored as int8.
+
+    Datasets created as resizable can grow when new videos are extracted.
+    Next to them, a json file (<stream>_videos_<id>.json) keeps the registry
+    of the videos already extracted: for each 'class/dir' the amount of
+    frames and the newest mtime of the files the stream reads (or of the
+    video), the first row of its features, its amount of samples and its
+    label.
+
+    create_features
+    create_labels
+    create_index
+    compression_of
+    read_features
+    read_labels
+    read_index
+    read_video_features
+    read_video_labels
+    read_videos
+    write_videos
+
+    The samples file also keeps an index of the videos, in the order of
+    their features: the rows [start, end) of each video ('offsets'), its id
+    'class/dir' ('videos'), its label ('classes') and, when there is one, its
+    camera ('cams'). With it the features of any set of videos are read as a
+    few contiguous slices, instead of walking the samples of every video
+    before them.
+
+    Readers always return float32 features and integer labels, whatever the
+    format of the file is, so old files are still valid. For samples files
+    without an index, read_index computes the offsets from the samples.
+'''
+
+FEATURE_DTYPES = ['float64', 'float32', 'float16']
+COMPRESSIONS = ['none', 'lzf', 'gzip']
+
+# Size, in bytes, of a chunk of consecutive feature vectors
+CHUNK_BYTES = 1 << 20
+
+def create_features(h5file, key, amount, num_features, dtype='float32',
+                    compression='none', resizable=False):
+
+    options = dict()
+    if resizable:
+        options['maxshape'] = (None, num_features)
+
+    # Chunks can't be larger than a fixed size dataset, so an empty one
+    # stays contiguous
+    if amount > 0 or resizable:
+        rows = CHUNK_BYTES // (num_features * np.dtype(dtype).itemsize)
+        if not resizable:
+            rows = min(rows, amount)
+        options['chunks'] = (max(1, rows), num_features)
+
+        if compression == 'lzf':
+            options['compression'] = 'lzf'
+        elif compression == 'gzip':
+            options['compression'] = 'gzip'
+            options['compression_opts'] = 4
+            options['shuffle'] = True
+
+    return h5file.create_dataset(key, shape=(amount, num_features),
+                                 dtype=dtype, **options)
+
+def create_labels(h5file, key, amount, resizable=False):
+
+    if resizable:
+        return h5file.create_dataset(key, shape=(amount, 1), dtype='int8',
+                                     maxshape=(None, 1), chunks=(4096, 1))
+    return h5file.create_dataset(key, shape=(amount, 1), dtype='int8')
+
+def create_index(h5file, keys, samples, classes, cams=None):
+
+    offsets = np.zeros(shape=(len(samples), 2), dtype='int64')
+    offsets[:, 1] = np.cumsum(samples)
+    offsets[1:, 0] = offsets[:-1, 1]
+
+    # Ids are stored as fixed length bytes
+    h5file.create_dataset('offsets', data=offsets)
+    h5file.create_dataset('videos', data=np.asarray([key.encode('utf-8') 
+                          for key in keys], dtype='S'))
+    h5file.create_dataset('classes', data=np.asarray(classes, dtype='int32'))
+    if cams is not None:
+        h5file.create_dataset('cams', data=np.asarray([cam.encode('utf-8') 
+                              for cam in cams], dtype='S'))
+
+def compression_of(dataset):
+
+    # Inverse of create_features, to create a dataset like an existing one
+    if dataset.compression is None:
+        return 'none'
+    return dataset.compression
+
+def read_features(dataset, start=0, end=None):
+
+    # Reading a slice (instead of fancy indexing) decompresses every chunk
+    # only once
+    if end is None:
+        end = dataset.shape[0]
+    return np.asarray(dataset[start:end], dtype=np.float32)
+
+def read_labels(dataset, start=0, end=None):
+
+    if end is None:
+        end = dataset.shape[0]
+    return np.asarray(dataset[start:end]).astype(int)
+
+def read_index(h5file, samples_key='samples'):
+
+    index = dict()
+    if 'offsets' in h5file:
+        index['offsets'] = np.asarray(h5file['offsets'], dtype='int64')
+        index['videos'] = [key.decode('utf-8') for key in h5file['videos']]
+        index['classes'] = np.asarray(h5file['classes']).astype(int)
+    else:
+        samples = np.asarray(h5file[samples_key]).reshape(-1)
+        index['offsets'] = np.zeros(shape=(len(samples), 2), dtype='int64')
+        index['offsets'][:, 1] = np.cumsum(samples)
+        index['offsets'][1:, 0] = index['offsets'][:-1, 1]
+        index['videos'] = None
+        index['classes'] = None
+
+    index['cams'] = None
+    if 'cams' in h5file:
+        index['cams'] = [cam.decode('utf-8') for cam in h5file['cams']]
+    return index
+
+def read_video_rows(dataset, offsets, videos, read):
+
+    # Videos that follow each other in the file are read in a single slice
+    slices = []
+    for video in videos:
+        start, end = offsets[video]
+        if len(slices) > 0 and slices[-1][1] == start:
+            slices[-1][1] = end
+        else:
+            slices.append([start, end])
+
+    if len(slices) == 0:
+        return read(dataset, 0, 0)
+    return np.concatenate([read(dataset, start, end) for start, end in 
+                           slices])
+
+def read_video_features(dataset, offsets, videos):
+
+    # Features of videos (indexes of the index), in the given order
+    return read_video_rows(dataset, offsets, videos, read_features)
+
+def read_video_labels(dataset, offsets, videos):
+
+    return read_video_rows(dataset, offsets, videos, read_labels)
+
+def read_videos(videos_file):
+
+    if not os.path.isfile(videos_file):
+        return dict()
+
+    with open(videos_file) as f:
+        return json.load(f)
+
+def write_videos(videos_file, videos):
+
+    # The registry is replaced at once, a crash never leaves it half written
+    with open(videos_file + '.tmp', 'w') as f:
+        json.dump(videos, f, sort_keys=True)
+    os.replace(videos_file + '.tmp', videos_file)
@@ -4,6 +4,7 @@ from sklearn.model_selection import KFold
 from sklearn.externals import joblib
 import numpy as np
 import h5py
+import feature_store
 from sklearn.metrics import confusion_matrix, accuracy_score
 from sklearn.metrics import confusion_matrix, accuracy_score, matthews_corrcoef, \
                             classification_report
@@ -28,6 +29,7 @@ from matplotlib import pyplot as plt
     This class has a few methods:
 
     pre_result
+    predict
     result
     check_videos
 
@@ -63,17 +65,23 @@ class Result:
 
         # all_features will contain all the feature vectors extracted from
         # optical flow images
-        self.all_features = h5features[self.features_key]
-        self.all_labels = np.asarray(h5labels[self.labels_key])
+        self.all_features = feature_store.read_features(h5features[self.features_key])
+        self.all_labels = feature_store.read_labels(h5labels[self.labels_key])
+
+        predicteds = self.predict(self.all_features)
+
+        return self.all_features, self.all_labels, predicteds
+
+    def predict(self, features):
 
         predicteds = []
         
-        for data in self.all_features:
+        for data in features:
             pred = self.classifier.predict(np.asarray(data.reshape(1, -1)))
             pred = pred.flatten()
             predicteds.append(pred)
 
-        return self.all_features, self.all_labels, np.asarray(predicteds)
+        return np.asarray(predicteds)
 
     def evaluate_max(self, truth, avg_predicted):
 
@@ -172,10 +180,17 @@ class Result:
         h5samples = h5py.File(stream + '_samples_' + self.fid + '.h5', 'r')
         h5num = h5py.File(stream + '_num_' + self.fid + '.h5', 'r')
 
-        all_samples = np.asarray(h5samples[self.samples_key])
+        offsets = feature_store.read_index(h5samples, self.samples_key)['offsets']
         all_num = np.asarray(h5num[self.num_key])
 
-        stack_c = 0
+        # Misses, FP and FN of every video are differences of cumulative sums
+        # over the stacks, stacks without prediction are not counted
+        truth = np.asarray(_y2).reshape(-1)[:len(predicted)]
+        miss = np.asarray(predicted).reshape(-1)[:len(truth)] != truth
+        cum_miss = np.concatenate(([0], np.cumsum(miss)))
+        cum_fn = np.concatenate(([0], np.cumsum(miss & (truth == 0))))
+        ends = np.minimum(offsets, len(truth))
+
         class_c = 0
         video_c = 0
         all_num = [y for x in all_num for y in x]
@@ -184,26 +199,16 @@ class Result:
             message = '###### ' + cl + ' videos ' + str(amount_videos)+' ######' 
             print(message)
             for num_video in range(amount_videos):
-                num_miss = 0
-                FP = 0
-                FN = 0
-
-                for num_stack in range(stack_c, stack_c + all_samples[video_c+num_video][0]):
-                    if num_stack >= len(predicted):
-                        break
-                    elif predicted[num_stack] != _y2[num_stack]:
-                        if _y2[num_stack] == 0:
-                            FN += 1
-                        else:
-                            FP += 1
-                        num_miss+=1
-                    
+                start, end = ends[video_c + num_video]
+                stacks = offsets[video_c + num_video][1] - offsets[video_c + num_video][0]
+                num_miss = cum_miss[end] - cum_miss[start]
+                FN = cum_fn[end] - cum_fn[start]
+                FP = num_miss - FN
+
                 if num_miss == 0:
-                    print("Hit video    %3d  [%5d miss  %5d stacks  %5d FP  %5d FN]" %(num_video+1, num_miss, all_samples[video_c+num_video][0], FP, FN))
+                    print("Hit video    %3d  [%5d miss  %5d stacks  %5d FP  %5d FN]" %(num_video+1, num_miss, stacks, FP, FN))
                 else:
-                    print("Miss video   %3d  [%5d miss  %5d stacks  %5d FP  %5d FN]" %(num_video+1, num_miss, all_samples[video_c+num_video][0], FP, FN))
-
-                stack_c += all_samples[video_c + num_video][0]
+                    print("Miss video   %3d  [%5d miss  %5d stacks  %5d FP  %5d FN]" %(num_video+1, num_miss, stacks, FP, FN))
 
             video_c += amount_videos
             class_c += 1
@@ -176,7 +176,7 @@ if __name__ == '__main__':
         model.save('VGG16_temporal')
 
     if 'pose' in args.streams:
-        model = VGG16(include_top=False)
+        model = VGG16(include_top=False, weights=None)
         
         layers_name = ['block1_conv1', 'block1_conv2', 'block2_conv1', 'block2_conv2', 'block3_conv1', 'block3_conv2', 'block3_conv3', 'block4_conv1', 'block4_conv2', 'block4_conv3', 'block5_conv1', 'block5_conv2', 'block5_conv3']
 
@@ -220,7 +220,7 @@ if __name__ == '__main__':
         model.save('VGG16_pose')
 
     if 'depth' in args.streams:
-        model = VGG16(include_top=False)
+        model = VGG16(include_top=False, weights=None)
 
         layers_name = ['block1_conv1', 'block1_conv2', 'block2_conv1', 'block2_conv2', 'block3_conv1', 'block3_conv2', 'block3_conv3', 'block4_conv1', 'block4_conv2', 'block4_conv3', 'block5_conv1', 'block5_conv2', 'block5_conv3']
 
@@ -264,7 +264,7 @@ if __name__ == '__main__':
         model.save('VGG16_depth')
     
     if 'spatial' in args.streams:
-        model = VGG16(include_top=False)
+        model = VGG16(include_top=False, weights=None)
 
         layers_name = ['block1_conv1', 'block1_conv2', 'block2_conv1', 'block2_conv2', 'block3_conv1', 'block3_conv2', 'block3_conv3', 'block4_conv1', 'block4_conv2', 'block4_conv3', 'block5_conv1', 'block5_conv2', 'block5_conv3']
 
@@ -308,7 +308,7 @@ if __name__ == '__main__':
         model.save('VGG16_spatial')
 
     if 'ritmo' in args.streams:
-        model = VGG16(include_top=False)
+        model = VGG16(include_top=False, weights=None)
 
         layers_name = ['block1_conv1', 'block1_conv2', 'block2_conv1', 'block2_conv2', 'block3_conv1', 'block3_conv2', 'block3_conv3', 'block4_conv1', 'block4_conv2', 'block4_conv3', 'block5_conv1', 'block5_conv2', 'block5_conv3']
 
@@ -352,7 +352,7 @@ if __name__ == '__main__':
         model.save('VGG16_ritmo')
 
     if 'saliency' in args.streams:
-        model = VGG16(include_top=False)
+        model = VGG16(include_top=False, weights=None)
 
         layers_name = ['block1_conv1', 'block1_conv2', 'block2_conv1', 'block2_conv2', 'block3_conv1', 'block3_conv2', 'block3_conv3', 'block4_conv1', 'block4_conv2', 'block4_conv3', 'block5_conv1', 'block5_conv2', 'block5_conv3']
 